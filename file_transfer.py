@@ -7,6 +7,8 @@ file_transfer.py - upload, download and generic file copy
 
 import os
 
+import ftp_error
+
 
 #TODO Think a bit more about the API before making it public.
 # # Only `chunks` should be used by clients of the ftputil library. Any
@@ -17,6 +19,24 @@ __all__ = []
 # Maximum size of chunk in `FTPHost.copyfileobj` in bytes.
 MAX_COPY_CHUNK_SIZE = 64 * 1024
 
+# `bytearray` is new in Python 2.6.
+try:
+    bytearray
+except NameError:
+    bytearray = None
+
+
+def _resume_mode(mode, rest):
+    """
+    Return a tuple `(mode, rest)` for opening a file to resume a
+    transfer. Reading starts at the offset `rest`, writing appends
+    to the file, which has `rest` bytes then. If `rest` is `None`,
+    return the arguments unchanged.
+    """
+    if (rest is None) or ('r' in mode):
+        return mode, rest
+    return mode.replace('w', 'a'), None
+
 
 class LocalFile(object):
     """
@@ -45,9 +65,27 @@ class LocalFile(object):
         #  at least precise up to a second.
         return 1.0
 
-    def fobj(self):
-        """Return a file object for the name/path in the constructor."""
-        return open(self.name, self.mode)
+    def size(self):
+        """Return the size of the file in bytes."""
+        return os.path.getsize(self.name)
+
+    def changed(self):
+        """
+        Note that a transfer may have changed the file. Local files
+        aren't cached, so do nothing.
+        """
+        pass
+
+    def fobj(self, rest=None):
+        """
+        Return a file object for the name/path in the constructor. See
+        `_resume_mode` for `rest`.
+        """
+        mode, rest = _resume_mode(self.mode, rest)
+        fobj = open(self.name, mode)
+        if rest:
+            fobj.seek(rest)
+        return fobj
 
 
 class RemoteFile(object):
@@ -70,19 +108,40 @@ class RemoteFile(object):
         return self._path.exists(self.name)
 
     def mtime(self):
-        """Return the timestamp for the last modification in seconds."""
+        """
+        Return the timestamp for the last modification in seconds or
+        `None` if the server doesn't tell the modification time.
+        """
+        st_mtime = self._path.getmtime(self.name)
+        if st_mtime is None:
+            return None
         # Convert to client time zone (see definition of time
         #  shift in docstring of `FTPHost.set_time_shift`).
-        return self._path.getmtime(self.name) - self._host.time_shift()
+        return st_mtime - self._host.time_shift()
 
     def mtime_precision(self):
         """Return the precision of the last modification time in seconds."""
         # I think using `stat` instead of `lstat` makes more sense here.
         return self._host.stat(self.name)._st_mtime_precision
 
-    def fobj(self):
-        """Return a file object for the name/path in the constructor."""
-        return self._host.file(self.name, self.mode)
+    def size(self):
+        """Return the size of the file in bytes."""
+        return self._path.getsize(self.name)
+
+    def changed(self):
+        """
+        Note that a transfer may have changed the file, so that the
+        next `size` call doesn't use a cached stat result.
+        """
+        self._host._stat.invalidate_lstat(self.name)
+
+    def fobj(self, rest=None):
+        """
+        Return a file object for the name/path in the constructor. See
+        `_resume_mode` for `rest`.
+        """
+        mode, rest = _resume_mode(self.mode, rest)
+        return self._host.file(self.name, mode, rest)
 
 
 def source_is_newer_than_target(source_file, target_file):
@@ -94,10 +153,13 @@ def source_is_newer_than_target(source_file, target_file):
     For the purpose of this test the source is newer than the
     target, if the target modification datetime plus its precision
     is before the source precision. In other words: If in doubt,
-    the file should be transferred.
+    the file should be transferred. This includes the case that
+    the modification time of the source or target is unknown.
     """
-    return source_file.mtime() + source_file.mtime_precision() >= \
-           target_file.mtime()
+    source_mtime, target_mtime = source_file.mtime(), target_file.mtime()
+    if source_mtime is None or target_mtime is None:
+        return True
+    return source_mtime + source_file.mtime_precision() >= target_mtime
 
 
 def chunks(fobj, max_chunk_size=MAX_COPY_CHUNK_SIZE):
@@ -118,18 +180,52 @@ def chunks(fobj, max_chunk_size=MAX_COPY_CHUNK_SIZE):
         yield chunk
 
 
+def _writes_buffers(fobj):
+    """
+    Return `True` if the `write` method of the file object `fobj`
+    accepts `buffer` objects, else `False`.
+    """
+    # `_FTPFile` objects convert line endings in text mode, which
+    #  needs strings.
+    return isinstance(fobj, file) or getattr(fobj, '_bin_mode', False)
+
+
+def _copy_with_buffer(source_fobj, target_fobj, max_chunk_size):
+    """
+    Copy data from `source_fobj`, which must have a `readinto`
+    method, to `target_fobj`, reusing one buffer for all chunks.
+    """
+    buffer_ = bytearray(max_chunk_size)
+    readinto, write = source_fobj.readinto, target_fobj.write
+    while True:
+        byte_count = readinto(buffer_)
+        if not byte_count:
+            break
+        write(buffer(buffer_, 0, byte_count))
+
+
 def copyfileobj(source_fobj, target_fobj, max_chunk_size=MAX_COPY_CHUNK_SIZE,
                 callback=None):
     """Copy data from file-like object source to file-like object target."""
     # Inspired by `shutil.copyfileobj` (I don't use the `shutil`
     #  code directly because it might change)
+    #
+    # If possible, avoid a new string for each chunk by reading into
+    #  a reused buffer (see `sandbox/copy_benchmark.py`). Callbacks
+    #  expect strings, and the data connections of `_FTPFile` objects
+    #  have no `readinto`, so downloads use `chunks`.
+    if (callback is None) and (bytearray is not None) and \
+       hasattr(source_fobj, 'readinto') and _writes_buffers(target_fobj):
+        _copy_with_buffer(source_fobj, target_fobj, max_chunk_size)
+        return
     for chunk in chunks(source_fobj, max_chunk_size):
         target_fobj.write(chunk)
         if callback is not None:
             callback(chunk)
 
 
-def copy_file(source_file, target_file, conditional, callback):
+def copy_file(source_file, target_file, conditional, callback,
+              resume=False, verify=False):
     """
     Copy a file from `source_file` to `target_file`.
 
@@ -140,7 +236,27 @@ def copy_file(source_file, target_file, conditional, callback):
     source. If `conditional` is false, the file is copied
     unconditionally. Return `True` if the file was copied, else
     `False`.
+
+    If `resume` is true and the target is smaller than the source,
+    assume it's the beginning of the source left by an interrupted
+    transfer and only copy the rest of the source. If the sizes are
+    equal, don't copy anything. If `verify` is true, raise an
+    `FTPIOError` if the sizes differ after the transfer. Both
+    options require binary mode.
     """
+    if (resume or verify) and ('b' not in source_file.mode):
+        raise ValueError("resume and verify require binary mode")
+    rest = None
+    if resume:
+        # An interrupted transfer may have changed the target.
+        target_file.changed()
+    if resume and target_file.exists():
+        source_size, target_size = source_file.size(), target_file.size()
+        if target_size == source_size:
+            # Nothing left to transfer
+            return False
+        elif 0 < target_size < source_size:
+            rest = target_size
     if conditional:
         # Evaluate condition: The target file either doesn't exist or is
         #  older than the source file. If in doubt (due to imprecise
@@ -150,15 +266,30 @@ def copy_file(source_file, target_file, conditional, callback):
         if not transfer_condition:
             # We didn't transfer.
             return False
-    source_fobj = source_file.fobj()
+    source_fobj = source_file.fobj(rest)
     try:
-        target_fobj = target_file.fobj()
+        target_fobj = target_file.fobj(rest)
         try:
             copyfileobj(source_fobj, target_fobj, callback=callback)
         finally:
             target_fobj.close()
     finally:
         source_fobj.close()
+    target_file.changed()
+    if verify:
+        verify_sizes(source_file, target_file)
     # Transfer accomplished
     return True
 
+
+def verify_sizes(source_file, target_file):
+    """
+    Raise an `FTPIOError` if the sizes of `source_file` and
+    `target_file` differ after a transfer.
+    """
+    source_size, target_size = source_file.size(), target_file.size()
+    if source_size != target_size:
+        raise ftp_error.FTPIOError("size of '%s' is %d after transfer "
+              "from '%s', expected %d" % (target_file.name, target_size,
+                                          source_file.name, source_size))
+
@@ -0,0 +1,569 @@
+# Copyright (C) 2010, Stefan Schwarzer <sschwarzer@sschwarzer.net>
+# See the file LICENSE for licensing terms.
+
+"""
+ftp_batch.py - concurrent transfers and directory listings
+"""
+
+import Queue
+import sys
+import threading
+
+import file_transfer
+import ftp_error
+
+
+# This module shouldn't be used by clients of the ftputil library.
+#  Batch transfers are started with `FTPHost.upload_many` and
+#  `FTPHost.download_many`, segmented downloads with
+#  `FTPHost.download`, concurrent listings with
+#  `FTPHost.walk_parallel`.
+__all__ = []
+
+# Default number of concurrent transfers (and sessions)
+DEFAULT_MAX_WORKERS = 4
+
+# Default minimum size of the byte ranges of a segmented download;
+#  smaller files are downloaded over one connection.
+MIN_SEGMENT_SIZE = 1024 * 1024
+
+
+class WorkerRemoteFile(file_transfer.RemoteFile):
+    """
+    Like `RemoteFile`, but transfer the file over the session of the
+    worker host itself instead of a child session. This way, each
+    worker needs only one connection.
+    """
+
+    def fobj(self, rest=None):
+        """
+        Return a file object for the name/path in the constructor. See
+        `file_transfer._resume_mode` for `rest`.
+        """
+        mode, rest = file_transfer._resume_mode(self.mode, rest)
+        return self._host._open_in_own_session(self.name, mode, rest)
+
+
+def _work(host, jobs, results, make_files, conditional):
+    """
+    Make a worker host from `host` and process jobs from the queue
+    `jobs` until it's empty. For each job, put a tuple
+    `(index, copied, exception)` into the queue `results`.
+
+    If the worker can't log in, put `(None, None, exception)` into
+    `results` and stop.
+    """
+    # Don't complain about lazy except clauses; all exceptions are
+    #  passed to the calling thread.
+    # pylint: disable=W0702
+    if jobs.empty():
+        # Don't log in if the other workers already took all the jobs.
+        return
+    try:
+        worker = host._make_worker()
+    except:
+        results.put((None, None, sys.exc_info()[1]))
+        return
+    try:
+        while True:
+            try:
+                index, source, target = jobs.get_nowait()
+            except Queue.Empty:
+                break
+            try:
+                source_file, target_file = make_files(worker, source, target)
+                copied = file_transfer.copy_file(source_file, target_file,
+                           conditional=conditional, callback=None)
+            except:
+                results.put((index, None, sys.exc_info()[1]))
+            else:
+                results.put((index, copied, None))
+    finally:
+        # Don't complain about lazy except clause
+        # pylint: disable=W0704
+        try:
+            worker.close()
+        except ftp_error.FTPError:
+            pass
+
+
+def copy_files(host, pairs, make_files, conditional=False,
+               max_workers=DEFAULT_MAX_WORKERS, callback=None,
+               on_copied=None):
+    """
+    Copy the files in `pairs`, a sequence of `(source, target)` path
+    pairs, over at most `max_workers` concurrent sessions. The
+    sessions are made from the `FTPHost` object `host`.
+
+    `make_files` is called in the worker threads with the worker
+    host, the source path and the target path and must return the
+    `LocalFile` and `RemoteFile` objects for `file_transfer.copy_file`.
+    If `conditional` is true, a file is only copied if the target
+    doesn't exist or is older than the source.
+
+    `callback` and `on_copied` are called in the calling thread with
+    the source path, the target path and a flag which is true if the
+    file was actually copied. `callback` is given by the client while
+    `on_copied` lets `FTPHost` update its caches.
+
+    Return a list of the copied `(source, target)` pairs in the order
+    of `pairs`. If any transfers failed, raise `BatchTransferError`
+    after all other transfers are done.
+    """
+    pairs = list(pairs)
+    if not pairs:
+        return []
+    if max_workers < 1:
+        raise ValueError("max_workers must be at least 1, not %r" %
+                         max_workers)
+    jobs, results = Queue.Queue(), Queue.Queue()
+    for index, (source, target) in enumerate(pairs):
+        jobs.put((index, source, target))
+    worker_count = min(max_workers, len(pairs))
+    threads = []
+    for ignored in range(worker_count):
+        thread = threading.Thread(target=_work, args=(host, jobs, results,
+                                                      make_files, conditional))
+        thread.setDaemon(True)
+        thread.start()
+        threads.append(thread)
+    copied_flags = [False] * len(pairs)
+    errors = []
+    done, failed_workers = 0, 0
+    while done < len(pairs):
+        index, copied, exc = results.get()
+        if index is None:
+            # A worker couldn't log in.
+            failed_workers += 1
+            if failed_workers < worker_count:
+                continue
+            # No worker left; fail the remaining jobs.
+            while True:
+                try:
+                    index, source, target = jobs.get_nowait()
+                except Queue.Empty:
+                    break
+                errors.append((index, source, target, exc))
+                done += 1
+            continue
+        done += 1
+        source, target = pairs[index]
+        if exc is not None:
+            errors.append((index, source, target, exc))
+            continue
+        copied_flags[index] = copied
+        if on_copied is not None:
+            on_copied(source, target, copied)
+        if callback is not None:
+            callback(source, target, copied)
+    # Wait until the workers have closed their sessions.
+    for thread in threads:
+        thread.join()
+    copied_pairs = [pair for pair, copied in zip(pairs, copied_flags)
+                    if copied]
+    if errors:
+        errors.sort()
+        errors = [(source, target, exc) for index, source, target, exc
+                  in errors]
+        raise ftp_error.BatchTransferError(errors, copied_pairs)
+    return copied_pairs
+
+
+def _check_segment_arguments(segments, segment_size):
+    """
+    Raise a `ValueError` if `segments` or `segment_size` (unless it's
+    `None`) isn't a positive number.
+    """
+    if segments < 1:
+        raise ValueError("segments must be at least 1, not %r" % segments)
+    if (segment_size is not None) and (segment_size < 1):
+        raise ValueError("segment_size must be at least 1, not %r" %
+                         segment_size)
+
+
+def _segment_ranges(size, segments, segment_size):
+    """
+    Return a list of `(start, length)` tuples for the byte ranges of a
+    file of `size` bytes. If `segment_size` is `None`, divide the file
+    into `segments` ranges, but not smaller than `MIN_SEGMENT_SIZE`.
+    """
+    if segment_size is None:
+        segment_size = max((size + segments - 1) // segments,
+                           MIN_SEGMENT_SIZE)
+    return [(start, min(segment_size, size - start))
+            for start in range(0, size, segment_size)]
+
+
+def _copy_segment(source_fobj, target_fobj, start, length, results,
+                  stopped, put_chunks):
+    """
+    Copy `length` bytes from the file object `source_fobj`, which
+    starts at the offset `start` of the source file, to the same
+    offset of the local file object `target_fobj`. If `put_chunks`
+    is true, put a tuple `("chunk", chunk)` into the queue `results`
+    for each chunk. Return early if the event `stopped` is set.
+    """
+    target_fobj.seek(start)
+    remaining = length
+    while remaining and not stopped.isSet():
+        chunk = source_fobj.read(min(remaining,
+                                     file_transfer.MAX_COPY_CHUNK_SIZE))
+        if not chunk:
+            raise ftp_error.FTPIOError("source file ended %d bytes before "
+                                       "the end of the segment at offset %d" %
+                                       (remaining, start))
+        target_fobj.write(chunk)
+        remaining -= len(chunk)
+        if put_chunks:
+            results.put(("chunk", chunk))
+
+
+def _download_segments(source_file, target_name, jobs, results, stopped,
+                       open_lock, put_chunks):
+    """
+    Download the byte ranges from the queue `jobs`, each of them a
+    tuple `(start, length, source_fobj)`, until it's empty. If
+    `source_fobj` is `None`, open the `RemoteFile` `source_file` at
+    `start` while holding the lock `open_lock`. The data is written
+    into the local file `target_name`.
+
+    If `put_chunks` is true, put `("chunk", chunk)` into the queue
+    `results` after each chunk. At the end, put `("done", exc_info)`,
+    where `exc_info` is `None` or the `sys.exc_info()` of an error.
+    """
+    # Don't complain about lazy except clause; all exceptions are
+    #  passed to the calling thread.
+    # pylint: disable=W0702
+    try:
+        target_fobj = open(target_name, 'r+b')
+        try:
+            while not stopped.isSet():
+                try:
+                    start, length, source_fobj = jobs.get_nowait()
+                except Queue.Empty:
+                    break
+                if source_fobj is None:
+                    # The child pool regards a child whose file is
+                    #  closed as unused, so another thread must not
+                    #  get a child before the file has been opened.
+                    open_lock.acquire()
+                    try:
+                        source_fobj = source_file.fobj(start or None)
+                    finally:
+                        open_lock.release()
+                # Closing the file before the end of the remote file
+                #  aborts the transfer.
+                try:
+                    _copy_segment(source_fobj, target_fobj, start, length,
+                                  results, stopped, put_chunks)
+                finally:
+                    source_fobj.close()
+        finally:
+            target_fobj.close()
+    except:
+        stopped.set()
+        results.put(("done", sys.exc_info()))
+    else:
+        results.put(("done", None))
+
+
+def download_segmented(source_file, target_file, segments, segment_size=None,
+                       callback=None, verify=False):
+    """
+    Download the `RemoteFile` `source_file` to the `LocalFile`
+    `target_file` (both in binary mode) in byte ranges of
+    `segment_size` bytes over up to `segments` concurrent child
+    sessions. See `_segment_ranges` for the default segment size.
+
+    Each range is fetched with `REST` and `RETR`; the transfer is
+    aborted at the end of the range. The ranges are written into the
+    preallocated local file at their offsets. If the file has only
+    one range or the server doesn't support `REST`, download the
+    file over one connection with `file_transfer.copy_file`.
+
+    `callback` is called in the calling thread with each chunk, but
+    the chunks come in no particular order. See `copy_file` for
+    `verify`.
+    """
+    _check_segment_arguments(segments, segment_size)
+    if 'b' not in source_file.mode:
+        raise ValueError("segmented downloads require binary mode")
+    ranges = _segment_ranges(source_file.size(), segments, segment_size)
+    if (segments == 1) or (len(ranges) < 2):
+        return file_transfer.copy_file(source_file, target_file,
+                                       conditional=False, callback=callback,
+                                       verify=verify)
+    # Check that the server supports `REST` before making the target
+    #  file. Use the file object for the range.
+    start, length = ranges[1]
+    try:
+        source_fobj = source_file.fobj(start)
+    except ftp_error.FTPIOError:
+        return file_transfer.copy_file(source_file, target_file,
+                                       conditional=False, callback=callback,
+                                       verify=verify)
+    jobs, results = Queue.Queue(), Queue.Queue()
+    jobs.put((start, length, source_fobj))
+    for start, length in ranges[:1] + ranges[2:]:
+        jobs.put((start, length, None))
+    # Preallocate the target file, so that the threads can write at
+    #  any offset.
+    try:
+        target_fobj = open(target_file.name, 'wb')
+        try:
+            target_fobj.truncate(ranges[-1][0] + ranges[-1][1])
+        finally:
+            target_fobj.close()
+    # Don't complain about lazy except clause
+    # pylint: disable=W0702
+    except:
+        source_fobj.close()
+        raise
+    stopped = threading.Event()
+    open_lock = threading.Lock()
+    threads = []
+    for ignored in range(min(segments, len(ranges))):
+        thread = threading.Thread(target=_download_segments,
+                                  args=(source_file, target_file.name, jobs,
+                                        results, stopped, open_lock,
+                                        callback is not None))
+        thread.setDaemon(True)
+        thread.start()
+        threads.append(thread)
+    first_exc_info = None
+    done = 0
+    try:
+        while done < len(threads):
+            kind, value = results.get()
+            if kind == "chunk":
+                callback(value)
+            else:
+                done += 1
+                if (value is not None) and (first_exc_info is None):
+                    first_exc_info = value
+    finally:
+        # For example, the callback raised an exception.
+        stopped.set()
+        for thread in threads:
+            thread.join()
+        # Abort the transfer of the first range if it wasn't started.
+        while True:
+            try:
+                start, length, source_fobj = jobs.get_nowait()
+            except Queue.Empty:
+                break
+            if source_fobj is not None:
+                source_fobj.close()
+    if first_exc_info is not None:
+        raise first_exc_info[0], first_exc_info[1], first_exc_info[2]
+    if verify:
+        file_transfer.verify_sizes(source_file, target_file)
+    return True
+
+
+def _list_dirs(host, jobs, results):
+    """
+    Make a worker host from `host` and fetch the listings of the
+    absolute directory paths from the queue `jobs` until it yields
+    `None`. For each path, put a tuple `(path, lines, exception)`
+    into the queue `results`.
+
+    If the worker can't log in, put `(None, None, exception)` into
+    `results` and stop.
+    """
+    # Don't complain about lazy except clauses; all exceptions are
+    #  passed to the calling thread.
+    # pylint: disable=W0702
+    try:
+        worker = host._make_worker()
+    except:
+        results.put((None, None, sys.exc_info()[1]))
+        return
+    try:
+        while True:
+            path = jobs.get()
+            if path is None:
+                break
+            try:
+                lines = worker._stat._host_dir(path)
+            except:
+                results.put((path, None, sys.exc_info()[1]))
+            else:
+                results.put((path, lines, None))
+    finally:
+        # Don't complain about lazy except clause
+        # pylint: disable=W0704
+        try:
+            worker.close()
+        except ftp_error.FTPError:
+            pass
+
+
+class ListingPool(object):
+    """
+    Fetch directory listings concurrently over at most `max_workers`
+    sessions made from the `FTPHost` object `host`. The sessions are
+    only made when needed.
+
+    The threads which fetch the listings don't refer to the pool, so
+    if the pool is garbage-collected, for example because a walk was
+    stopped early, the threads end and close their sessions.
+    """
+
+    def __init__(self, host, max_workers):
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1, not %r" %
+                             max_workers)
+        self._host = host
+        self._max_workers = max_workers
+        self._jobs = Queue.Queue()
+        self._results = Queue.Queue()
+        self._threads = []
+        self._failed_workers = 0
+        # Number of paths whose listings haven't been returned by
+        #  `get` yet
+        self.pending = 0
+
+    def submit(self, path):
+        """Request the listing of the absolute directory `path`."""
+        self.pending += 1
+        if len(self._threads) < min(self._max_workers, self.pending):
+            thread = threading.Thread(target=_list_dirs,
+                       args=(self._host, self._jobs, self._results))
+            thread.setDaemon(True)
+            thread.start()
+            self._threads.append(thread)
+        self._jobs.put(path)
+
+    def get(self):
+        """
+        Wait for a requested listing and return a tuple `(path, lines,
+        exception)`. If the listing could be fetched, `exception` is
+        `None`, else `lines` is `None`.
+
+        If no worker could log in, fetch the listing with the session
+        of `host`.
+        """
+        while True:
+            if self._failed_workers == len(self._threads):
+                # No worker left; do the work ourselves.
+                path = self._jobs.get_nowait()
+                self.pending -= 1
+                try:
+                    return path, self._host._stat._host_dir(path), None
+                except ftp_error.FTPOSError, exc:
+                    return path, None, exc
+            path, lines, exc = self._results.get()
+            if path is None:
+                self._failed_workers += 1
+                continue
+            self.pending -= 1
+            return path, lines, exc
+
+    def _stop(self):
+        """Tell the threads to stop after their current listing."""
+        for thread in self._threads:
+            self._jobs.put(None)
+        threads, self._threads = self._threads, []
+        return threads
+
+    def close(self):
+        """Stop the threads and wait until they closed their sessions."""
+        for thread in self._stop():
+            thread.join()
+
+    # Don't wait for the threads during garbage collection.
+    __del__ = _stop
+
+
+def walk(host, top, max_workers=DEFAULT_MAX_WORKERS, ordered=False,
+         onerror=None):
+    """
+    Iterate over the directory tree `top` on `host` like
+    `FTPHost.walk` with `topdown=True`, but fetch the listings of
+    the subdirectories concurrently with a `ListingPool`.
+
+    The listings are parsed and stored in the caches of `host` in
+    the calling thread. The subdirectories of a directory are only
+    requested after the directory has been yielded, so the caller
+    can prune the directory names as with `os.walk`.
+
+    If `ordered` is true, yield the directories in the same order as
+    `FTPHost.walk`, else in the order their listings arrive.
+    """
+    # The first listing is fetched in the calling thread, which also
+    #  checks that `top` is a directory.
+    try:
+        listing = host._stat.listing(top)
+    except ftp_error.FTPOSError, err:
+        if onerror is not None:
+            onerror(err)
+        return
+    path = host.path
+    pool = ListingPool(host, max_workers)
+    # Map absolute paths of requested listings to the paths as they
+    #  should be yielded.
+    requested = {}
+    # Received listings, keyed by absolute path; the values are parsed
+    #  listings or exceptions.
+    received = {}
+    # Absolute paths in the order the listings were received
+    arrivals = []
+    # Absolute paths of the directories still to be yielded; used as
+    #  a stack for ordered walks
+    abs_top = path.abspath(top)
+    waiting = [abs_top]
+    requested[abs_top] = top
+    received[abs_top] = listing
+    arrivals.append(abs_top)
+    while waiting:
+        if ordered:
+            abs_dirpath = waiting.pop()
+            while abs_dirpath not in received:
+                _receive(host, pool, received, arrivals)
+            arrivals.remove(abs_dirpath)
+        else:
+            while not arrivals:
+                _receive(host, pool, received, arrivals)
+            abs_dirpath = arrivals.pop(0)
+            waiting.remove(abs_dirpath)
+        dirpath = requested.pop(abs_dirpath)
+        listing = received.pop(abs_dirpath)
+        if isinstance(listing, Exception):
+            if onerror is not None:
+                onerror(listing)
+            continue
+        # Classify the items with the stat results from the listing,
+        #  so that only links need further lookups.
+        dirs, nondirs, links = host._classify_listing(abs_dirpath, listing)
+        yield dirpath, dirs, nondirs
+        # Don't follow links to directories, like `FTPHost.walk`.
+        abs_subdirs = []
+        for name in dirs:
+            if name in links:
+                continue
+            abs_subdir = path.join(abs_dirpath, name)
+            requested[abs_subdir] = path.join(dirpath, name)
+            pool.submit(abs_subdir)
+            abs_subdirs.append(abs_subdir)
+        # Reverse the order so that the stack yields the first
+        #  subdirectory first.
+        abs_subdirs.reverse()
+        waiting.extend(abs_subdirs)
+    pool.close()
+
+
+def _receive(host, pool, received, arrivals):
+    """
+    Wait for a listing from `pool`, parse it and store it (or the
+    exception which occurred instead) in `received`. Append the path
+    to `arrivals`.
+    """
+    abs_path, lines, exc = pool.get()
+    if exc is None:
+        received[abs_path] = host._stat.add_listing(abs_path, lines)
+    elif isinstance(exc, ftp_error.FTPOSError):
+        received[abs_path] = exc
+    else:
+        raise exc
+    arrivals.append(abs_path)
@@ -0,0 +1,185 @@
+# Copyright (C) 2010, Stefan Schwarzer <sschwarzer@sschwarzer.net>
+# See the file LICENSE for licensing terms.
+
+"""
+ftp_cache_backend.py - persistent storage for the stat and listing caches
+
+A backend is attached to an `FTPHost` object with its method
+`set_cache_backend`. Afterwards, the caches of the host write their
+entries through to the backend and, if they don't have an entry in
+memory, look it up in the backend. So a new `FTPHost` object, even in
+another process, can use the stat results and listings stored
+by an earlier one.
+"""
+
+import cPickle
+import threading
+
+
+__all__ = ['CacheBackend', 'SqliteCacheBackend']
+
+
+class CacheBackend(object):
+    """
+    Base class for persistent cache backends.
+
+    Entries are identified by a namespace string, which distinguishes
+    servers, logins and the kind of the cache, and an absolute path.
+    The values are `StatResult` or listing objects, which can be
+    pickled.
+    """
+
+    def load(self, namespace, path):
+        """
+        Return a tuple `(timestamp, value)` for the entry or `None`
+        if there's no usable entry. `timestamp` is the time (in
+        seconds since the epoch) the entry was stored.
+        """
+        raise NotImplementedError("must be defined by subclass")
+
+    def store(self, namespace, path, timestamp, value):
+        """Store the entry, replacing an existing one."""
+        raise NotImplementedError("must be defined by subclass")
+
+    def delete(self, namespace, path):
+        """Delete the entry if it exists."""
+        raise NotImplementedError("must be defined by subclass")
+
+    def delete_tree(self, namespace, path):
+        """
+        Delete the entries for `path` and all paths below it, if
+        they exist.
+        """
+        raise NotImplementedError("must be defined by subclass")
+
+    def clear(self, namespace):
+        """Delete all entries in the namespace."""
+        raise NotImplementedError("must be defined by subclass")
+
+    def flush(self):
+        """Make changes persistent. The default does nothing."""
+        pass
+
+    def close(self):
+        """Flush changes and release resources."""
+        self.flush()
+
+
+class SqliteCacheBackend(CacheBackend):
+    """
+    Cache backend which stores the entries in an SQLite database
+    file. This needs the `sqlite3` module of Python 2.5 or later.
+
+    To avoid a disk synchronization for each cache entry, changes are
+    committed only every `commit_interval` changes, when `flush` or
+    `close` is called and when an `FTPHost` object using the backend
+    is closed. The same database file may be used by several
+    processes, and the backend object by several threads, e. g. with
+    shared caches (see `FTPHost.share_caches`).
+    """
+
+    # Version of the database layout and the stored values; increase
+    #  this if a change of ftputil makes stored entries unusable.
+    #  Tables written with another version are emptied.
+    _FORMAT_VERSION = 1
+
+    def __init__(self, filename, commit_interval=1000):
+        # Only import `sqlite3` if the backend is used.
+        import sqlite3
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        # Reentrant because `store` and `delete` may call `flush`.
+        self._lock = threading.RLock()
+        # Store the pickled values as `str`, not as `buffer`.
+        self._connection.text_factory = str
+        self.commit_interval = commit_interval
+        # Number of changes since the last commit
+        self._changes = 0
+        self._check_format()
+
+    def _check_format(self):
+        """Create the tables or empty them if they're outdated."""
+        execute = self._connection.execute
+        execute("CREATE TABLE IF NOT EXISTS format (version INTEGER)")
+        execute("CREATE TABLE IF NOT EXISTS entries "
+                "(namespace TEXT, path TEXT, timestamp REAL, value BLOB, "
+                "PRIMARY KEY (namespace, path))")
+        versions = [row[0] for row in execute("SELECT version FROM format")]
+        if versions != [self._FORMAT_VERSION]:
+            execute("DELETE FROM entries")
+            execute("DELETE FROM format")
+            execute("INSERT INTO format VALUES (?)", (self._FORMAT_VERSION,))
+        self._connection.commit()
+
+    def _changed(self):
+        """Count a change and commit if necessary."""
+        self._changes += 1
+        if self._changes >= self.commit_interval:
+            self.flush()
+
+    def load(self, namespace, path):
+        self._lock.acquire()
+        try:
+            row = self._connection.execute(
+                    "SELECT timestamp, value FROM entries "
+                    "WHERE namespace = ? AND path = ?",
+                    (namespace, path)).fetchone()
+        finally:
+            self._lock.release()
+        if row is None:
+            return None
+        timestamp, pickled_value = row
+        try:
+            return timestamp, cPickle.loads(pickled_value)
+        # Don't complain about lazy except clause
+        # pylint: disable=W0702
+        except:
+            # Treat an unusable entry as a missing one.
+            self.delete(namespace, path)
+            return None
+
+    def store(self, namespace, path, timestamp, value):
+        pickled_value = cPickle.dumps(value, 2)
+        self._execute_change(
+          "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+          (namespace, path, timestamp, pickled_value))
+
+    def delete(self, namespace, path):
+        self._execute_change(
+          "DELETE FROM entries WHERE namespace = ? AND path = ?",
+          (namespace, path))
+
+    def delete_tree(self, namespace, path):
+        prefix = path.rstrip('/') + '/'
+        self._execute_change(
+          "DELETE FROM entries WHERE namespace = ? AND "
+          "(path = ? OR substr(path, 1, ?) = ?)",
+          (namespace, path, len(prefix), prefix))
+
+    def clear(self, namespace):
+        self._execute_change("DELETE FROM entries WHERE namespace = ?",
+                             (namespace,))
+
+    def _execute_change(self, statement, parameters):
+        """Execute an SQL statement which changes the database."""
+        self._lock.acquire()
+        try:
+            self._connection.execute(statement, parameters)
+            self._changed()
+        finally:
+            self._lock.release()
+
+    def flush(self):
+        self._lock.acquire()
+        try:
+            self._connection.commit()
+            self._changes = 0
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            self.flush()
+            self._connection.close()
+        finally:
+            self._lock.release()
@@ -31,6 +31,7 @@ __all__ = [
   'CommandNotImplementedError',
   'SyncError',
   'FTPIOError',
+  'BatchTransferError',
   ]
 
 
@@ -154,6 +155,23 @@ class FTPIOError(FTPError, IOError):
     pass
 
 
+class BatchTransferError(FTPIOError):
+    """
+    Raised by `FTPHost.upload_many` and `FTPHost.download_many` if
+    some of the transfers failed.
+
+    The attribute `errors` is a list of `(source, target, exception)`
+    tuples for the failed transfers, `copied` a list of `(source,
+    target)` pairs for the files which were copied successfully.
+    """
+
+    def __init__(self, errors, copied):
+        FTPIOError.__init__(self, "%d file transfer(s) failed, the first "
+                            "for '%s'" % (len(errors), errors[0][0]))
+        self.errors = errors
+        self.copied = copied
+
+
 def _try_with_ioerror(callee, *args, **kwargs):
     """
     Try the callee with the given arguments and map resulting
@@ -6,6 +6,8 @@
 ftp_file.py - support for file-like objects on FTP servers
 """
 
+import time
+
 import ftp_error
 
 
@@ -59,31 +61,64 @@ class _FTPFile(object):
         self._conn = None
         self._read_mode = None
         self._fo = None
+        # Time of the last `close` call, used by the child pool
+        self._close_time = None
+
+    def _open(self, path, mode, rest=None):
+        """
+        Open the remote file with given path name and mode. Modes 'a'
+        and 'ab' append to the file (with an `APPE` command).
 
-    def _open(self, path, mode):
-        """Open the remote file with given path name and mode."""
+        If `rest` is given, the transfer starts at this byte offset
+        (with a `REST` command), e. g. to resume an interrupted
+        transfer. This is only supported for binary modes.
+        """
         # Check mode.
-        if 'a' in mode:
-            raise ftp_error.FTPIOError("append mode not supported")
-        if mode not in ('r', 'rb', 'w', 'wb'):
+        if mode not in ('r', 'rb', 'w', 'wb', 'a', 'ab'):
             raise ftp_error.FTPIOError("invalid mode '%s'" % mode)
+        if (rest is not None) and ('b' not in mode):
+            raise ftp_error.FTPIOError("offset requires binary mode, "
+                                       "not '%s'" % mode)
         # Remember convenience variables instead of the mode itself.
         self._bin_mode = 'b' in mode
         self._read_mode = 'r' in mode
-        # Select ASCII or binary mode.
-        transfer_type = ('A', 'I')[self._bin_mode]
-        command = 'TYPE %s' % transfer_type
-        ftp_error._try_with_ioerror(self._session.voidcmd, command)
         # Make transfer command.
-        command_type = ('STOR', 'RETR')[self._read_mode]
+        if 'a' in mode:
+            command_type = 'APPE'
+        else:
+            command_type = ('STOR', 'RETR')[self._read_mode]
         command = '%s %s' % (command_type, path)
+        self._start_transfer(command, ftp_error._try_with_ioerror, rest)
+
+    def _open_listing(self, command):
+        """
+        Send the directory listing `command`, for example `LIST`, and
+        open the data connection for reading the listing in text
+        mode. Unlike for `_open`, errors are raised as `FTPOSError`s.
+        """
+        self._bin_mode = False
+        self._read_mode = True
+        self._start_transfer(command, ftp_error._try_with_oserror)
+
+    def _start_transfer(self, command, try_with, rest=None):
+        """
+        Select the transfer type according to `_bin_mode`, send the
+        transfer `command` (preceded by `REST rest` if `rest` isn't
+        `None`) and open the data connection. Call the FTP commands
+        via `try_with`, i. e. `ftp_error._try_with_ioerror` or
+        `ftp_error._try_with_oserror`.
+        """
+        # Select ASCII or binary mode.
+        transfer_type = ('A', 'I')[self._bin_mode]
+        try_with(self._session.voidcmd, 'TYPE %s' % transfer_type)
         # Ensure we can process the raw line separators.
         #  Force to binary regardless of transfer type.
-        if not 'b' in mode:
-            mode = mode + 'b'
+        mode = ('wb', 'rb')[self._read_mode]
         # Get connection and file object.
-        self._conn = ftp_error._try_with_ioerror(
-                       self._session.transfercmd, command)
+        if rest is None:
+            self._conn = try_with(self._session.transfercmd, command)
+        else:
+            self._conn = try_with(self._session.transfercmd, command, rest)
         self._fo = self._conn.makefile(mode)
         # This comes last so that `close` won't try to close `_FTPFile`
         #  objects without `_conn` and `_fo` attributes in case of an error.
@@ -246,4 +281,5 @@ class _FTPFile(object):
             #  either, so we consider the file closed for practical
             #  purposes.
             self.closed = True
+            self._close_time = time.time()
 
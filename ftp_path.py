@@ -160,19 +160,35 @@ class _Path(object):
         e.g., to pass a filename pattern, or a mutable object designed
         to accumulate statistics.  Passing None for arg is common.
         """
+        self._walk(top, func, arg, True)
+
+    def _walk(self, top, func, arg, check_isdir):
+        """
+        Implement `walk`. If `check_isdir` is false, `top` is known
+        to be a directory, so its parent directory doesn't need to
+        be listed to check this.
+        """
         # This code (and the above documentation) is taken from
-        #  posixpath.py, with slight modifications.
+        #  posixpath.py, with slight modifications. The stat results
+        #  of the items are taken from the listing, so each directory
+        #  is listed only once, even if the caches are too small or
+        #  disabled.
         try:
-            names = self._host.listdir(top)
+            listing = self._host._stat.listing(top, check_isdir)
         except OSError:
             return
+        names = [name for name in listing.names()
+                 if name not in (self._host.curdir, self._host.pardir)]
         func(arg, top, names)
         for name in names:
+            stat_result = listing.get(name)
             name = self.join(top, name)
-            try:
-                stat_result = self._host.lstat(name)
-            except OSError:
-                continue
-            if stat.S_ISDIR(stat_result[stat.ST_MODE]):
-                self.walk(name, func, arg)
+            if stat_result is None:
+                # `func` added the name.
+                try:
+                    stat_result = self._host.lstat(name)
+                except OSError:
+                    continue
+            if stat.S_ISDIR(stat_result.st_mode):
+                self._walk(name, func, arg, False)
 
@@ -0,0 +1,313 @@
+# Copyright (C) 2010, Stefan Schwarzer <sschwarzer@sschwarzer.net>
+# See the file LICENSE for licensing terms.
+
+"""
+ftp_pool.py - pool of child sessions for file transfers
+"""
+
+import ftplib
+import sys
+import threading
+import time
+
+import ftp_error
+
+
+# This module shouldn't be used by clients of the ftputil library.
+#  The pool is configured via the `child_pool` attribute of `FTPHost`
+#  objects.
+__all__ = []
+
+
+class ChildPool(object):
+    """
+    Pool of child `FTPHost` objects which are used for file transfers
+    (see the implementation notes in `FTPHost`). Each child has a
+    `_file` attribute which refers to an `_FTPFile` object. A child
+    is in use as long as its `_file` is open.
+
+    The following attributes can be changed to configure the pool:
+
+    - `max_size`: maximum number of children to keep. If all children
+      are in use, `acquire` still makes a new child, but it will be
+      closed after its file has been closed. `None` (the default)
+      means there's no limit.
+
+    - `idle_timeout`: unused children are closed after they have been
+      idle for this number of seconds. `None` (the default) means
+      they're kept until the pool is closed (but see `check_interval`).
+
+    - `check_interval`: children which have been idle for less than
+      this number of seconds are assumed to be alive. Children idle
+      for longer are checked with a `PWD` command before they're
+      reused; if the check fails, the child is closed and removed.
+      Children idle for a shorter time may have died nonetheless, so
+      if opening a file with a reused child fails and a check shows
+      that the child is dead, `open` retries once with a new child.
+
+    The attributes `hits`, `misses` and `evictions` count the reused
+    children, the newly made children and the closed and removed
+    children, respectively.
+    """
+
+    def __init__(self):
+        self.max_size = None
+        self.idle_timeout = None
+        self.check_interval = 30.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # All children in the order they were made
+        self._children = []
+        # Unused children as a stack of `(last_used, child)` pairs; the
+        #  most recently used child is at the end.
+        self._idle = []
+        # Children whose files were open when we last looked
+        self._busy = []
+        self._lock = threading.Lock()
+        self._pruning_stopped = None
+
+    def children(self):
+        """Return a list of all children, used or not."""
+        return self._children[:]
+
+    def __len__(self):
+        return len(self._children)
+
+    def _close_child(self, child):
+        """
+        Close the `child` without raising an exception. Don't remove
+        it from the pool; see `_remove`.
+        """
+        # Don't complain about lazy except clause
+        # pylint: disable=W0704
+        try:
+            child._file.close()
+            child.close()
+        except ftp_error.FTPError:
+            # The connection is probably already dead.
+            pass
+
+    def _remove(self, child):
+        """
+        Remove `child` from the list of children and count the
+        eviction. The lock must be held by the caller.
+        """
+        self._children.remove(child)
+        self.evictions += 1
+
+    def _reclaim(self):
+        """
+        Move children whose files have been closed from the busy
+        list to the idle stack. If the pool is too large, return a
+        list of children to close, else an empty list. The lock must
+        be held by the caller.
+        """
+        still_busy, closed = [], []
+        for child in self._busy:
+            if child._file.closed:
+                last_used = child._file._close_time or time.time()
+                closed.append((last_used, child))
+            else:
+                still_busy.append(child)
+        if not closed:
+            return []
+        self._busy = still_busy
+        closed.sort()
+        self._idle.extend(closed)
+        self._idle.sort()
+        surplus = []
+        if self.max_size is not None:
+            while self._idle and len(self._children) > self.max_size:
+                # Remove the least recently used children first.
+                last_used, child = self._idle.pop(0)
+                self._remove(child)
+                surplus.append(child)
+        return surplus
+
+    def _expired(self, now):
+        """
+        Remove children which have been idle for longer than
+        `idle_timeout` from the pool and return them as a list. The
+        lock must be held by the caller.
+        """
+        if self.idle_timeout is None:
+            return []
+        expired = []
+        while self._idle and (now - self._idle[0][0] > self.idle_timeout):
+            last_used, child = self._idle.pop(0)
+            self._remove(child)
+            expired.append(child)
+        return expired
+
+    def _is_alive(self, child, last_used, now):
+        """
+        Return `True` if the `child` is assumed to be usable, else
+        `False`. The lock must _not_ be held by the caller.
+        """
+        if now - last_used < self.check_interval:
+            return True
+        return self._check(child)
+
+    def _check(self, child):
+        """
+        Return `True` if the session of `child` responds to a `PWD`
+        command, else `False`. The lock must _not_ be held by the
+        caller.
+        """
+        try:
+            child._session.pwd()
+        except ftplib.all_errors:
+            # For example, a server timeout
+            return False
+        return True
+
+    def acquire(self, make_child):
+        """
+        Return an unused child, preferring the most recently used
+        one. If there's none, call `make_child` without arguments to
+        make a new child and return it.
+        """
+        return self._acquire(make_child)[0]
+
+    def open(self, make_child, open_child):
+        """
+        Acquire a child as with `acquire`, call `open_child` with it
+        and return the result.
+
+        If `open_child` raises an `FTPError` for a reused child and
+        the child's session turns out to be dead, close and remove
+        the child and call `open_child` once more with a new child.
+        Otherwise pass the exception on.
+        """
+        child, reused = self._acquire(make_child)
+        try:
+            return open_child(child)
+        except ftp_error.FTPError:
+            exc_info = sys.exc_info()
+            if not reused or self._check(child):
+                raise exc_info[0], exc_info[1], exc_info[2]
+        # The server may have closed the connection since the child
+        #  was last used.
+        self._discard(child)
+        return open_child(self._make(make_child))
+
+    def _discard(self, child):
+        """Close the `child`, which is in use, and remove it."""
+        self._lock.acquire()
+        try:
+            self._busy.remove(child)
+            self._remove(child)
+        finally:
+            self._lock.release()
+        self._close_child(child)
+
+    def _acquire(self, make_child):
+        """
+        Implement `acquire`, but return a tuple of the child and a
+        flag which is `True` if the child was reused.
+        """
+        while True:
+            self._lock.acquire()
+            try:
+                to_close = self._reclaim()
+                now = time.time()
+                to_close.extend(self._expired(now))
+                if self._idle:
+                    last_used, child = self._idle.pop()
+                else:
+                    child = None
+            finally:
+                self._lock.release()
+            for old_child in to_close:
+                self._close_child(old_child)
+            if child is None:
+                break
+            if self._is_alive(child, last_used, now):
+                self._lock.acquire()
+                try:
+                    self._busy.append(child)
+                    self.hits += 1
+                finally:
+                    self._lock.release()
+                return child, True
+            # The child's session is dead; throw it away.
+            self._lock.acquire()
+            try:
+                self._remove(child)
+            finally:
+                self._lock.release()
+            self._close_child(child)
+        # No usable child; make a new one.
+        return self._make(make_child), False
+
+    def _make(self, make_child):
+        """
+        Call `make_child` to make a new child, add it to the pool as
+        used and return it.
+        """
+        child = make_child()
+        self._lock.acquire()
+        try:
+            self._children.append(child)
+            self._busy.append(child)
+            self.misses += 1
+        finally:
+            self._lock.release()
+        return child
+
+    def prune(self):
+        """
+        Close and remove unused children which have been idle for
+        longer than `idle_timeout`.
+        """
+        self._lock.acquire()
+        try:
+            to_close = self._reclaim()
+            to_close.extend(self._expired(time.time()))
+        finally:
+            self._lock.release()
+        for child in to_close:
+            self._close_child(child)
+
+    def _prune_periodically(self, interval, stopped):
+        """Call `prune` every `interval` seconds until `stopped` is set."""
+        while True:
+            stopped.wait(interval)
+            if stopped.isSet():
+                break
+            self.prune()
+
+    def start_pruning(self, interval):
+        """
+        Start a background thread which calls `prune` every `interval`
+        seconds. The thread ends when `stop_pruning` or `close` is
+        called.
+        """
+        self.stop_pruning()
+        self._pruning_stopped = threading.Event()
+        thread = threading.Thread(target=self._prune_periodically,
+                                  args=(interval, self._pruning_stopped))
+        thread.setDaemon(True)
+        thread.start()
+
+    def stop_pruning(self):
+        """Stop the background thread started with `start_pruning`."""
+        if self._pruning_stopped is not None:
+            self._pruning_stopped.set()
+            self._pruning_stopped = None
+
+    def close(self):
+        """Close all children and remove them from the pool."""
+        self.stop_pruning()
+        self._lock.acquire()
+        try:
+            children = self._children
+            self._children, self._idle, self._busy = [], [], []
+        finally:
+            self._lock.release()
+        for child in children:
+            # Children have a `_file` attribute which is an `_FTPFile`
+            #  object.
+            child._file.close()
+            child.close()
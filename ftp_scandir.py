@@ -0,0 +1,237 @@
+# Copyright (C) 2010, Stefan Schwarzer <sschwarzer@sschwarzer.net>
+# See the file LICENSE for licensing terms.
+
+"""
+ftp_scandir.py - iterate over directory listings while they arrive
+"""
+
+import stat
+
+import ftp_error
+import ftp_stat
+
+
+# This module shouldn't be used by clients of the ftputil library.
+#  `ScandirIterator` objects are returned by `FTPHost.scandir`.
+__all__ = []
+
+
+class DirEntry(object):
+    """
+    Represent an item in a directory listing, similar to the
+    `DirEntry` objects of `scandir` in newer Python versions.
+
+    The attribute `name` is the name of the item, `path` the name
+    joined to the path given to `FTPHost.scandir`.
+    """
+
+    def __init__(self, host, path, lstat_result):
+        self.name = lstat_result._st_name
+        self.path = path
+        self._host = host
+        self._lstat_result = lstat_result
+
+    def __repr__(self):
+        return "<DirEntry %r>" % self.name
+
+    def is_symlink(self):
+        """Return `True` if the item is a link, else `False`."""
+        return stat.S_ISLNK(self._lstat_result.st_mode)
+
+    def is_dir(self, follow_symlinks=True):
+        """
+        Return `True` if the item is a directory or, if
+        `follow_symlinks` is true, a link to a directory.
+        """
+        if follow_symlinks and self.is_symlink():
+            return self._host.path.isdir(self.path)
+        return stat.S_ISDIR(self._lstat_result.st_mode)
+
+    def is_file(self, follow_symlinks=True):
+        """
+        Return `True` if the item is a regular file or, if
+        `follow_symlinks` is true, a link to a regular file.
+        """
+        if follow_symlinks and self.is_symlink():
+            return self._host.path.isfile(self.path)
+        return stat.S_ISREG(self._lstat_result.st_mode)
+
+    def stat(self, follow_symlinks=True):
+        """
+        Return the stat result for the item. If the item is a link
+        and `follow_symlinks` is true, return the stat result for the
+        link target; this may need a directory listing.
+        """
+        if follow_symlinks and self.is_symlink():
+            return self._host.stat(self.path)
+        return self._lstat_result
+
+
+class ScandirIterator(object):
+    """
+    Iterator over the `DirEntry` objects for the items in a remote
+    directory. The entries for `.` and `..` are skipped.
+
+    If the listing of the directory is cached, the entries come from
+    the cache. Otherwise the listing is read from a child session
+    (see `FTPHost.file`), and each line is parsed as soon as it
+    arrives. The stat results are stored in the stat cache at once,
+    and, after the last line, the whole listing is stored in the
+    listing cache.
+
+    Until the iterator is exhausted or closed with `close`, the child
+    session is busy.
+    """
+
+    def __init__(self, host, path):
+        self._host = host
+        self._stat = host._stat
+        self._path = path
+        self._abs_path = host.path.abspath(path)
+        self._time_shift = host.time_shift()
+        # The child `FTPHost` object and its `_FTPFile` object, from
+        #  which the listing is read
+        self._child = None
+        self._file = None
+        # Stat results for the listing cache; `None` if it's disabled
+        self._stat_results = None
+        # Iterator over the stat results of a cached listing
+        self._cached_stat_results = None
+        listing = self._stat._cached_listing(self._abs_path)
+        if listing is not None:
+            self._cached_stat_results = iter(listing)
+        else:
+            self._open()
+
+    def _open(self):
+        """Start the transfer of the listing in a child session."""
+        host = self._host
+        if self._stat._mlsd_supported():
+            command = 'MLSD'
+        else:
+            command = 'LIST'
+        child = host.child_pool.acquire(host._make_child)
+        # Like `_FTPHost._robust_ftp_command` with `descend_deeply`,
+        #  list the current directory to avoid problems with
+        #  whitespace in paths.
+        host._chdir_with(child, self._abs_path)
+        child._file._open_listing(command)
+        self._child, self._file = child, child._file
+        if self._stat._listing_cache._enabled:
+            self._stat_results = []
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        """Return the next `DirEntry` or raise `StopIteration`."""
+        special_names = (self._host.curdir, self._host.pardir)
+        while True:
+            if self._cached_stat_results is not None:
+                lstat_result = self._cached_stat_results.next()
+            else:
+                lstat_result = self._next_from_server()
+            name = lstat_result._st_name
+            if name not in special_names:
+                return DirEntry(self._host,
+                                self._host.path.join(self._path, name),
+                                lstat_result)
+
+    def _next_from_server(self):
+        """
+        Read lines from the server until one can be used and return
+        its stat result. At the end of the listing, store the listing
+        in the cache and raise `StopIteration`.
+        """
+        if self._file is None:
+            raise StopIteration
+        try:
+            while True:
+                line = self._file.readline()
+                if not line:
+                    self._finish()
+                    raise StopIteration
+                if line.endswith('\n'):
+                    line = line[:-1]
+                lstat_result = self._parse_line(line)
+                if lstat_result is not None:
+                    break
+        except (ftp_error.FTPError, EnvironmentError):
+            self.close()
+            raise
+        self._stat._lstat_cache[
+          self._host.path.join(self._abs_path, lstat_result._st_name)] = \
+          lstat_result
+        if self._stat_results is not None:
+            self._stat_results.append(lstat_result)
+        return lstat_result
+
+    def _parse_line(self, line):
+        """
+        Return the stat result for the `line` from the listing or
+        `None` if the line should be ignored.
+
+        If no parser has been established yet and the line can't be
+        parsed, switch to the `MSParser`, like `_Stat` does for whole
+        listings.
+        """
+        stat_ = self._stat
+        if stat_._parser.ignores_line(line):
+            return None
+        try:
+            lstat_result = stat_._parser.parse_line(line, self._time_shift)
+        except ftp_error.ParserError:
+            if not stat_._allow_parser_switching:
+                raise
+            stat_._allow_parser_switching = False
+            stat_._parser = ftp_stat.MSParser()
+            lstat_result = stat_._parser.parse_line(line, self._time_shift)
+        stat_._allow_parser_switching = False
+        return lstat_result
+
+    def _finish(self):
+        """
+        Close the data connection after the last line and store the
+        listing in the listing cache.
+        """
+        self._file.close()
+        self._file = self._child = None
+        stat_results, self._stat_results = self._stat_results, None
+        if stat_results is not None:
+            self._stat._store_stat_results(self._abs_path, stat_results)
+
+    def close(self):
+        """
+        Stop the iteration. If the listing hasn't been read
+        completely, it isn't stored in the listing cache.
+        """
+        self._cached_stat_results = iter(())
+        self._stat_results = None
+        if self._file is not None:
+            file_, self._file = self._file, None
+            self._child = None
+            file_.close()
+
+    def __del__(self):
+        # Free the child session if the iteration was stopped early.
+        #  Don't complain about lazy except clause
+        # pylint: disable=W0704
+        try:
+            self.close()
+        except ftp_error.FTPError:
+            pass
+
+    #
+    # Context manager methods
+    #
+    def __enter__(self):
+        # Return `self`, so it can be accessed as the variable
+        #  component of the `with` statement.
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # We don't need the `exc_*` arguments here
+        # pylint: disable=W0613
+        self.close()
+        # Be explicit
+        return False
@@ -5,6 +5,8 @@
 ftp_stat.py - stat result, parsers, and FTP stat'ing for `ftputil`
 """
 
+import array
+import calendar
 import re
 import stat
 import time
@@ -14,38 +16,196 @@ import ftp_stat_cache
 
 
 # These can be used to write custom parsers.
-__all__ = ['StatResult', 'Parser', 'UnixParser', 'MSParser']
+__all__ = ['StatResult', 'Parser', 'UnixParser', 'MSParser', 'MLSDParser']
 
 
-class StatResult(tuple):
+# Memoized conversions for `Parser.parse_unix_mode` and
+#  `Parser.parse_unix_time`. In large listings, the same mode strings
+#  and dates occur over and over again.
+_unix_mode_cache = {}
+_mktime_cache = {}
+# Limit for the number of entries in each of the caches above; if it's
+#  reached, the cache is cleared.
+_MAX_CONVERSION_CACHE_SIZE = 10000
+
+
+def _cached_mktime(year, month, day, hour, minute):
+    """
+    Return the result of `time.mktime` for the given local time.
+    Memoize the result.
+    """
+    key = (year, month, day, hour, minute)
+    try:
+        return _mktime_cache[key]
+    except KeyError:
+        if len(_mktime_cache) >= _MAX_CONVERSION_CACHE_SIZE:
+            _mktime_cache.clear()
+        st_mtime = time.mktime( (year, month, day, hour, minute, 0, 0, 0, -1) )
+        _mktime_cache[key] = st_mtime
+        return st_mtime
+
+
+class _CurrentYear(object):
+    """
+    Determine the current local year, but call `time.localtime` only
+    if the time is outside the year determined before.
+    """
+
+    def __init__(self):
+        self._year = None
+        self._year_start = self._year_end = 0.0
+
+    def year(self, now):
+        """Return the local year at the time `now` (in seconds)."""
+        if not (self._year_start <= now < self._year_end):
+            year = time.localtime(now)[0]
+            self._year_start = _cached_mktime(year, 1, 1, 0, 0)
+            self._year_end = _cached_mktime(year+1, 1, 1, 0, 0)
+            self._year = year
+        return self._year
+
+_current_year = _CurrentYear()
+
+
+class StatResult(object):
     """
     Support class resembling a tuple like that returned from
     `os.(l)stat`.
+
+    The ten values can be accessed by index or with the attribute
+    names known from `os.stat` results, and the object compares like
+    a tuple with the same values. Additionally, the parsers set the
+    attributes `_st_name`, `_st_target` and `_st_mtime_precision`.
+
+    A `tuple` subclass can't have slots for these attributes, so
+    `StatResult` isn't one; use `tuple(stat_result)` where a real
+    tuple is needed.
     """
 
-    _index_mapping = {
-      'st_mode':  0, 'st_ino':   1, 'st_dev':    2, 'st_nlink':    3,
-      'st_uid':   4, 'st_gid':   5, 'st_size':   6, 'st_atime':    7,
-      'st_mtime': 8, 'st_ctime': 9, '_st_name': 10, '_st_target': 11}
+    _fields = ('st_mode', 'st_ino', 'st_dev', 'st_nlink', 'st_uid',
+               'st_gid', 'st_size', 'st_atime', 'st_mtime', 'st_ctime')
+
+    # Without a `__dict__` for each instance, cached stat results for
+    #  large directory trees need much less memory, and attribute
+    #  access doesn't need a `__getattr__` call.
+    __slots__ = _fields + ('_st_name', '_st_target', '_st_mtime_precision')
 
     def __init__(self, sequence):
-        # Don't call `__init__` via `super`. Construction from a
-        #  sequence is implicitly handled by `tuple.__new__`, not
-        #  `tuple.__init__`. As a by-product, this avoids a
-        #  `DeprecationWarning` in Python 2.6+ .
-        # pylint: disable=W0231, W0613
-        #
+        (self.st_mode, self.st_ino, self.st_dev, self.st_nlink,
+         self.st_uid, self.st_gid, self.st_size, self.st_atime,
+         self.st_mtime, self.st_ctime) = sequence
         # These may be overwritten in a `Parser.parse_line` method.
         self._st_name = ""
         self._st_target = None
         self._st_mtime_precision = None
 
-    def __getattr__(self, attr_name):
-        if attr_name in self._index_mapping:
-            return self[self._index_mapping[attr_name]]
+    def _as_tuple(self):
+        """Return the ten `os.stat`-like values as a tuple."""
+        return (self.st_mode, self.st_ino, self.st_dev, self.st_nlink,
+                self.st_uid, self.st_gid, self.st_size, self.st_atime,
+                self.st_mtime, self.st_ctime)
+
+    #
+    # Tuple compatibility
+    #
+    def _other_values(self, other):
+        """
+        Return the values of `other` as a tuple for a comparison, or
+        `None` if `other` isn't a tuple or `StatResult`.
+        """
+        if isinstance(other, StatResult):
+            return other._as_tuple()
+        elif isinstance(other, tuple):
+            return other
         else:
-            raise AttributeError("'StatResult' object has no attribute '%s'" %
-                                 attr_name)
+            return None
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._as_tuple()[index]
+        # Like for tuples, negative indices count from the end and
+        #  other indices raise an `IndexError`.
+        return getattr(self, self._fields[index])
+
+    def __len__(self):
+        return 10
+
+    def __iter__(self):
+        for field in self._fields:
+            yield getattr(self, field)
+
+    def __contains__(self, value):
+        return value in self._as_tuple()
+
+    def count(self, value):
+        """Return the number of occurrences of `value`."""
+        return list(self._as_tuple()).count(value)
+
+    def index(self, value):
+        """Return the first index of `value`."""
+        return list(self._as_tuple()).index(value)
+
+    def __add__(self, other):
+        return self._as_tuple() + other
+
+    def __radd__(self, other):
+        return other + self._as_tuple()
+
+    def __eq__(self, other):
+        other_values = self._other_values(other)
+        if other_values is None:
+            return NotImplemented
+        if len(other_values) != 10:
+            return False
+        for index, field in enumerate(self._fields):
+            if getattr(self, field) != other_values[index]:
+                return False
+        return True
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __lt__(self, other):
+        other_values = self._other_values(other)
+        if other_values is None:
+            return NotImplemented
+        return self._as_tuple() < other_values
+
+    def __le__(self, other):
+        other_values = self._other_values(other)
+        if other_values is None:
+            return NotImplemented
+        return self._as_tuple() <= other_values
+
+    def __gt__(self, other):
+        other_values = self._other_values(other)
+        if other_values is None:
+            return NotImplemented
+        return self._as_tuple() > other_values
+
+    def __ge__(self, other):
+        other_values = self._other_values(other)
+        if other_values is None:
+            return NotImplemented
+        return self._as_tuple() >= other_values
+
+    def __hash__(self):
+        return hash(self._as_tuple())
+
+    def __repr__(self):
+        return repr(self._as_tuple())
+
+    # Objects with `__slots__` can't be pickled with protocols 0 and 1
+    #  by default.
+    def __reduce__(self):
+        return (self.__class__, (self._as_tuple(),),
+                (self._st_name, self._st_target, self._st_mtime_precision))
+
+    def __setstate__(self, state):
+        self._st_name, self._st_target, self._st_mtime_precision = state
 
 #
 # FTP directory parsers
@@ -92,6 +252,25 @@ class Parser(object):
         """
         raise NotImplementedError("must be defined by subclass")
 
+    def parse_lines(self, lines, time_shift=0.0):
+        """
+        Return a list of `StatResult` objects for the lines of a
+        directory listing, skipping the lines for which `ignores_line`
+        returns a true value.
+
+        If a line can't be parsed, raise a `ParserError`. See
+        `parse_line` for the `time_shift` parameter.
+
+        Subclasses may override this method with a faster
+        implementation for whole listings.
+        """
+        ignores_line, parse_line = self.ignores_line, self.parse_line
+        stat_results = []
+        for line in lines:
+            if not ignores_line(line):
+                stat_results.append(parse_line(line, time_shift))
+        return stat_results
+
     #
     # Helper methods for parts of a directory listing line
     #
@@ -104,6 +283,20 @@ class Parser(object):
         If the mode string can't be parsed, raise an
         `ftp_error.ParserError`.
         """
+        try:
+            return _unix_mode_cache[mode_string]
+        except KeyError:
+            st_mode = self._parse_unix_mode(mode_string)
+            if len(_unix_mode_cache) >= _MAX_CONVERSION_CACHE_SIZE:
+                _unix_mode_cache.clear()
+            _unix_mode_cache[mode_string] = st_mode
+            return st_mode
+
+    def _parse_unix_mode(self, mode_string):
+        """
+        Return the `st_mode` value for the `mode_string`, as described
+        for `parse_unix_mode`, but without memoization.
+        """
         if len(mode_string) != 10:
             raise ftp_error.ParserError("invalid mode string '%s'" %
                                         mode_string)
@@ -163,13 +356,13 @@ class Parser(object):
         try:
             month = self._month_numbers[month_abbreviation.lower()]
         except KeyError:
-            raise ftp_error.ParserError("invalid month name '%s'" % month)
+            raise ftp_error.ParserError("invalid month name '%s'" %
+                                        month_abbreviation)
         day = int(day)
         if ":" not in year_or_time:
             # `year_or_time` is really a year
             year, hour, minute = int(year_or_time), 0, 0
-            st_mtime = time.mktime( (year, month, day,
-                                     hour, minute, 0, 0, 0, -1) )
+            st_mtime = _cached_mktime(year, month, day, hour, minute)
             # Precise up to a day
             st_mtime_precision = 24 * 60 * 60
         else:
@@ -177,9 +370,9 @@ class Parser(object):
             hour, minute = year_or_time.split(':')
             year, hour, minute = None, int(hour), int(minute)
             # Try the current year
-            year = time.localtime()[0]
-            st_mtime = time.mktime( (year, month, day,
-                                     hour, minute, 0, 0, 0, -1) )
+            now = time.time()
+            year = _current_year.year(now)
+            st_mtime = _cached_mktime(year, month, day, hour, minute)
             # Precise up to a minute
             st_mtime_precision = 60
             # Rhs of comparison: Transform client time to server time
@@ -193,10 +386,9 @@ class Parser(object):
             #  may cause that datetime to be recognized as the current
             #  datetime, but after all the datetime from the server
             #  can only be exact up to a minute.
-            if st_mtime > time.time() + time_shift + 60.0:
+            if st_mtime > now + time_shift + 60.0:
                 # If it's in the future, use previous year
-                st_mtime = time.mktime( (year-1, month, day,
-                                         hour, minute, 0, 0, 0, -1) )
+                st_mtime = _cached_mktime(year-1, month, day, hour, minute)
         if with_precision:
             return (st_mtime, st_mtime_precision)
         else:
@@ -250,6 +442,14 @@ class Parser(object):
 class UnixParser(Parser):
     """`Parser` class for Unix-specific directory format."""
 
+    # Regular expression for the common format with user and group
+    #  fields. Lines which don't match are split with `_split_line`,
+    #  which is slower but also handles unusual variants. The groups
+    #  correspond to the return value of `_split_line`.
+    _line_regex = re.compile(r"(\S{10})\s+(\d+)\s+(\S+)\s+(\S+)\s+(\d+)\s+"
+                             r"([A-Za-z]{3})\s+(\d{1,2})\s+"
+                             r"(\d{4}|\d{1,2}:\d{2})\s+(\S.*)$")
+
     def _split_line(self, line):
         """
         Split a line in metadata, nlink, user, group, size, month,
@@ -288,8 +488,49 @@ class UnixParser(Parser):
 
         If the line can't be parsed, raise a `ParserError`.
         """
+        match = self._line_regex.match(line)
+        if match is None:
+            line_parts = self._split_line(line)
+        else:
+            line_parts = match.groups()
+        return self._parse_line_parts(line_parts, time_shift)
+
+    def parse_lines(self, lines, time_shift=0.0):
+        """
+        Return a list of `StatResult` objects for the lines of a
+        directory listing. See `Parser.parse_lines`.
+        """
+        # The fast path below assumes the line handling of this
+        #  class, so use the generic implementation if a subclass
+        #  changed it.
+        cls = self.__class__
+        if (cls.ignores_line.im_func is not Parser.ignores_line.im_func) or \
+           (cls.parse_line.im_func is not UnixParser.parse_line.im_func):
+            return Parser.parse_lines(self, lines, time_shift)
+        # Only lines which don't match the regular expression can be
+        #  summary lines like "total 23".
+        match, ignores_line = self._line_regex.match, self.ignores_line
+        split_line, parse_line_parts = self._split_line, self._parse_line_parts
+        stat_results = []
+        for line in lines:
+            line_match = match(line)
+            if line_match is not None:
+                line_parts = line_match.groups()
+            elif ignores_line(line):
+                continue
+            else:
+                line_parts = split_line(line)
+            stat_results.append(parse_line_parts(line_parts, time_shift))
+        return stat_results
+
+    def _parse_line_parts(self, line_parts, time_shift):
+        """
+        Return a `StatResult` instance for the `line_parts` as
+        returned by `_split_line`. See `parse_line` for the
+        `time_shift` argument.
+        """
         mode_string, nlink, user, group, size, month, day, \
-          year_or_time, name = self._split_line(line)
+          year_or_time, name = line_parts
         # st_mode
         st_mode = self.parse_unix_mode(mode_string)
         # st_ino, st_dev, st_nlink, st_uid, st_gid, st_size, st_atime
@@ -381,12 +622,357 @@ class MSParser(Parser):
         stat_result._st_mtime_precision = 60
         return stat_result
 
+
+class MLSDParser(Parser):
+    """
+    `Parser` class for the machine-readable listings of the `MLSD`
+    and `MLST` commands (RFC 3659).
+    """
+
+    # Fact values of the "type" fact for the listed directory itself
+    #  and its parent directory
+    _ignored_types = ('cdir', 'pdir')
+
+    # Fact values of the "type" fact for links, optionally followed
+    #  by a colon and the link target
+    _link_types = ('os.unix=slink', 'os.unix=symlink')
+
+    def _split_line(self, line):
+        """
+        Split a line into a dictionary of facts, with lowercase fact
+        names, and the name of the item. Return these two values as a
+        tuple.
+
+        If the line can't be split, raise a `ParserError`.
+        """
+        try:
+            facts_string, name = line.split(' ', 1)
+        except ValueError:
+            raise ftp_error.ParserError("line '%s' can't be parsed" % line)
+        facts = {}
+        for fact in facts_string.split(';'):
+            if not fact:
+                continue
+            try:
+                fact_name, value = fact.split('=', 1)
+            except ValueError:
+                raise ftp_error.ParserError("invalid fact '%s'" % fact)
+            facts[fact_name.lower()] = value
+        if 'type' not in facts:
+            raise ftp_error.ParserError("line '%s' has no type fact" % line)
+        return facts, name
+
+    def ignores_line(self, line):
+        """
+        Return a true value for empty lines and the lines for the
+        listed directory and its parent directory.
+        """
+        if not line.strip():
+            return True
+        try:
+            facts, name = self._split_line(line)
+        except ftp_error.ParserError:
+            return False
+        return facts['type'].lower() in self._ignored_types
+
+    def parse_mlsd_time(self, time_string, time_shift):
+        """
+        Return a tuple of the modification time and its precision in
+        seconds, parsed from the UTC `time_string` of a "modify" fact
+        (format "YYYYMMDDHHMMSS" with optional fraction of a second).
+
+        As for the other parsers, the modification time is expressed
+        in the time of the server (see `FTPHost.set_time_shift`).
+
+        If the time can't be parsed, raise a `ParserError`.
+        """
+        if '.' in time_string:
+            time_string, fraction = time_string.split('.', 1)
+        else:
+            fraction = ''
+        if len(time_string) != 14:
+            raise ftp_error.ParserError("invalid time string '%s'" %
+                                        time_string)
+        try:
+            time_tuple = (int(time_string[0:4]), int(time_string[4:6]),
+                          int(time_string[6:8]), int(time_string[8:10]),
+                          int(time_string[10:12]), int(time_string[12:14]),
+                          0, 0, 0)
+            if fraction:
+                fraction = float("0." + fraction)
+            else:
+                fraction = 0.0
+        except ValueError:
+            raise ftp_error.ParserError("invalid time string '%s'" %
+                                        time_string)
+        st_mtime = calendar.timegm(time_tuple) + fraction + time_shift
+        return st_mtime, 1.0
+
+    def parse_line(self, line, time_shift=0.0):
+        """
+        Return a `StatResult` instance corresponding to the given
+        `MLSD` line. The modification time is corrected by
+        `time_shift` because `MLSD` times are in UTC.
+
+        If the line can't be parsed, raise a `ParserError`.
+        """
+        facts, name = self._split_line(line)
+        type_parts = facts['type'].split(':', 1)
+        type_ = type_parts[0].lower()
+        st_target = None
+        if type_ == 'dir':
+            st_mode = stat.S_IFDIR
+        elif type_ in self._link_types:
+            st_mode = stat.S_IFLNK
+            if len(type_parts) == 2:
+                st_target = type_parts[1]
+        else:
+            # Treat other types like regular files.
+            st_mode = stat.S_IFREG
+        if 'unix.mode' in facts:
+            try:
+                st_mode = st_mode | (int(facts['unix.mode'], 8) & 07777)
+            except ValueError:
+                raise ftp_error.ParserError("invalid mode '%s'" %
+                                            facts['unix.mode'])
+        else:
+            # Approximate the owner's permissions from the "perm" fact.
+            perm = facts.get('perm', '').lower()
+            for perm_chars, mode_bits in (('rl', 0400), ('wacmpdf', 0200),
+                                          ('e', 0100)):
+                for perm_char in perm_chars:
+                    if perm_char in perm:
+                        st_mode = st_mode | mode_bits
+                        break
+        st_uid = facts.get('unix.owner', facts.get('unix.uid'))
+        st_gid = facts.get('unix.group', facts.get('unix.gid'))
+        st_size = None
+        if 'size' in facts:
+            try:
+                st_size = int(facts['size'])
+            except ValueError:
+                raise ftp_error.ParserError("invalid size %s" %
+                                            facts['size'])
+        if 'modify' in facts:
+            st_mtime, st_mtime_precision = \
+              self.parse_mlsd_time(facts['modify'], time_shift)
+        else:
+            # Unknown modification time; use the lowest precision the
+            #  other parsers give (see `parse_unix_time`).
+            st_mtime, st_mtime_precision = None, 24 * 60 * 60
+        stat_result = StatResult(
+                      (st_mode, None, None, None, st_uid,
+                       st_gid, st_size, None, st_mtime, None) )
+        stat_result._st_name = name
+        stat_result._st_target = st_target
+        stat_result._st_mtime_precision = st_mtime_precision
+        return stat_result
+
+#
+# Parsed directory listings
+#
+class _MissingPath(object):
+    """
+    Marker stored in the lstat cache for a path which wasn't found in
+    the listing of its parent directory.
+    """
+
+    def __repr__(self):
+        return "<missing path>"
+
+    def __reduce__(self):
+        # Unpickle as the module-level instance, so that identity
+        #  checks work for entries from a persistent cache backend.
+        return '_MISSING_PATH'
+
+_MISSING_PATH = _MissingPath()
+
+
+class _Listing(object):
+    """
+    Represent the parsed contents of a remote directory, i. e. the
+    `StatResult` objects for the items in it, in the order the server
+    listed them.
+    """
+
+    def __init__(self, stat_results):
+        self._names = []
+        self._stat_results = {}
+        for stat_result in stat_results:
+            st_name = stat_result._st_name
+            self._names.append(st_name)
+            self._stat_results[st_name] = stat_result
+
+    def names(self):
+        """Return a list of the names in the listing."""
+        return self._names[:]
+
+    def get(self, name):
+        """
+        Return the `StatResult` for the item `name` or `None` if the
+        name isn't in the listing.
+        """
+        return self._stat_results.get(name)
+
+    def __contains__(self, name):
+        return name in self._stat_results
+
+    def __iter__(self):
+        """Return an iterator over the `StatResult` objects."""
+        for name in self._names:
+            yield self._stat_results[name]
+
+    def __len__(self):
+        return len(self._names)
+
+
+# Value in the float columns of `_ColumnarListing` for `None`
+_NO_FLOAT = -1.0e300
+
+
+class _ColumnarListing(object):
+    """
+    Represent the parsed contents of a remote directory, like
+    `_Listing`, but store the data of the items in columns instead of
+    one `StatResult` object per item. This needs much less memory for
+    large directories. The `StatResult` objects are made when they're
+    requested.
+
+    `st_mode`, `st_size` and `st_mtime` are stored in arrays. The
+    (few) different combinations of `st_nlink`, `st_uid`, `st_gid`
+    and `_st_mtime_precision` are stored once; for each item, an
+    array holds the index of its combination. Link targets are kept
+    in a dictionary. Stat results with values which don't fit into
+    this scheme (for example, an `st_ino` value) are kept as they are.
+    """
+
+    def __init__(self, stat_results=()):
+        self._names = []
+        # Map names to row numbers
+        self._rows = {}
+        self._modes = array.array('l')
+        self._sizes = array.array('d')
+        self._mtimes = array.array('d')
+        self._other_indices = array.array('l')
+        # Distinct `(st_nlink, st_uid, st_gid, _st_mtime_precision)`
+        #  tuples and their indices in this list
+        self._others = []
+        self._other_index = {}
+        # Link targets and stat results which can't be stored in the
+        #  columns, keyed by row number
+        self._targets = {}
+        self._unusual_rows = {}
+        self.extend(stat_results)
+
+    def extend(self, stat_results):
+        """Add the `stat_results` to the end of the listing."""
+        names, rows = self._names, self._rows
+        modes, sizes, mtimes = self._modes, self._sizes, self._mtimes
+        other_indices, other_index = self._other_indices, self._other_index
+        for stat_result in stat_results:
+            row = len(names)
+            st_name = stat_result._st_name
+            names.append(st_name)
+            rows[st_name] = row
+            st_mode, st_size, st_mtime = \
+              stat_result.st_mode, stat_result.st_size, stat_result.st_mtime
+            # Keep stat results whose values can't be stored in the
+            #  columns without losing information.
+            if not (stat_result.st_ino is None and
+                    stat_result.st_dev is None and
+                    stat_result.st_atime is None and
+                    stat_result.st_ctime is None and
+                    (st_mode is None or
+                     (type(st_mode) is int and st_mode >= 0)) and
+                    (st_size is None or
+                     (type(st_size) in (int, long) and st_size >= 0 and
+                      float(st_size) == st_size)) and
+                    (st_mtime is None or
+                     (type(st_mtime) is float and st_mtime != _NO_FLOAT))):
+                self._unusual_rows[row] = stat_result
+                modes.append(-1)
+                sizes.append(_NO_FLOAT)
+                mtimes.append(_NO_FLOAT)
+                other_indices.append(-1)
+                continue
+            if st_mode is None:
+                st_mode = -1
+            if st_size is None:
+                st_size = _NO_FLOAT
+            if st_mtime is None:
+                st_mtime = _NO_FLOAT
+            modes.append(st_mode)
+            sizes.append(st_size)
+            mtimes.append(st_mtime)
+            others = (stat_result.st_nlink, stat_result.st_uid,
+                      stat_result.st_gid, stat_result._st_mtime_precision)
+            try:
+                other_indices.append(other_index[others])
+            except KeyError:
+                other_index[others] = len(self._others)
+                other_indices.append(len(self._others))
+                self._others.append(others)
+            if stat_result._st_target is not None:
+                self._targets[row] = stat_result._st_target
+
+    def _stat_result(self, row):
+        """Return a new `StatResult` object for the `row`."""
+        if row in self._unusual_rows:
+            return self._unusual_rows[row]
+        st_mode, st_size, st_mtime = \
+          self._modes[row], self._sizes[row], self._mtimes[row]
+        if st_mode == -1:
+            st_mode = None
+        if st_size == _NO_FLOAT:
+            st_size = None
+        else:
+            st_size = int(st_size)
+        if st_mtime == _NO_FLOAT:
+            st_mtime = None
+        st_nlink, st_uid, st_gid, st_mtime_precision = \
+          self._others[self._other_indices[row]]
+        stat_result = StatResult(
+                      (st_mode, None, None, st_nlink, st_uid,
+                       st_gid, st_size, None, st_mtime, None) )
+        stat_result._st_name = self._names[row]
+        stat_result._st_target = self._targets.get(row)
+        stat_result._st_mtime_precision = st_mtime_precision
+        return stat_result
+
+    def names(self):
+        """Return a list of the names in the listing."""
+        return self._names[:]
+
+    def get(self, name):
+        """
+        Return a `StatResult` for the item `name` or `None` if the
+        name isn't in the listing.
+        """
+        row = self._rows.get(name)
+        if row is None:
+            return None
+        return self._stat_result(row)
+
+    def __contains__(self, name):
+        return name in self._rows
+
+    def __iter__(self):
+        """Return an iterator over `StatResult` objects for the items."""
+        for name in self._names:
+            yield self._stat_result(self._rows[name])
+
+    def __len__(self):
+        return len(self._names)
+
 #
 # Stat'ing operations for files on an FTP server
 #
 class _Stat(object):
     """Methods for stat'ing directories, links and regular files."""
 
+    # Number of lines parsed at once for a `_ColumnarListing`
+    _COLUMNAR_CHUNK_SIZE = 1000
+
     def __init__(self, host):
         self._host = host
         self._path = host.path
@@ -395,51 +981,273 @@ class _Stat(object):
         # Allow one chance to switch to another parser if the default
         #  doesn't work.
         self._allow_parser_switching = True
+        # Use `MLSD` and `MLST` instead of `DIR` if the server supports
+        #  them. `None` means we don't know yet.
+        self._use_mlsd = None
+        # Try `LIST -R` in `scan_tree` unless the server rejected it
+        #  before.
+        self._use_recursive_listing = True
         # Cache only lstat results. `stat` works locally on `lstat` results.
         self._lstat_cache = ftp_stat_cache.StatCache()
+        # Cache parsed directory listings, keyed by the absolute
+        #  path of the directory.
+        self._listing_cache = ftp_stat_cache.ListingCache()
+
+    def _mlsd_supported(self):
+        """
+        Return `True` if `MLSD` and `MLST` should be used for listings
+        and stat'ing, else `False`. On the first call (unless `MLSD`
+        was disabled explicitly), ask the server for its features and,
+        if it supports `MLST`, use the `MLSDParser`.
+        """
+        if self._use_mlsd is None:
+            self._use_mlsd = 'MLST' in self._host._features()
+            if self._use_mlsd:
+                self._parser = MLSDParser()
+                self._allow_parser_switching = False
+        return self._use_mlsd
 
     def _host_dir(self, path):
         """
-        Return a list of lines, as fetched by FTP's `DIR` command,
-        when applied to `path`.
+        Return a list of lines, as fetched by FTP's `DIR` command
+        or, if supported, `MLSD`, when applied to `path`.
         """
+        if self._mlsd_supported():
+            return self._host._mlsd(path)
         return self._host._dir(path)
 
-    def _real_listdir(self, path):
+    def _cached_listing(self, path):
         """
-        Return a list of directories, files etc. in the directory
-        named `path`.
+        Return the cached `_Listing` for the absolute directory `path`
+        or `None` if there's no (valid) listing in the cache.
+        """
+        try:
+            return self._listing_cache[path]
+        except ftp_error.CacheMissError:
+            return None
+
+    def _fetch_listing(self, path):
+        """
+        Fetch the directory listing for the absolute directory `path`
+        from the server and return it as a `_Listing` object. Store
+        the listing and the stat results of the items in the caches.
 
         If the directory listing from the server can't be parsed
         raise a `ParserError`.
         """
-        # We _can't_ put this check into `FTPHost._dir`; see its docstring.
-        path = self._path.abspath(path)
-        # `listdir` should only be allowed for directories and links to them.
-        if not self._path.isdir(path):
-            raise ftp_error.PermanentError(
-                  "550 %s: no such directory or wrong directory parser used" %
-                  path)
-        # Set up for `for` loop
-        lines = self._host_dir(path)
-        # Exit the method now if there aren't any files
+        return self._store_listing(path, self._host_dir(path))
+
+    def _store_listing(self, path, lines):
+        """
+        Parse the `lines` of the directory listing for the absolute
+        directory `path` and return the listing as a `_Listing`
+        object. Store the listing and the stat results of the items
+        in the caches.
+
+        If the listing has at least `columnar_threshold` lines (see
+        `ftp_stat_cache.ListingCache`), return and store a
+        `_ColumnarListing` instead and don't store the stat results.
+
+        If the directory listing can't be parsed raise a
+        `ParserError`.
+        """
+        # Don't try to parse the listing if there aren't any files
         if lines == ['']:
-            return []
-        names = []
+            lines = []
+        # We use the `time_shift` parameter to have the correct
+        #  timestamp values in the cache.
+        time_shift = self._host.time_shift()
+        threshold = self._listing_cache.columnar_threshold
+        if threshold is not None and len(lines) >= threshold:
+            # Parse the listing in chunks, so that there are never
+            #  `StatResult` objects for all items at the same time.
+            #  Don't put the items into the stat cache; `lstat` gets
+            #  them from the listing.
+            listing = _ColumnarListing()
+            chunk_size = self._COLUMNAR_CHUNK_SIZE
+            for start in xrange(0, len(lines), chunk_size):
+                listing.extend(self._parser.parse_lines(
+                                 lines[start:start+chunk_size], time_shift))
+            self._listing_cache[path] = listing
+            return listing
+        stat_results = self._parser.parse_lines(lines, time_shift)
+        join, lstat_cache = self._path.join, self._lstat_cache
+        for stat_result in stat_results:
+            lstat_cache[join(path, stat_result._st_name)] = stat_result
+        return self._store_stat_results(path, stat_results)
+
+    def _store_stat_results(self, path, stat_results):
+        """
+        Store the listing for the absolute directory `path`, made of
+        the `stat_results` of its items, in the listing cache and
+        return it. The stat results aren't put into the stat cache.
+        """
+        threshold = self._listing_cache.columnar_threshold
+        if threshold is not None and len(stat_results) >= threshold:
+            listing = _ColumnarListing(stat_results)
+        else:
+            listing = _Listing(stat_results)
+        self._listing_cache[path] = listing
+        return listing
+
+    def invalidate(self, path):
+        """
+        Invalidate the cached stat data for the absolute `path`,
+        the cached listing of the directory containing `path` and,
+        if `path` is a directory, its own cached listing.
+        """
+        self._lstat_cache.invalidate(path)
+        self._listing_cache.invalidate(path)
+        self._listing_cache.invalidate(self._path.dirname(path))
+
+    def invalidate_lstat(self, path):
+        """
+        Invalidate only the cached stat data for the absolute `path`,
+        not the cached listings.
+        """
+        self._lstat_cache.invalidate(path)
+
+    def invalidate_tree(self, path):
+        """
+        Like `invalidate`, but also invalidate the cached stat data
+        and listings for all paths below the absolute `path`.
+        """
+        self._lstat_cache.invalidate_tree(path)
+        self._listing_cache.invalidate_tree(path)
+        self._listing_cache.invalidate(self._path.dirname(path))
+
+    def _split_recursive_listing(self, top, lines):
+        """
+        Split the `lines` of a recursive listing (see `scan_tree`) of
+        the absolute directory `top` into the listings of the
+        directories. Return a list of `(path, lines)` tuples where
+        `path` is the absolute path of a directory.
+
+        The listing of each subdirectory starts with a header line
+        like "./dir/subdir:" after an empty line; the listing of `top`
+        may have a header like "." or no header at all. In the latter
+        case, the first line may be a listing line for a name ending
+        in a colon, so it's only taken as a header if it names `top`.
+        """
+        sections = []
+        dirpath, dir_lines = None, []
+        at_section_start = True
+        is_first_line = True
         for line in lines:
-            if self._parser.ignores_line(line):
+            if not line.strip():
+                at_section_start = True
+                is_first_line = False
                 continue
-            # For `listdir`, we are interested in just the names,
-            #  but we use the `time_shift` parameter to have the
-            #  correct timestamp values in the cache.
-            stat_result = self._parser.parse_line(line,
-                                                  self._host.time_shift())
-            loop_path = self._path.join(path, stat_result._st_name)
-            self._lstat_cache[loop_path] = stat_result
-            st_name = stat_result._st_name
-            if st_name not in (self._host.curdir, self._host.pardir):
-                names.append(st_name)
-        return names
+            if is_first_line:
+                is_first_line = False
+                is_header = line[:-1] in ('.', './', top, top + '/')
+            else:
+                is_header = at_section_start and line.endswith(':')
+            if is_header:
+                if dirpath is not None or dir_lines:
+                    sections.append((dirpath or top, dir_lines))
+                name = line[:-1]
+                if name.startswith('./'):
+                    name = name[2:]
+                if name in ('', '.'):
+                    dirpath = top
+                else:
+                    # Also works for absolute paths.
+                    dirpath = self._path.normpath(self._path.join(top, name))
+                dir_lines = []
+            else:
+                dir_lines.append(line)
+            at_section_start = False
+        if dirpath is not None or dir_lines:
+            sections.append((dirpath or top, dir_lines))
+        return sections
+
+    def scan_tree(self, top):
+        """
+        Store the listings of all directories in the tree `top` in
+        the caches. Use a single `LIST -R` command if the server
+        supports it, else list each directory.
+
+        Raise a `PermanentError` if `top` isn't a directory.
+        """
+        top = self._path.abspath(top)
+        if not self._path.isdir(top):
+            raise ftp_error.PermanentError(
+                  "550 %s: no such directory or wrong directory parser used" %
+                  top)
+        sections = []
+        # The output of `LIST -R` can't be parsed with the `MLSDParser`.
+        if self._use_recursive_listing and not self._mlsd_supported():
+            try:
+                lines = self._host._dir_recursive(top)
+            except ftp_error.PermanentError:
+                self._use_recursive_listing = False
+            else:
+                sections = self._split_recursive_listing(top, lines)
+        if not sections:
+            # The server rejected `LIST -R` or sent nothing.
+            for ignored in self._host.walk(top):
+                pass
+            return
+        for dirpath, dir_lines in sections:
+            listing = self.add_listing(dirpath, dir_lines)
+        if len(sections) > 1:
+            return
+        # With a single section, `top` has no subdirectories, or the
+        #  server ignored the `-R` option. In the latter case, list the
+        #  subdirectories; the listing of `top` is in the cache now.
+        for lstat_result in listing:
+            if stat.S_ISDIR(lstat_result.st_mode) and \
+               lstat_result._st_name not in (self._host.curdir,
+                                              self._host.pardir):
+                for ignored in self._host.walk(top):
+                    pass
+                return
+
+    def _real_listing(self, path, _check_isdir=True):
+        """
+        Return the `_Listing` (or `_ColumnarListing`) for the
+        directory named `path`, from the cache if possible.
+
+        If the directory listing from the server can't be parsed
+        raise a `ParserError`.
+
+        (`_check_isdir` is an implementation aid for callers which
+        already know that `path` is a directory.)
+        """
+        # We _can't_ put this check into `FTPHost._dir`; see its docstring.
+        path = self._path.abspath(path)
+        listing = self._cached_listing(path)
+        if listing is None:
+            # Listings should only be allowed for directories and
+            #  links to them.
+            if _check_isdir and not self._path.isdir(path):
+                raise ftp_error.PermanentError(
+                      "550 %s: no such directory or wrong directory parser used" %
+                      path)
+            listing = self._fetch_listing(path)
+        return listing
+
+    def _real_listdir(self, path):
+        """
+        Return a list of directories, files etc. in the directory
+        named `path`.
+
+        If the directory listing from the server can't be parsed
+        raise a `ParserError`.
+        """
+        listing = self._real_listing(path)
+        # For `listdir`, we are interested in just the names.
+        return [name for name in listing.names()
+                if name not in (self._host.curdir, self._host.pardir)]
+
+    def _real_add_listing(self, path, lines):
+        """
+        Store the listing `lines` for the absolute directory `path`
+        in the caches and return the parsed listing, as `listing`
+        would.
+        """
+        return self._store_listing(path, lines)
 
     def _real_lstat(self, path, _exception_for_missing_path=True):
         """
@@ -456,43 +1264,17 @@ class _Stat(object):
         _not_ intended for use by ftputil clients.)
         """
         path = self._path.abspath(path)
-        # If the path is in the cache, return the lstat result.
-        if path in self._lstat_cache:
-            return self._lstat_cache[path]
-        # Note: (l)stat works by going one directory up and parsing
-        #  the output of an FTP `DIR` command. Unfortunately, it is
-        #  not possible to do this for the root directory `/`.
-        if path == '/':
-            raise ftp_error.RootDirError(
-                  "can't stat remote root directory")
-        dirname, basename = self._path.split(path)
-
-        # If even the directory doesn't exist and we don't want the
-        #  exception, treat it the same as if the path wasn't found in
-        #  the directory's contents (compare below). The use of `isdir`
-        #  here causes a recursion but that should be ok because that
-        #  will at the latest stop when we've got to the root directory.
-#         if not self._path.isdir(dirname) and not _exception_for_missing_path:
-#             return None
-        # Loop through all lines of the directory listing. We
-        #  probably won't need all lines for the particular path but
-        #  we want to collect as many stat results in the cache as
-        #  possible.
-        lstat_result_for_path = None
-        lines = self._host_dir(dirname)
-        for line in lines:
-            if self._parser.ignores_line(line):
-                continue
-            stat_result = self._parser.parse_line(line,
-                          self._host.time_shift())
-            loop_path = self._path.join(dirname, stat_result._st_name)
-            self._lstat_cache[loop_path] = stat_result
-            # Needed to work without cache or with disabled cache
-            if stat_result._st_name == basename:
-                lstat_result_for_path = stat_result
-        if lstat_result_for_path is not None:
-            return lstat_result_for_path
-        # Path was not found during the loop
+        # If the path is in the cache, return the lstat result. The
+        #  cache may also "know" that the path is missing. Don't test
+        #  with `in` first; with shared caches, another thread may
+        #  remove the entry between the test and the lookup.
+        try:
+            lstat_result = self._lstat_cache[path]
+        except ftp_error.CacheMissError:
+            lstat_result = self._uncached_lstat(path)
+        if lstat_result is not _MISSING_PATH:
+            return lstat_result
+        # Path was not found in the directory listing
         if _exception_for_missing_path:
             #TODO Use FTP DIR command on the file to implicitly use
             #  the usual status code of the server for missing files
@@ -507,6 +1289,62 @@ class _Stat(object):
             #  severe error in the code above.
             return None
 
+    def _uncached_lstat(self, path):
+        """
+        Return the lstat result for the absolute `path` from the
+        listing of its parent directory or `_MISSING_PATH` if the
+        path isn't in the listing. Use the cached listing if there
+        is one, else fetch the listing.
+        """
+        dirname, basename = self._path.split(path)
+        listing = self._cached_listing(dirname)
+        if listing is None and self._mlsd_supported():
+            # Ask for the single path instead of listing the parent
+            #  directory.
+            lstat_result = self._mlst(path)
+            self._lstat_cache[path] = lstat_result
+            return lstat_result
+        # Note: (l)stat works by going one directory up and parsing
+        #  the output of an FTP `DIR` command. Unfortunately, it is
+        #  not possible to do this for the root directory `/`.
+        if path == '/':
+            raise ftp_error.RootDirError(
+                  "can't stat remote root directory")
+        if listing is None:
+            # Get the listing of the parent directory. We probably
+            #  won't need all items for the particular path but we
+            #  want to collect as many stat results in the caches as
+            #  possible.
+            listing = self._fetch_listing(dirname)
+        # Use the listing directly because the lstat cache may be
+        #  too small or disabled.
+        lstat_result = listing.get(basename)
+        if lstat_result is None:
+            # The listing is complete, so the path doesn't exist.
+            #  Remember this, so that checks like `exists` for this
+            #  path don't need another listing (until the entry
+            #  expires or is invalidated).
+            lstat_result = _MISSING_PATH
+        self._lstat_cache[path] = lstat_result
+        return lstat_result
+
+    def _mlst(self, path):
+        """
+        Return the lstat result for the absolute `path` as determined
+        by an `MLST` command or `_MISSING_PATH` if the server doesn't
+        know the path.
+        """
+        try:
+            line = self._host._mlst(path)
+        except ftp_error.CommandNotImplementedError:
+            raise
+        except ftp_error.PermanentError:
+            return _MISSING_PATH
+        lstat_result = self._parser.parse_line(line, self._host.time_shift())
+        # The server may return the name with the directory.
+        lstat_result._st_name = self._path.basename(path)
+        return lstat_result
+
     def _real_stat(self, path, _exception_for_missing_path=True):
         """
         Return info from a "stat" call on `path`.
@@ -534,6 +1372,10 @@ class _Stat(object):
             #  same as the `lstat` result.
             if not stat.S_ISLNK(lstat_result.st_mode):
                 return lstat_result
+            # An `MLSD` listing may not tell the target of a link. As
+            #  the link can't be followed, return the link itself.
+            if lstat_result._st_target is None:
+                return lstat_result
             # If we stat'ed a link, calculate a normalized path for
             #  the file the link points to.
             # We don't use `basename`.
@@ -586,6 +1428,30 @@ class _Stat(object):
         """
         return self.__call_with_parser_retry(self._real_listdir, path)
 
+    def listing(self, path, _check_isdir=True):
+        """
+        Return the parsed listing of the directory `path`. Iterating
+        over it gives the `StatResult` objects of the items, including
+        those for `.` and `..` if the server lists them.
+
+        Raise a `PermanentError` if the path doesn't exist, but
+        maybe raise other exceptions depending on the state of
+        the server (e. g. timeout).
+        """
+        return self.__call_with_parser_retry(self._real_listing, path,
+                                             _check_isdir)
+
+    def add_listing(self, path, lines):
+        """
+        Store the `lines` of a directory listing for the absolute
+        directory `path`, fetched with another session, in the
+        caches. Return the parsed listing, like `listing`.
+
+        If the listing can't be parsed, raise a `ParserError`.
+        """
+        return self.__call_with_parser_retry(self._real_add_listing,
+                                             path, lines)
+
     def lstat(self, path, _exception_for_missing_path=True):
         """
         Return a `StatResult` without following links.
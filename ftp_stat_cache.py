@@ -5,6 +5,8 @@
 ftp_stat_cache.py - cache for (l)stat data
 """
 
+import posixpath
+import threading
 import time
 
 import ftp_error
@@ -33,17 +35,81 @@ class StatCache(object):
 
     Note that the `__len__` method does no age tests and thus may
     include some or many already expired entries.
+
+    If a persistent backend is set with `set_backend`, entries are
+    also written to the backend, and entries which aren't in memory
+    are looked up there. `max_age` applies to the time the entry was
+    originally stored. If `max_age` is `None`, entries from the
+    backend expire after `backend_max_age` seconds (by default one
+    hour), since they may come from an earlier process and the
+    server may have changed since then.
+
+    To support `invalidate_tree`, the cache keeps an index which maps
+    each directory to the paths directly below it, for all paths in
+    the cache and their parent directories. The index isn't updated
+    when entries are removed; instead it's rebuilt from the cache
+    keys when it has grown too much.
     """
     # Default number of cache entries
     _DEFAULT_CACHE_SIZE = 1000
 
+    # Default maximum age of entries loaded from a backend
+    _DEFAULT_BACKEND_MAX_AGE = 60 * 60
+
     def __init__(self):
         # Can be reset with method `resize`
         self._cache = lrucache.LRUCache(self._DEFAULT_CACHE_SIZE)
         # Never expire
         self.max_age = None
+        # Used for entries from the backend if `max_age` is `None`
+        self.backend_max_age = self._DEFAULT_BACKEND_MAX_AGE
+        # Map directories to sets of the paths directly below them
+        self._index = {}
+        # Number of paths in the index and an estimate of the number
+        #  of paths which were removed from the cache but not from the
+        #  index
+        self._index_size = 0
+        self._index_stale = 0
+        # Persistent backend (see `ftp_cache_backend`) and the
+        #  namespace of our entries in it
+        self._backend = None
+        self._namespace = None
         self.enable()
 
+    def set_backend(self, backend, namespace):
+        """
+        Use the persistent `backend` for the cache entries, which
+        are stored under the string `namespace`. If `backend` is
+        `None`, stop using a backend.
+        """
+        self._backend = backend
+        self._namespace = namespace
+
+    def flush(self):
+        """Make the changes in the backend persistent, if any."""
+        if self._backend is not None:
+            self._backend.flush()
+
+    def _load(self, path):
+        """
+        Load the entry for `path` from the backend into memory,
+        unless it's missing or expired.
+        """
+        record = self._backend.load(self._namespace, path)
+        if record is None:
+            return
+        timestamp, value = record
+        max_age = self.max_age
+        if max_age is None:
+            max_age = self.backend_max_age
+        if (max_age is not None) and (time.time() - timestamp > max_age):
+            self._backend.delete(self._namespace, path)
+            return
+        self._store_in_memory(path, value)
+        # If the memory cache has the size 0, the entry isn't there.
+        if path in self._cache:
+            self._cache.set_mtime(path, timestamp)
+
     def enable(self):
         """Enable storage of stat results."""
         # `enable` is called by `__init__`, so it's not set outside `__init__`
@@ -69,7 +135,9 @@ class StatCache(object):
         If the new size is greater than the current cache size,
         relatively long-unused elements will be removed.
         """
+        old_length = len(self._cache)
         self._cache.size = new_size
+        self._index_stale += old_length - len(self._cache)
 
     def _age(self, path):
         """
@@ -83,13 +151,77 @@ class StatCache(object):
                     "no entry for path %s in cache" % path)
 
     def clear(self):
-        """Clear (invalidate) all cache entries."""
+        """
+        Clear (invalidate) all cache entries, including those in the
+        backend, if any.
+        """
+        self.clear_memory()
+        if self._backend is not None:
+            self._backend.clear(self._namespace)
+
+    def clear_memory(self):
+        """
+        Clear (invalidate) all cache entries in memory. Entries in the
+        backend aren't affected.
+        """
         old_size = self._cache.size
         try:
             # Implicitly clear the cache by setting the size to zero
             self.resize(0)
         finally:
             self.resize(old_size)
+        self._index = {}
+        self._index_size = 0
+        self._index_stale = 0
+
+    def _store_in_memory(self, path, value):
+        """Put `value` into the memory cache and index `path`."""
+        cache = self._cache
+        if (len(cache) >= cache.size) and (path not in cache):
+            # The least recently used entry will be removed.
+            self._index_stale += 1
+        cache[path] = value
+        self._add_to_index(path)
+
+    def _add_to_index(self, path):
+        """
+        Add `path` and, if necessary, its parents to the index.
+        Rebuild the index if it contains too many paths which aren't
+        in the cache anymore.
+        """
+        index = self._index
+        while True:
+            # Faster than `posixpath.dirname`
+            slash_index = path.rfind('/')
+            if slash_index > 0:
+                parent = path[:slash_index]
+            elif (slash_index == 0) and (path != '/'):
+                parent = '/'
+            else:
+                # Root directory or relative path without a directory
+                break
+            children = index.get(parent)
+            if children is None:
+                children = index[parent] = set()
+            elif path in children:
+                # The parents are already in the index.
+                break
+            children.add(path)
+            self._index_size += 1
+            path = parent
+        if self._index_stale > len(self._cache) + 1000:
+            self._rebuild_index()
+
+    def _rebuild_index(self):
+        """
+        Rebuild the index from the paths in the cache, so that it
+        doesn't contain paths which were removed from the cache.
+        """
+        self._index = {}
+        self._index_size = 0
+        self._index_stale = 0
+        for path in self._cache:
+            self._add_to_index(path)
 
     def invalidate(self, path):
         """
@@ -104,14 +236,43 @@ class StatCache(object):
         #  want to introduce a reference to the `FTPHost` object for
         #  only that purpose.
         assert path.startswith("/"), "%s must be an absolute path" % path
+        if self._backend is not None:
+            self._backend.delete(self._namespace, path)
         try:
             del self._cache[path]
+            self._index_stale += 1
         # Don't complain about lazy except clause
         # pylint: disable=W0704
         except lrucache.CacheKeyError:
             # Ignore errors
             pass
 
+    def invalidate_tree(self, path):
+        """
+        Invalidate the cache entries for the absolute `path` and all
+        paths below it. The time needed depends on the number of
+        these paths, not on the size of the cache.
+        """
+        assert path.startswith("/"), "%s must be an absolute path" % path
+        if self._backend is not None:
+            self._backend.delete_tree(self._namespace, path)
+        parent_children = self._index.get(posixpath.dirname(path))
+        if (parent_children is not None) and (path in parent_children):
+            parent_children.remove(path)
+            self._index_size -= 1
+        paths = [path]
+        while paths:
+            path = paths.pop()
+            try:
+                del self._cache[path]
+            # Don't complain about lazy except clause
+            # pylint: disable=W0704
+            except lrucache.CacheKeyError:
+                pass
+            children = self._index.pop(path, ())
+            self._index_size -= len(children)
+            paths.extend(children)
+
     def __getitem__(self, path):
         """
         Return the stat entry for the `path`. If there's no stored
@@ -119,6 +280,8 @@ class StatCache(object):
         """
         if not self._enabled:
             raise ftp_error.CacheMissError("cache is disabled")
+        if (self._backend is not None) and (path not in self._cache):
+            self._load(path)
         # Possibly raise a `CacheMissError` in `_age`
         if (self.max_age is not None) and (self._age(path) > self.max_age):
             self.invalidate(path)
@@ -140,7 +303,10 @@ class StatCache(object):
         """
         if not self._enabled:
             return
-        self._cache[path] = stat_result
+        self._store_in_memory(path, stat_result)
+        if self._backend is not None:
+            self._backend.store(self._namespace, path, time.time(),
+                                stat_result)
 
     def __contains__(self, path):
         """
@@ -173,3 +339,114 @@ class StatCache(object):
             lines.append("%s: %s" % (key, self[key]))
         return "\n".join(lines)
 
+
+
+class ListingCache(StatCache):
+    """
+    Cache for parsed directory listings, keyed by the absolute path
+    of the directory.
+
+    The interface is the same as that of `StatCache`, including
+    `max_age`, which is independent of the `max_age` of the stat
+    cache. Since each entry represents a whole directory, the
+    default number of entries is lower.
+    """
+    # Default number of cache entries
+    _DEFAULT_CACHE_SIZE = 100
+
+    def __init__(self):
+        StatCache.__init__(self)
+        # Listings with at least this number of lines are stored in a
+        #  compact, column-based form; `None` means never.
+        self.columnar_threshold = None
+
+
+def _locked(method_name):
+    """
+    Return a method which calls the method `method_name` of the base
+    class of `_SharedCacheMixin` with the cache's lock held.
+    """
+    def method(self, *args):
+        self._lock.acquire()
+        try:
+            return getattr(super(_SharedCacheMixin, self),
+                           method_name)(*args)
+        finally:
+            self._lock.release()
+    method.__name__ = method_name
+    return method
+
+
+class _SharedCacheMixin(object):
+    """
+    Make the methods of a cache class thread-safe, so that the cache
+    can be shared by `FTPHost` objects used in different threads.
+    """
+
+    def __init__(self):
+        # Reentrant because some methods call others.
+        self._lock = threading.RLock()
+        super(_SharedCacheMixin, self).__init__()
+
+    enable = _locked('enable')
+    disable = _locked('disable')
+    resize = _locked('resize')
+    set_backend = _locked('set_backend')
+    flush = _locked('flush')
+    clear = _locked('clear')
+    clear_memory = _locked('clear_memory')
+    invalidate = _locked('invalidate')
+    invalidate_tree = _locked('invalidate_tree')
+    __getitem__ = _locked('__getitem__')
+    __setitem__ = _locked('__setitem__')
+    __contains__ = _locked('__contains__')
+    __len__ = _locked('__len__')
+    __str__ = _locked('__str__')
+
+
+class SharedStatCache(_SharedCacheMixin, StatCache):
+    """Thread-safe `StatCache`."""
+
+
+class SharedListingCache(_SharedCacheMixin, ListingCache):
+    """Thread-safe `ListingCache`."""
+
+
+class CacheRegistry(object):
+    """
+    Registry of stat and listing caches which are shared by `FTPHost`
+    objects, usually for the same server and login.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Map keys to `(stat_cache, listing_cache)` tuples
+        self._caches = {}
+
+    def caches(self, key):
+        """
+        Return a tuple `(stat_cache, listing_cache)` for the hashable
+        `key`. If there are no caches for the key yet, make them.
+        """
+        self._lock.acquire()
+        try:
+            if key not in self._caches:
+                self._caches[key] = (SharedStatCache(), SharedListingCache())
+            return self._caches[key]
+        finally:
+            self._lock.release()
+
+    def remove(self, key):
+        """
+        Remove the caches for `key` from the registry. `FTPHost`
+        objects which use them keep them.
+        """
+        self._lock.acquire()
+        try:
+            self._caches.pop(key, None)
+        finally:
+            self._lock.release()
+
+
+# Caches shared with `FTPHost.share_caches`
+registry = CacheRegistry()
@@ -14,12 +14,17 @@ Tools for syncing combinations of local and remote directories.
 # - local -> local (perhaps implicitly possible due to design, but not targeted)
 
 import os
+import Queue
 import shutil
+import sys
+import threading
 
 from ftputil import FTPHost
+import file_transfer
+import ftp_batch
 import ftp_error
 
-__all__ = ['FTPHost', 'LocalHost', 'Syncer']
+__all__ = ['FTPHost', 'LocalHost', 'Syncer', 'TransferScheduler']
 
 
 # Used for copying file objects; value is 64 KB.
@@ -43,12 +48,436 @@ class LocalHost(object):
         """
         return 0.0
 
+    def rmtree(self, path):
+        """Remove the directory tree `path`."""
+        shutil.rmtree(path)
+
     def __getattr__(self, attr):
         return getattr(os, attr)
 
 
+def _copy_mtime(source, target, source_file, target_file, mtime=None):
+    """
+    If the `target` host supports it (i. e. it's local), set the
+    modification time of `target_file` to that of `source_file` on
+    the `source` host, so that a later sync finds the file unchanged.
+
+    `mtime` is the modification time of `source_file` in the local
+    time of the client (see `Syncer._manifest`). If it's `None`, it's
+    taken from a `stat` call on the source.
+    """
+    try:
+        utime = target.utime
+    except AttributeError:
+        return
+    if mtime is None:
+        mtime = source.stat(source_file).st_mtime - source.time_shift()
+    mtime = mtime + target.time_shift()
+    utime(target_file, (mtime, mtime))
+
+
+def _is_transient(exc):
+    """
+    Return `True` if the exception `exc` from a transfer is caused
+    by a temporary or a connection error, so that repeating the
+    transfer may succeed, else `False`.
+    """
+    if isinstance(exc, ftp_error.PermanentError):
+        return False
+    if isinstance(exc, ftp_error.FTPOSError):
+        # A `TemporaryError` or a connection error
+        return True
+    if isinstance(exc, ftp_error.FTPIOError) and \
+       not isinstance(exc, ftp_error.BatchTransferError):
+        # `FTPIOError`s don't keep the class of the `ftplib` error,
+        #  so use the reply code. Connection errors have none.
+        return (exc.errno is None) or (400 <= exc.errno < 500)
+    return False
+
+
+class _Cancelled(Exception):
+    """Raised in a worker thread to stop a cancelled transfer."""
+    pass
+
+
+class _HostPool(object):
+    """
+    Worker hosts for the transfers of a `TransferScheduler`, made from
+    the `FTPHost` object `host` when needed. At most `max_connections`
+    of them exist at a time (`None` means no limit). For a `LocalHost`
+    the host itself is used, since it doesn't need a connection.
+    """
+
+    def __init__(self, host, max_connections):
+        self._host = host
+        self._is_remote = isinstance(host, FTPHost)
+        self._max_connections = max_connections
+        # Protects the following attributes; notified when a worker
+        #  is returned or closed.
+        self._condition = threading.Condition()
+        self._idle = []
+        # Number of workers which exist or are being made
+        self._count = 0
+
+    def acquire(self, count):
+        """Return a list of `count` worker hosts, waiting if necessary."""
+        if not self._is_remote:
+            return [self._host] * count
+        condition = self._condition
+        condition.acquire()
+        try:
+            while (self._max_connections is not None) and \
+                  (len(self._idle) + self._max_connections - self._count <
+                   count):
+                condition.wait()
+            workers = self._idle[-count:]
+            del self._idle[len(self._idle)-len(workers):]
+            to_make = count - len(workers)
+            self._count += to_make
+        finally:
+            condition.release()
+        try:
+            while to_make:
+                workers.append(self._host._make_worker())
+                to_make -= 1
+        # Don't complain about lazy except clause
+        # pylint: disable=W0702
+        except:
+            condition.acquire()
+            try:
+                self._count -= to_make
+                condition.notifyAll()
+            finally:
+                condition.release()
+            self.release(workers)
+            raise
+        return workers
+
+    def release(self, workers, discard=False):
+        """
+        Return the `workers` to the pool. If `discard` is true, e. g.
+        because their connections may be broken, close them instead.
+        """
+        if not self._is_remote:
+            return
+        if discard:
+            for worker in workers:
+                self._close(worker)
+        condition = self._condition
+        condition.acquire()
+        try:
+            if discard:
+                self._count -= len(workers)
+            else:
+                self._idle.extend(workers)
+            condition.notifyAll()
+        finally:
+            condition.release()
+
+    def _close(self, worker):
+        """Close the `worker` without raising an exception."""
+        # Don't complain about lazy except clause
+        # pylint: disable=W0704
+        try:
+            worker.close()
+        except ftp_error.FTPError:
+            pass
+
+    def close(self):
+        """Close the unused workers."""
+        idle, self._idle = self._idle, []
+        self.release(idle, discard=True)
+
+
+class TransferScheduler(object):
+    """
+    Copy files from the `source` to the `target` host (each an
+    `FTPHost` or a `LocalHost` object) concurrently in up to
+    `max_workers` threads. Each thread transfers over its own
+    connections, which are made from the `FTPHost` objects; the
+    hosts themselves aren't used by the threads.
+
+    - The biggest files are transferred first, so the threads finish
+      at about the same time.
+
+    - At most `max_connections` connections are made to each FTP
+      server, or to the server if source and target are the same
+      `FTPHost` object; a transfer needs a connection to both source
+      and target. `None` means no limit besides `max_workers`.
+
+    - A transfer which fails with a temporary error (4xx) or a
+      connection error (e. g. a broken connection) is repeated up to
+      `max_retries` times with new connections. Permanent errors
+      (5xx) aren't retried.
+
+    - `cancel` stops the transfers. It may be called from another
+      thread or from the progress callback.
+
+    During `run`, the progress is available from the attributes
+    `files_total`, `files_done` (copied or failed), `bytes_total`
+    and `bytes_copied`.
+    """
+
+    def __init__(self, source, target,
+                 max_workers=ftp_batch.DEFAULT_MAX_WORKERS,
+                 max_connections=None, max_retries=2):
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1, not %r" %
+                             max_workers)
+        if (source is target) and isinstance(source, FTPHost):
+            min_connections = 2
+        else:
+            min_connections = 1
+        if (max_connections is not None) and \
+           (max_connections < min_connections):
+            raise ValueError("max_connections must be at least %d, not %r" %
+                             (min_connections, max_connections))
+        self._source = source
+        self._target = target
+        self.max_workers = max_workers
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self._cancelled = threading.Event()
+        self.files_total = self.files_done = 0
+        self.bytes_total = self.bytes_copied = 0
+
+    def cancel(self):
+        """
+        Stop the transfers. Transfers which haven't started yet are
+        skipped, running ones are stopped after their current chunk;
+        their target files remain incomplete.
+        """
+        self._cancelled.set()
+
+    def cancelled(self):
+        """Return `True` if the transfers were cancelled, else `False`."""
+        return self._cancelled.isSet()
+
+    def _size(self, path):
+        """Return the size of the source file `path` or 0 if unknown."""
+        try:
+            return self._source.path.getsize(path)
+        except (ftp_error.FTPOSError, OSError):
+            # Let the transfer report the problem.
+            return 0
+
+    def run(self, pairs, callback=None, mtimes=None):
+        """
+        Copy the files given by `pairs`, a sequence of `(source,
+        target)` path pairs. If given, `callback` is called in the
+        calling thread with the scheduler as argument whenever the
+        progress attributes have changed.
+
+        `mtimes` is an optional dictionary which maps source paths to
+        their modification times in the local time of the client. The
+        modification times of local targets are set from it instead
+        of stat'ing the sources again.
+
+        Return a list of the copied `(source, target)` pairs in the
+        order of `pairs`. If any transfers failed, raise
+        `BatchTransferError` after all other transfers are done.
+        """
+        # The workers have their own current directories.
+        pairs = [(self._source.path.abspath(source),
+                  self._target.path.abspath(target))
+                 for source, target in pairs]
+        if mtimes is None:
+            mtimes = {}
+        sizes = [self._size(source) for source, target in pairs]
+        self.files_total, self.files_done = len(pairs), 0
+        self.bytes_total, self.bytes_copied = sum(sizes), 0
+        if not pairs:
+            return []
+        # Biggest files first; the index keeps the order of the pairs
+        #  for files of the same size.
+        jobs = [(-size, index) for index, size in enumerate(sizes)]
+        jobs.sort()
+        job_queue, results = Queue.Queue(), Queue.Queue()
+        for ignored, index in jobs:
+            source, target = pairs[index]
+            job_queue.put((index, source, target, mtimes.get(source)))
+        source_pool = _HostPool(self._source, self.max_connections)
+        if self._target is self._source:
+            target_pool = source_pool
+        else:
+            target_pool = _HostPool(self._target, self.max_connections)
+        threads = []
+        for ignored in range(min(self.max_workers, len(pairs))):
+            thread = threading.Thread(target=self._work,
+                       args=(job_queue, results, source_pool, target_pool))
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+        try:
+            try:
+                copied_flags, errors = self._collect(pairs, results,
+                                                     callback)
+            # Don't complain about lazy except clause
+            # pylint: disable=W0702
+            except:
+                # For example, the callback raised an exception.
+                self.cancel()
+                raise
+        finally:
+            for thread in threads:
+                thread.join()
+            source_pool.close()
+            target_pool.close()
+        copied_pairs = [pair for pair, copied in zip(pairs, copied_flags)
+                        if copied]
+        if errors:
+            errors.sort()
+            errors = [(source, target, exc) for index, source, target, exc
+                      in errors]
+            raise ftp_error.BatchTransferError(errors, copied_pairs)
+        return copied_pairs
+
+    def _collect(self, pairs, results, callback):
+        """
+        Process the messages of the worker threads from the queue
+        `results` until all transfers have ended. Return a list of
+        flags for the copied pairs and a list of `(index, source,
+        target, exception)` tuples for the failed transfers.
+        """
+        copied_flags = [False] * len(pairs)
+        errors = []
+        ended = 0
+        while ended < len(pairs):
+            kind, index, value = results.get()
+            if kind == "progress":
+                self.bytes_copied += value
+            elif kind == "retry":
+                # Bytes of the failed attempt
+                self.bytes_copied -= value
+            else:
+                ended += 1
+                source, target = pairs[index]
+                if isinstance(self._target, FTPHost):
+                    self._target._stat.invalidate(target)
+                if kind == "copied":
+                    copied_flags[index] = True
+                    self.files_done += 1
+                elif kind == "failed":
+                    errors.append((index, source, target, value))
+                    self.files_done += 1
+                else:
+                    # Cancelled
+                    continue
+            if callback is not None:
+                callback(self)
+        return copied_flags, errors
+
+    def _work(self, jobs, results, source_pool, target_pool):
+        """
+        Take jobs from the queue `jobs` until it's empty and put
+        tuples `(kind, index, value)` describing the progress into
+        the queue `results`.
+        """
+        while True:
+            try:
+                index, source, target, mtime = jobs.get_nowait()
+            except Queue.Empty:
+                break
+            if self._cancelled.isSet():
+                results.put(("cancelled", index, None))
+                continue
+            self._transfer(index, source, target, mtime, results,
+                           source_pool, target_pool)
+
+    def _transfer(self, index, source, target, mtime, results, source_pool,
+                  target_pool):
+        """
+        Copy `source` to `target`, retrying if necessary. See `run`
+        for `mtime`.
+        """
+        attempt = 0
+        while True:
+            # Bytes copied in this attempt; a list to change it in
+            #  the callback.
+            copied = [0]
+            def progress(chunk):
+                """Report the `chunk` or stop if cancelled."""
+                if self._cancelled.isSet():
+                    raise _Cancelled()
+                copied[0] += len(chunk)
+                results.put(("progress", index, len(chunk)))
+            # Don't complain about lazy except clause; all exceptions
+            #  are passed to the calling thread.
+            # pylint: disable=W0702
+            try:
+                self._copy(source, target, mtime, progress, source_pool,
+                           target_pool)
+            except:
+                exc = sys.exc_info()[1]
+                if self._cancelled.isSet():
+                    # Maybe `_Cancelled` or an error from closing the
+                    #  files of the interrupted transfer
+                    results.put(("cancelled", index, None))
+                elif _is_transient(exc) and (attempt < self.max_retries):
+                    attempt += 1
+                    results.put(("retry", index, copied[0]))
+                    continue
+                else:
+                    results.put(("failed", index, exc))
+            else:
+                results.put(("copied", index, None))
+            break
+
+    def _copy(self, source, target, mtime, progress, source_pool,
+              target_pool):
+        """
+        Copy the file `source` to `target` with worker hosts from the
+        pools, calling `progress` for each chunk. See `run` for
+        `mtime`.
+        """
+        if source_pool is target_pool:
+            source_host, target_host = source_pool.acquire(2)
+        else:
+            source_host = source_pool.acquire(1)[0]
+            try:
+                target_host = target_pool.acquire(1)[0]
+            # Don't complain about lazy except clause
+            # pylint: disable=W0702
+            except:
+                source_pool.release([source_host])
+                raise
+        # Connections may be broken after other errors, so only reuse
+        #  them after a successful transfer or a permanent error.
+        discard = True
+        try:
+            try:
+                source_file = self._open(source_host, source, "rb")
+                try:
+                    target_file = self._open(target_host, target, "wb")
+                    try:
+                        file_transfer.copyfileobj(source_file, target_file,
+                                                  callback=progress)
+                    finally:
+                        target_file.close()
+                finally:
+                    source_file.close()
+                _copy_mtime(source_host, target_host, source, target, mtime)
+                discard = False
+            except ftp_error.PermanentError:
+                discard = False
+                raise
+        finally:
+            if source_pool is target_pool:
+                source_pool.release([source_host, target_host], discard)
+            else:
+                source_pool.release([source_host], discard)
+                target_pool.release([target_host], discard)
+
+    def _open(self, host, path, mode):
+        """Return a file object for `path` on the worker `host`."""
+        if isinstance(host, FTPHost):
+            return host._open_in_own_session(path, mode)
+        else:
+            return host.open(path, mode)
+
+
 class Syncer(object):
-    def __init__(self, source, target):
+    def __init__(self, source, target, max_workers=1, max_connections=None):
         """
         Init the `FTPSyncer` instance.
 
@@ -58,33 +487,21 @@ class Syncer(object):
         in. The semantics is so that the items under the source
         directory will show up under the target directory after the
         synchronization (unless there's an error).
+
+        If `max_workers` is greater than 1, the files of a directory
+        tree are copied concurrently with a `TransferScheduler`, which
+        gets `max_workers` and `max_connections`.
         """
         self._source = source
         self._target = target
+        self.max_workers = max_workers
+        self.max_connections = max_connections
 
-    def _mkdir(self, target_dir):
-        """
-        Try to create the target directory `target_dir`. If it already
-        exists, don't do anything. If the directory is present but
-        it's actually a file, raise a `SyncError`.
-        """
-        #TODO Handle setting of target mtime according to source mtime
-        #  (beware of rootdir anomalies; try to handle them as well).
-        #print "Making", target_dir
-        if self._target.path.isfile(target_dir):
-            raise ftp_error.SyncError("target dir '%s' is actually a file" %
-                                      target_dir)
-        if not self._target.path.isdir(target_dir):
-            self._target.mkdir(target_dir)
-
-    def _sync_file(self, source_file, target_file):
+    def _sync_file(self, source_file, target_file, mtime=None):
         #XXX This duplicates code from `FTPHost._copyfileobj`. Maybe
         #  implement the upload and download methods in terms of
         #  `_sync_file`, or maybe not?
         #TODO Handle `IOError`s
-        #TODO Handle conditional copy
-        #TODO Handle setting of target mtime according to source mtime
-        #  (beware of rootdir anomalies; try to handle them as well).
         #print "Syncing", source_file, "->", target_file
         source = self._source.open(source_file, "rb")
         try:
@@ -95,45 +512,214 @@ class Syncer(object):
                 target.close()
         finally:
             source.close()
+        _copy_mtime(self._source, self._target, source_file, target_file,
+                    mtime)
 
-    def _sync_tree(self, source_dir, target_dir):
+    def _manifest(self, host, top):
+        """
+        Return a dictionary for the items in the directory tree `top`
+        on `host`, made with a single walk over the tree. The keys are
+        tuples of the names in the path of an item, relative to `top`.
+        The values are tuples `(is_dir, size, mtime, precision)`; for
+        directories, only `is_dir` is set. `mtime` is converted to
+        the local time of the client, and `precision` is the maximum
+        error of `mtime` in seconds.
+
+        Files which can't be stat'ed, e. g. links pointing nowhere,
+        are left out. If `top` isn't a directory, the dictionary is
+        empty.
+        """
+        manifest = {}
+        if not host.path.isdir(top):
+            return manifest
+        join, time_shift = host.path.join, host.time_shift()
+        names_for_dir = {top: ()}
+        for dirpath, dirnames, filenames in host.walk(top):
+            names = names_for_dir.pop(dirpath)
+            for dirname in dirnames:
+                dir_names = names + (dirname,)
+                names_for_dir[join(dirpath, dirname)] = dir_names
+                manifest[dir_names] = (True, None, None, None)
+            for filename in filenames:
+                try:
+                    stat_result = host.stat(join(dirpath, filename))
+                except (ftp_error.FTPOSError, OSError):
+                    continue
+                precision = getattr(stat_result, '_st_mtime_precision',
+                                    None) or 1.0
+                manifest[names + (filename,)] = \
+                  (False, stat_result.st_size,
+                   stat_result.st_mtime - time_shift, precision)
+        return manifest
+
+    def _is_changed(self, source_entry, target_entry):
+        """
+        Return `True` if the source file described by `source_entry`
+        has to be copied over the target file described by
+        `target_entry` (see `_manifest`), else `False`.
+        """
+        ignored, source_size, source_mtime, source_precision = source_entry
+        ignored, target_size, target_mtime, target_precision = target_entry
+        if source_size != target_size:
+            return True
+        # The target is usually newer than the source unless the
+        #  modification time of the target could be set after the
+        #  copy, in which case the times are equal.
+        return source_mtime > \
+               target_mtime + max(source_precision, target_precision)
+
+    def plan(self, source_dir, target_dir, delete=False):
+        """
+        Return a list of the actions needed to update the target
+        directory tree `target_dir` to match the source directory tree
+        `source_dir`, without changing anything. The actions are
+        tuples:
+
+        - `("mkdir", target_path)`
+        - `("copy", source_path, target_path)`
+        - `("delete", target_path)` for a file or a directory tree
+
+        Files are only copied if they're missing on the target, have
+        another size or the source is newer than the target. If
+        `delete` is true, items on the target which aren't on the
+        source are deleted; otherwise they're left alone. If a
+        directory on one side is a file on the other side, the target
+        item is replaced if `delete` is true, else a `SyncError` is
+        raised.
+        """
+        return self._plan(source_dir, target_dir, delete)[0]
+
+    def _plan(self, source_dir, target_dir, delete):
+        """
+        Return a tuple of the actions (see `plan`) and a dictionary
+        which maps the source paths of the copied files to their
+        modification times from the manifest.
+        """
+        source_dir = self._source.path.abspath(source_dir)
+        target_dir = self._target.path.abspath(target_dir)
+        source_manifest = self._manifest(self._source, source_dir)
+        target_manifest = self._manifest(self._target, target_dir)
+        source_join, target_join = self._source.path.join, \
+                                   self._target.path.join
+        actions, mtimes = [], {}
+        if self._target.path.isfile(target_dir):
+            raise ftp_error.SyncError("target dir '%s' is actually a file" %
+                                      target_dir)
+        if not self._target.path.isdir(target_dir):
+            actions.append(("mkdir", target_dir))
+        # Sorting puts directories before the items in them.
+        source_names = source_manifest.keys()
+        source_names.sort()
+        for names in source_names:
+            source_entry = source_manifest[names]
+            target_entry = target_manifest.get(names)
+            target_path = target_join(target_dir, *names)
+            if (target_entry is not None) and \
+               (target_entry[0] != source_entry[0]):
+                if not delete:
+                    raise ftp_error.SyncError(
+                          "can't replace '%s' with an item of another type" %
+                          target_path)
+                actions.append(("delete", target_path))
+                target_entry = None
+            if source_entry[0]:
+                if target_entry is None:
+                    actions.append(("mkdir", target_path))
+            elif (target_entry is None) or \
+                 self._is_changed(source_entry, target_entry):
+                source_path = source_join(source_dir, *names)
+                actions.append(("copy", source_path, target_path))
+                mtimes[source_path] = source_entry[2]
+        if delete:
+            target_names = target_manifest.keys()
+            target_names.sort()
+            for names in target_names:
+                # Items in replaced or deleted directories are removed
+                #  with them.
+                parent_entry = source_manifest.get(names[:-1],
+                                                   (len(names) == 1,))
+                if (names not in source_manifest) and parent_entry[0]:
+                    actions.append(("delete", target_join(target_dir,
+                                                          *names)))
+        return actions, mtimes
+
+    def _execute(self, action, mtimes):
+        """
+        Execute an `action` returned by `plan`. `mtimes` maps source
+        paths to modification times (see `_plan`).
+        """
+        if action[0] == "mkdir":
+            self._target.mkdir(action[1])
+        elif action[0] == "copy":
+            self._sync_file(action[1], action[2], mtimes.get(action[1]))
+        else:
+            target_path = action[1]
+            if self._target.path.isdir(target_path) and \
+               not self._target.path.islink(target_path):
+                self._target.rmtree(target_path)
+            else:
+                self._target.remove(target_path)
+
+    def _sync_tree(self, source_dir, target_dir, delete=False,
+                   dry_run=False, callback=None):
         """
         Synchronize the source and the target directory tree by
         updating the target to match the source as far as possible.
+        Return the executed actions (see `plan`); if `dry_run` is true,
+        return them without executing them.
+
+        For concurrent transfers, the directories are made and the
+        deletions done first, then the files are copied.
 
         Current limitations:
-        - _don't_ delete items which are on the target path but not on the
-          source path
-        - files are always copied, the modification timestamps are not
-          compared
         - all files are copied in binary mode, never in ASCII/text mode
+        - the modification times of remote targets can't be set, so
+          a file is copied again only if its size changes or the
+          source becomes newer than the copy
         - incomplete error handling
         """
-        self._mkdir(target_dir)
-        for dirpath, dirnames, filenames in self._source.walk(source_dir):
-            for dirname in dirnames:
-                inner_source_dir = self._source.path.join(dirpath, dirname)
-                inner_target_dir = inner_source_dir.replace(source_dir,
-                                                            target_dir, 1)
-                self._mkdir(inner_target_dir)
-            for filename in filenames:
-                source_file = self._source.path.join(dirpath, filename)
-                target_file = source_file.replace(source_dir, target_dir, 1)
-                self._sync_file(source_file, target_file)
+        actions, mtimes = self._plan(source_dir, target_dir, delete)
+        if dry_run:
+            return actions
+        if self.max_workers == 1:
+            for action in actions:
+                self._execute(action, mtimes)
+            return actions
+        copies = []
+        for action in actions:
+            if action[0] == "copy":
+                copies.append(action[1:])
+            else:
+                self._execute(action, mtimes)
+        scheduler = TransferScheduler(self._source, self._target,
+                                      self.max_workers, self.max_connections)
+        scheduler.run(copies, callback, mtimes)
+        return actions
 
-    def sync(self, source_path, target_path):
+    def sync(self, source_path, target_path, delete=False, dry_run=False,
+             callback=None):
         """
         Synchronize `source_path` and `target_path` (both are strings,
         each denoting a directory or file path), i. e. update the
         target path so that it's a copy of the source path.
 
         This method handles both directory trees and single files.
+        For directory trees, only changed files are copied, and if
+        `delete` is true, items which aren't on the source are removed
+        from the target. Return the list of actions (see `plan`). If
+        `dry_run` is true, only return the actions.
+
+        For concurrent transfers, `callback` is the progress callback
+        of `TransferScheduler.run`.
         """
         #TODO Handle making of missing intermediate directories
         source_path = self._source.path.abspath(source_path)
         target_path = self._target.path.abspath(target_path)
         if self._source.path.isfile(source_path):
-            self._sync_file(source_path, target_path)
+            actions = [("copy", source_path, target_path)]
+            if not dry_run:
+                self._sync_file(source_path, target_path)
+            return actions
         else:
-            self._sync_tree(source_path, target_path)
-
+            return self._sync_tree(source_path, target_path, delete,
+                                   dry_run, callback)
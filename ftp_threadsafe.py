@@ -0,0 +1,508 @@
+# Copyright (C) 2010, Stefan Schwarzer <sschwarzer@sschwarzer.net>
+# See the file LICENSE for licensing terms.
+
+"""
+ftp_threadsafe.py - `FTPHost`-like class which can be used by several
+threads
+
+    host = ftp_threadsafe.ThreadSafeFTPHost('ftp.domain.com', 'me',
+                                            'secret')
+    host.max_sessions = 8
+    # In any thread
+    host.chdir('some_dir')
+    names = host.listdir(host.curdir)
+    ...
+    host.close()
+"""
+
+import Queue
+import posixpath
+import sys
+import threading
+import traceback
+
+import ftp_error
+import ftp_stat_cache
+import ftputil
+
+
+__all__ = ['ThreadSafeFTPHost', 'Future']
+
+
+def _forwarded(method_name):
+    """
+    Return a method which calls the `FTPHost` method `method_name`
+    with a session from the pool.
+    """
+    def method(self, *args, **kwargs):
+        return self._call(method_name, args, kwargs)
+    method.__name__ = method_name
+    method.__doc__ = "Like `FTPHost.%s`." % method_name
+    return method
+
+
+class Future(object):
+    """
+    Result of an operation started with `ThreadSafeFTPHost.submit`,
+    which becomes available when the operation has finished.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._done = False
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def _set(self, result, exc_info):
+        """
+        Store the `result` of the operation or, if it failed, the
+        `exc_info` tuple and call the callbacks.
+        """
+        self._condition.acquire()
+        try:
+            self._result, self._exc_info = result, exc_info
+            self._done = True
+            callbacks, self._callbacks = self._callbacks, []
+            self._condition.notifyAll()
+        finally:
+            self._condition.release()
+        for callback in callbacks:
+            self._call(callback)
+
+    def _call(self, callback):
+        """
+        Call `callback` with the future. If it raises an exception,
+        print the traceback to `sys.stderr` like an uncaught exception
+        in a thread, but don't pass the exception on, so that the
+        thread which executed the operation keeps working.
+        """
+        # Don't complain about lazy except clause
+        # pylint: disable=W0702
+        try:
+            callback(self)
+        except:
+            traceback.print_exc()
+
+    def done(self):
+        """Return `True` if the operation has finished, else `False`."""
+        return self._done
+
+    def wait(self, timeout=None):
+        """
+        Wait until the operation has finished or `timeout` seconds
+        have passed. Return `True` if the operation has finished.
+        """
+        self._condition.acquire()
+        try:
+            if not self._done:
+                self._condition.wait(timeout)
+            return self._done
+        finally:
+            self._condition.release()
+
+    def result(self):
+        """
+        Wait until the operation has finished and return its result.
+        If the operation raised an exception, raise it again.
+        """
+        self.wait()
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self):
+        """
+        Wait until the operation has finished and return the exception
+        it raised or `None`.
+        """
+        self.wait()
+        if self._exc_info is None:
+            return None
+        return self._exc_info[1]
+
+    def add_done_callback(self, callback):
+        """
+        Call `callback` with the future as argument when the operation
+        has finished, in the thread which executed the operation. If
+        it has already finished, call `callback` immediately.
+        """
+        self._condition.acquire()
+        try:
+            if not self._done:
+                self._callbacks.append(callback)
+                return
+        finally:
+            self._condition.release()
+        self._call(callback)
+
+
+class _Path(object):
+    """
+    Thread-safe counterpart of `FTPHost.path`. Each function call
+    which needs the server is made with a session from the pool of
+    the `ThreadSafeFTPHost`.
+    """
+
+    def __init__(self, host):
+        self._host = host
+        # Delegate these to the `posixpath` module, like
+        #  `ftp_path._Path`; they don't need a session.
+        # pylint: disable=C0103
+        pp = posixpath
+        self.dirname      = pp.dirname
+        self.basename     = pp.basename
+        self.isabs        = pp.isabs
+        self.commonprefix = pp.commonprefix
+        self.join         = pp.join
+        self.split        = pp.split
+        self.splitdrive   = pp.splitdrive
+        self.splitext     = pp.splitext
+        self.normcase     = pp.normcase
+        self.normpath     = pp.normpath
+
+    def __getattr__(self, attr_name):
+        host = self._host
+        def method(*args):
+            """Call the function with a session from the pool."""
+            session = host._acquire()
+            try:
+                return getattr(session.path, attr_name)(*args)
+            finally:
+                host._release(session)
+        return method
+
+
+class ThreadSafeFTPHost(object):
+    """
+    Facade for `FTPHost` objects which can be shared by several
+    threads. The constructor arguments are the same as for `FTPHost`.
+
+    Each operation is done with an `FTPHost` object (a session) from
+    a pool, which is used by only one thread at a time. Sessions are
+    made when needed, up to `max_sessions`; if all of them are busy,
+    an operation waits until a session is returned to the pool. The
+    sessions share a thread-safe stat cache and listing cache.
+
+    Each thread has its own current directory, which `chdir` and
+    `getcwd` refer to. It starts with the login directory.
+
+    With `submit`, operations can be run in the background without a
+    thread for each of them.
+    """
+
+    # Default for the `max_sessions` attribute
+    _DEFAULT_MAX_SESSIONS = 4
+
+    def __init__(self, *args, **kwargs):
+        self._args = args
+        self._kwargs = kwargs
+        self.max_sessions = self._DEFAULT_MAX_SESSIONS
+        self.closed = False
+        # Protects the following attributes; notified when a session
+        #  becomes available.
+        self._condition = threading.Condition()
+        # All sessions and the unused ones
+        self._sessions = []
+        self._idle = []
+        # Number of sessions being made
+        self._pending = 0
+        # The current directory of each thread, if it has changed it
+        self._local = threading.local()
+        # Key for the caches shared by the sessions
+        self._cache_key = ("ThreadSafeFTPHost", id(self))
+        # Operations started with `submit` and the threads which
+        #  execute them
+        self._jobs = Queue.Queue()
+        self._workers = []
+        session = self._make_session()
+        self._sessions.append(session)
+        self._idle.append(session)
+        self._login_dir = session.getcwd()
+        self.curdir, self.pardir, self.sep = \
+          session.curdir, session.pardir, session.sep
+        self.stat_cache = session.stat_cache
+        self.listing_cache = session.listing_cache
+        self.path = _Path(self)
+
+    #
+    # Session pool
+    #
+    def _make_session(self):
+        """
+        Return a new `FTPHost` object which shares the caches of the
+        other sessions and uses the same time shift and parser as the
+        first session.
+        """
+        session = ftputil.FTPHost(*self._args, **self._kwargs)
+        session.share_caches(self._cache_key)
+        if self._sessions:
+            model = self._sessions[0]
+            session.set_time_shift(model.time_shift())
+            session._stat._parser = model._stat._parser
+            session._stat._allow_parser_switching = \
+              model._stat._allow_parser_switching
+            session._stat._use_mlsd = model._stat._use_mlsd
+        return session
+
+    def _acquire(self):
+        """
+        Return an unused session, making one if necessary and allowed,
+        and change its current directory to that of the calling
+        thread.
+        """
+        condition = self._condition
+        condition.acquire()
+        try:
+            while True:
+                if self.closed:
+                    raise ValueError("ThreadSafeFTPHost object is closed")
+                if self._idle:
+                    session = self._idle.pop()
+                    break
+                if len(self._sessions) + self._pending < self.max_sessions:
+                    self._pending += 1
+                    session = None
+                    break
+                condition.wait()
+        finally:
+            condition.release()
+        if session is None:
+            # Log in without holding the lock.
+            try:
+                session = self._make_session()
+            finally:
+                condition.acquire()
+                try:
+                    self._pending -= 1
+                    if session is not None:
+                        self._sessions.append(session)
+                    else:
+                        # Let another thread try.
+                        condition.notify()
+                finally:
+                    condition.release()
+        try:
+            current_dir = self.getcwd()
+            if session.getcwd() != current_dir:
+                session.chdir(current_dir)
+        # Don't complain about lazy except clause
+        # pylint: disable=W0702
+        except:
+            self._release(session)
+            raise
+        return session
+
+    def _release(self, session):
+        """Return the `session` to the pool."""
+        condition = self._condition
+        condition.acquire()
+        try:
+            if self.closed:
+                session.close()
+            else:
+                self._idle.append(session)
+                condition.notify()
+        finally:
+            condition.release()
+
+    def _call(self, method_name, args, kwargs):
+        """Call the `FTPHost` method with a session from the pool."""
+        session = self._acquire()
+        try:
+            return getattr(session, method_name)(*args, **kwargs)
+        finally:
+            self._release(session)
+
+    def close(self):
+        """
+        Close the unused sessions. Sessions which are in use are closed
+        when the operation using them has finished.
+        """
+        self._condition.acquire()
+        try:
+            if self.closed:
+                return
+            self.closed = True
+            idle, self._idle = self._idle, []
+            # Stop the worker threads after the submitted operations.
+            for worker in self._workers:
+                self._jobs.put(None)
+            # Wake up threads waiting for a session.
+            self._condition.notifyAll()
+        finally:
+            self._condition.release()
+        try:
+            for session in idle:
+                session.close()
+        finally:
+            ftp_stat_cache.registry.remove(self._cache_key)
+
+    #
+    # Operations in the background
+    #
+    def submit(self, method_name, *args, **kwargs):
+        """
+        Start the operation `method_name` (e. g. "download") with the
+        given arguments in the background and return a `Future` for
+        its result.
+
+        The operations are executed by at most `max_sessions` worker
+        threads, so you can submit many more operations than there
+        are sessions. Relative paths refer to the current directory of
+        the calling thread at the time of the `submit` call.
+        """
+        if self.closed:
+            raise ValueError("ThreadSafeFTPHost object is closed")
+        # Raise an `AttributeError` for unknown methods right away.
+        getattr(self, method_name)
+        future = Future()
+        self._jobs.put((future, self.getcwd(), method_name, args, kwargs))
+        self._condition.acquire()
+        try:
+            if len(self._workers) < min(self.max_sessions,
+                                        self._jobs.qsize()):
+                worker = threading.Thread(target=self._work)
+                worker.setDaemon(True)
+                worker.start()
+                self._workers.append(worker)
+        finally:
+            self._condition.release()
+        return future
+
+    def _work(self):
+        """Execute submitted operations until told to stop."""
+        try:
+            while True:
+                job = self._jobs.get()
+                if job is None:
+                    break
+                future, current_dir, method_name, args, kwargs = job
+                self._local.current_dir = current_dir
+                try:
+                    result = getattr(self, method_name)(*args, **kwargs)
+                # Don't complain about lazy except clause
+                # pylint: disable=W0702
+                except:
+                    future._set(None, sys.exc_info())
+                else:
+                    future._set(result, None)
+        finally:
+            # If the thread ends unexpectedly, let `submit` start
+            #  another one.
+            self._condition.acquire()
+            try:
+                self._workers.remove(threading.currentThread())
+            finally:
+                self._condition.release()
+
+    #
+    # Current directory of the calling thread
+    #
+    def getcwd(self):
+        """Return the current directory of the calling thread."""
+        return getattr(self._local, 'current_dir', self._login_dir)
+
+    def chdir(self, path):
+        """Change the current directory of the calling thread."""
+        session = self._acquire()
+        try:
+            session.chdir(path)
+            self._local.current_dir = session.getcwd()
+        finally:
+            self._release(session)
+
+    #
+    # Settings for all sessions
+    #
+    def set_time_shift(self, time_shift):
+        """Set the time shift for all sessions (see `FTPHost`)."""
+        self._condition.acquire()
+        try:
+            for session in self._sessions:
+                session.set_time_shift(time_shift)
+        finally:
+            self._condition.release()
+
+    def time_shift(self):
+        """Return the time shift between FTP server and client."""
+        return self._sessions[0].time_shift()
+
+    def set_parser(self, parser):
+        """Set the directory parser for all sessions (see `FTPHost`)."""
+        self._condition.acquire()
+        try:
+            for session in self._sessions:
+                session.set_parser(parser)
+        finally:
+            self._condition.release()
+
+    #
+    # Operations
+    #
+    file = _forwarded('file')
+    open = file
+    listdir = _forwarded('listdir')
+    lstat = _forwarded('lstat')
+    stat = _forwarded('stat')
+    mkdir = _forwarded('mkdir')
+    makedirs = _forwarded('makedirs')
+    rmdir = _forwarded('rmdir')
+    remove = _forwarded('remove')
+    unlink = remove
+    rmtree = _forwarded('rmtree')
+    rename = _forwarded('rename')
+    chmod = _forwarded('chmod')
+    upload = _forwarded('upload')
+    download = _forwarded('download')
+    upload_if_newer = _forwarded('upload_if_newer')
+    download_if_newer = _forwarded('download_if_newer')
+    scan_tree = _forwarded('scan_tree')
+    keep_alive = _forwarded('keep_alive')
+
+    def walk(self, top, topdown=True, onerror=None):
+        """
+        Iterate over the directory tree `top` like `FTPHost.walk`. A
+        session is only used to classify the items of a directory,
+        not between the iterations.
+        """
+        return self._walk(top, topdown, onerror, True)
+
+    def _walk(self, top, topdown, onerror, check_isdir):
+        """
+        Implement `walk`. If `check_isdir` is false, `top` is known
+        to be a directory, so its parent directory doesn't need to
+        be listed to check this.
+        """
+        # The following code is adapted from `FTPHost._walk`.
+        try:
+            dirs, nondirs, links = self._call('_classify_items',
+                                              (top, check_isdir), {})
+        except ftp_error.FTPOSError, err:
+            if onerror is not None:
+                onerror(err)
+            return
+        if topdown:
+            yield top, dirs, nondirs
+        for name in dirs:
+            if name not in links:
+                path = self.path.join(top, name)
+                for item in self._walk(path, topdown, onerror, False):
+                    yield item
+        if not topdown:
+            yield top, dirs, nondirs
+
+    #
+    # Context manager methods
+    #
+    def __enter__(self):
+        # Return `self`, so it can be accessed as the variable
+        #  component of the `with` statement.
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # We don't need the `exc_*` arguments here
+        # pylint: disable=W0613
+        self.close()
+        # Be explicit
+        return False
@@ -42,9 +42,11 @@ FTPFile objects
     usual file operations for non-seekable files (`read`, `readline`,
     `readlines`, `write`, `writelines`, `close`).
 
-Note: ftputil currently is not threadsafe. More specifically, you can
+Note: `FTPHost` objects aren't threadsafe. More specifically, you can
       use different `FTPHost` objects in different threads but not
-      using a single `FTPHost` object in different threads.
+      using a single `FTPHost` object in different threads. If you
+      want to share an object between threads, use a
+      `ftp_threadsafe.ThreadSafeFTPHost`.
 """
 
 import ftplib
@@ -54,10 +56,14 @@ import time
 import warnings
 
 import file_transfer
+import ftp_batch
 import ftp_error
 import ftp_file
 import ftp_path
+import ftp_pool
+import ftp_scandir
 import ftp_stat
+import ftp_stat_cache
 import ftputil_version
 
 
@@ -90,7 +96,9 @@ class FTPHost(object):
     # On the other hand, the initially constructed host object will
     # store references to already established `_FTPFile` objects and
     # reuse an associated connection if its associated `_FTPFile`
-    # has been closed.
+    # has been closed. These children are managed by a pool (see
+    # `ftp_pool.ChildPool`) which can be configured via the
+    # `child_pool` attribute.
 
     def __init__(self, *args, **kwargs):
         """Abstract initialization of `FTPHost` object."""
@@ -107,10 +115,20 @@ class FTPHost(object):
         self._stat = ftp_stat._Stat(self)
         self.stat_cache = self._stat._lstat_cache
         self.stat_cache.enable()
+        self.listing_cache = self._stat._listing_cache
+        # Key of the shared caches if `share_caches` was called
+        self._shared_cache_key = None
         self._cached_current_dir = \
           ftp_error._try_with_oserror(self._session.pwd)
+        # Current directory of the session on the server. This differs
+        #  from `_cached_current_dir` only if the path policy isn't
+        #  "robust".
+        self._session_dir = self._cached_current_dir
+        self._path_policy = 'robust'
+        # Number of `CWD` commands avoided due to the path policy
+        self.round_trips_saved = 0
         # Associated `FTPHost` objects for data transfer
-        self._children = []
+        self.child_pool = ftp_pool.ChildPool()
         # This is only set to something else than `None` if this instance
         #  represents an `_FTPFile`.
         self._file = None
@@ -162,49 +180,44 @@ class FTPHost(object):
         #  session) but doesn't copy the state of `self.getcwd()`.
         return FTPHost(*self._args, **self._kwargs)
 
-    def _available_child(self):
-        """
-        Return an available (i. e. one whose `_file` object is closed
-        and doesn't have a timed-out server connection) child
-        (`FTPHost` object) from the pool of children or `None` if
-        there aren't any.
-        """
-        #TODO: Currently timed-out child sessions aren't removed and
-        #  may collect over time. In very busy or long running
-        #  processes, this might slow down an application because the
-        #  same stale child sessions have to processed again and again.
-        for host in self._children:
-            # Test for timeouts only after testing for a closed file:
-            # - If a file isn't closed, save time; don't bother to access
-            #   the remote server.
-            # - If a file transfer on the child is in progress, requesting
-            #   the directory is an invalid operation because of the way
-            #   the FTP state machine works (see RFC 959).
-            if host._file.closed:
-                try:
-                    host._session.pwd()
-                # Timed-out sessions raise `error_temp`.
-                except ftplib.error_temp:
-                    continue
-                else:
-                    # Everything's ok; use this `FTPHost` instance.
-                    return host
-        # Be explicit.
-        return None
-
-    def file(self, path, mode='r'):
+    def _make_child(self):
         """
-        Return an open file(-like) object which is associated with
-        this `FTPHost` object.
+        Return a new child `FTPHost` object with an (unopened)
+        `_FTPFile` object.
+        """
+        host = self._copy()
+        host._file = ftp_file._FTPFile(host)
+        host._path_policy = self._path_policy
+        return host
 
-        This method tries to reuse a child but will generate a new one
-        if none is available.
+    def _children(self):
+        """Return a list of the child `FTPHost` objects."""
+        return self.child_pool.children()
+
+    _children = property(_children)
+
+    def _make_worker(self):
+        """
+        Return a new `FTPHost` object for batch transfers (see
+        `upload_many` and `download_many`). Other than a child, the
+        worker uses the time shift and parser of this host.
+        """
+        worker = self._make_child()
+        worker.set_time_shift(self.time_shift())
+        worker._stat._parser = self._stat._parser
+        worker._stat._allow_parser_switching = \
+          self._stat._allow_parser_switching
+        worker._stat._use_mlsd = self._stat._use_mlsd
+        if self._shared_cache_key is not None:
+            worker.share_caches(self._shared_cache_key)
+        return worker
+
+    def _open_with(self, host, path, mode, rest=None):
+        """
+        Open the file `path` (relative to the current directory of
+        this `FTPHost` object) with the session of `host` and return
+        the `_FTPFile` object of `host`. See `file` for `rest`.
         """
-        host = self._available_child()
-        if host is None:
-            host = self._copy()
-            self._children.append(host)
-            host._file = ftp_file._FTPFile(host)
         basedir = self.getcwd()
         # Prepare for changing the directory (see whitespace workaround
         #  in method `_dir`).
@@ -215,39 +228,81 @@ class FTPHost(object):
         effective_dir, effective_file = host.path.split(effective_path)
         try:
             # This will fail if we can't access the directory at all.
-            host.chdir(effective_dir)
+            self._chdir_with(host, effective_dir)
         except ftp_error.PermanentError:
             # Similarly to a failed `file` in a local filesystem, we
             #  raise an `IOError`, not an `OSError`.
             raise ftp_error.FTPIOError("remote directory '%s' doesn't exist "
                   "or has insufficient access rights" % effective_dir)
-        host._file._open(effective_file, mode)
-        if 'w' in mode:
-            # Invalidate cache entry because size and timestamps will change.
-            self.stat_cache.invalidate(effective_path)
+        host._file._open(effective_file, mode, rest)
         return host._file
 
+    def _chdir_with(self, host, path):
+        """
+        Change the directory of the child or worker `host` to the
+        absolute `path`, according to the path policy of this
+        `FTPHost` object.
+        """
+        if self._path_policy == 'robust':
+            host.chdir(path)
+        elif not host._session_chdir(path):
+            self.round_trips_saved += 1
+
+    def _open_in_own_session(self, path, mode, rest=None):
+        """
+        Open the file `path` with the session of this `FTPHost`
+        object, which must have been made by `_make_worker`. Until
+        the file is closed, this `FTPHost` object can't be used for
+        anything else.
+        """
+        return self._open_with(self, path, mode, rest)
+
+    def file(self, path, mode='r', rest=None):
+        """
+        Return an open file(-like) object which is associated with
+        this `FTPHost` object.
+
+        Modes 'a' and 'ab' append to the remote file. If `rest` is
+        given, reading or writing starts at this byte offset of the
+        remote file; this requires a binary mode.
+
+        This method tries to reuse a child but will generate a new one
+        if none is available.
+        """
+        def open_child(host):
+            """Open the file with the child `host`."""
+            return self._open_with(host, path, mode, rest)
+        file_obj = self.child_pool.open(self._make_child, open_child)
+        if ('w' in mode) or ('a' in mode):
+            effective_path = self.path.join(self.getcwd(), path)
+            # Invalidate cache entries because size and timestamps will
+            #  change.
+            self._stat.invalidate(effective_path)
+        return file_obj
+
     open = file
 
     def close(self):
         """Close host connection."""
         if self.closed:
             return
-        # Close associated children
-        for host in self._children:
-            # Children have a `_file` attribute which is an `_FTPFile` object.
-            host._file.close()
-            host.close()
-        # Now deal with ourself
         try:
+            # Close associated children
+            self.child_pool.close()
+            # Now deal with ourself
             ftp_error._try_with_oserror(self._session.close)
         finally:
             # If something went wrong before, the host/session is
             #  probably defunct and subsequent calls to `close` won't
             #  help either, so we consider the host/session closed for
             #  practical purposes.
-            self.stat_cache.clear()
-            self._children = []
+            self.stat_cache.flush()
+            self.listing_cache.flush()
+            # Shared caches are still used by other `FTPHost` objects.
+            #  Entries in a persistent backend are kept, too.
+            if self._shared_cache_key is None:
+                self.stat_cache.clear_memory()
+                self.listing_cache.clear_memory()
             self.closed = True
 
     def __del__(self):
@@ -259,6 +314,78 @@ class FTPHost(object):
             # We don't want warnings if the constructor failed.
             pass
 
+    #
+    # Persistent caches
+    #
+    def set_cache_backend(self, backend, namespace=None):
+        """
+        Use the persistent `backend` (see `ftp_cache_backend`) for
+        the stat cache and the listing cache. If `backend` is `None`,
+        don't use a backend anymore.
+
+        The entries are stored under the string `namespace`, followed
+        by the kind of the cache. The default namespace is made from
+        the host name, the port and the user name, so that entries
+        for different servers and logins don't get mixed up.
+        """
+        if namespace is None:
+            namespace = "%s:%s %s" % self._cache_key()
+        self.stat_cache.set_backend(backend, namespace + " stat")
+        self.listing_cache.set_backend(backend, namespace + " listing")
+
+    def share_caches(self, key=None):
+        """
+        Use the stat cache and the listing cache shared by all
+        `FTPHost` objects which called `share_caches` with the same
+        `key`, instead of the own caches. The shared caches are
+        thread-safe, and invalidations by one `FTPHost` object are
+        seen by all others.
+
+        The default key is a tuple `(host, port, user)` made from the
+        arguments of the constructor.
+        """
+        if key is None:
+            key = self._cache_key()
+        stat_cache, listing_cache = ftp_stat_cache.registry.caches(key)
+        self._stat._lstat_cache = self.stat_cache = stat_cache
+        self._stat._listing_cache = self.listing_cache = listing_cache
+        self._shared_cache_key = key
+
+    def _reset_caches(self):
+        """
+        Empty the caches after a change of the listing format. Shared
+        caches are still used by other `FTPHost` objects with their
+        format, so use own caches instead of emptying shared ones.
+        """
+        if self._shared_cache_key is None:
+            self.stat_cache.clear()
+            self.listing_cache.clear()
+            return
+        self.stat_cache.flush()
+        self.listing_cache.flush()
+        self._stat._lstat_cache = self.stat_cache = \
+          ftp_stat_cache.StatCache()
+        self._stat._listing_cache = self.listing_cache = \
+          ftp_stat_cache.ListingCache()
+        self._shared_cache_key = None
+
+    def _cache_key(self):
+        """
+        Return a tuple `(host, port, user)` made from the arguments
+        of the constructor, which identifies the server and the login
+        for shared and persistent caches.
+        """
+        args, kwargs = self._args, self._kwargs
+        host, user = '', ''
+        if len(args) > 0:
+            host = args[0]
+        if len(args) > 1:
+            user = args[1]
+        host = kwargs.get('host', host)
+        user = kwargs.get('user', user)
+        port = getattr(self._session, 'port', '')
+        return (host, port, user)
+
     #
     # Setting a custom directory parser
     #
@@ -285,10 +412,84 @@ class FTPHost(object):
           assumed to contain stat information.
         """
         # The cache contents, if any, probably aren't useful.
-        self.stat_cache.clear()
+        self._reset_caches()
         # Set the parser explicitly, don't allow "smart" switching anymore.
         self._stat._parser = parser
         self._stat._allow_parser_switching = False
+        # The parser is for `DIR` listings.
+        self._stat._use_mlsd = False
+
+    def set_mlsd(self, enabled):
+        """
+        If `enabled` is true (the default), use the `MLSD` and `MLST`
+        commands for directory listings and stat'ing if the server
+        supports them. If `enabled` is false, always use the `DIR`
+        command and the parsers for its output.
+        """
+        self._reset_caches()
+        if enabled:
+            # Check the server features again on the next listing.
+            self._stat._use_mlsd = None
+        else:
+            if self._stat._use_mlsd:
+                # Start again with the default parser.
+                self._stat._parser = ftp_stat.UnixParser()
+                self._stat._allow_parser_switching = True
+            self._stat._use_mlsd = False
+
+    #
+    # Handling of the session's current directory
+    #
+    def set_path_policy(self, policy):
+        """
+        Set the policy for running FTP commands on paths. `policy`
+        is one of the following strings:
+
+        - "robust" (the default): Before each command, check that the
+          current directory is accessible, change to the directory
+          which contains the path and run the command on the last
+          path component only. After the command, change back to the
+          current directory. This works even with servers which
+          can't handle whitespace in the directory part of paths.
+
+        - "track": Like "robust", but don't check the current
+          directory and don't change back after the command. Keep
+          track of the directory of the session instead, so that
+          a `CWD` command is only sent if the session isn't already
+          in the directory which contains the path.
+
+        - "direct": Pass absolute paths directly to the commands,
+          without any `CWD` commands. For paths which contain
+          whitespace, use the "track" policy.
+
+        The attribute `round_trips_saved` counts the `CWD` commands
+        which were avoided due to the policy.
+        """
+        if policy not in ('robust', 'track', 'direct'):
+            raise ValueError("invalid path policy '%s'" % policy)
+        if policy == 'robust' and \
+           self._session_dir != self._cached_current_dir:
+            # The "robust" code assumes that the session is in the
+            #  current directory.
+            self._session_chdir(self._cached_current_dir)
+        self._path_policy = policy
+
+    def path_policy(self):
+        """Return the path policy (see `set_path_policy`)."""
+        return self._path_policy
+
+    def _session_chdir(self, path):
+        """
+        Change the directory of the session to the absolute `path`
+        if the session isn't already there. Return `True` if a `CWD`
+        command was sent, else `False`. Unlike `chdir`, this doesn't
+        change the current directory as returned by `getcwd`.
+        """
+        if path == self._session_dir:
+            return False
+        ftp_error._try_with_oserror(self._session.cwd, path)
+        self._session_dir = path
+        return True
 
     #
     # Time shift adjustment between client (i. e. us) and server
@@ -454,15 +655,24 @@ class FTPHost(object):
         target_file = file_transfer.RemoteFile(self, target_path, target_mode)
         return source_file, target_file
 
-    def upload(self, source, target, mode='', callback=None):
+    def upload(self, source, target, mode='', callback=None, resume=False,
+               verify=False):
         """
         Upload a file from the local source (name) to the remote
         target (name). The argument `mode` is an empty string or 'a' for
         text copies, or 'b' for binary copies.
+
+        If `resume` is true and the remote target is smaller than the
+        source, it's taken as the beginning of an interrupted upload
+        and only the remaining part of the source is appended to it.
+        If `verify` is true, the sizes of source and target are
+        compared after the upload and an `FTPIOError` is raised if
+        they differ. Both options require binary mode.
         """
         source_file, target_file = self._upload_files(source, target, mode)
         file_transfer.copy_file(source_file, target_file,
-                                conditional=False, callback=callback)
+                                conditional=False, callback=callback,
+                                resume=resume, verify=verify)
 
     def upload_if_newer(self, source, target, mode='', callback=None):
         """
@@ -487,15 +697,38 @@ class FTPHost(object):
         target_file = file_transfer.LocalFile(target_path, target_mode)
         return source_file, target_file
 
-    def download(self, source, target, mode='', callback=None):
+    def download(self, source, target, mode='', callback=None, resume=False,
+                 verify=False, segments=1, segment_size=None):
         """
         Download a file from the remote source (name) to the local
         target (name). The argument mode is an empty string or 'a' for
         text copies, or 'b' for binary copies.
+
+        If `resume` is true and the local target is smaller than the
+        source, only the remaining part of the source is downloaded
+        (starting with a `REST` command) and appended to the target.
+        See `upload` for `verify`.
+
+        If `segments` is greater than 1, a big file is downloaded in
+        byte ranges of `segment_size` bytes over up to `segments`
+        concurrent connections. By default, the file is divided into
+        `segments` ranges of at least 1 MB. Segmented downloads
+        require binary mode and can't be resumed. If the server
+        doesn't support `REST`, the file is downloaded over one
+        connection.
         """
+        ftp_batch._check_segment_arguments(segments, segment_size)
         source_file, target_file = self._download_files(source, target, mode)
-        file_transfer.copy_file(source_file, target_file,
-                                conditional=False, callback=callback)
+        if segments == 1:
+            file_transfer.copy_file(source_file, target_file,
+                                    conditional=False, callback=callback,
+                                    resume=resume, verify=verify)
+        elif resume:
+            raise ValueError("segmented downloads can't be resumed")
+        else:
+            ftp_batch.download_segmented(source_file, target_file,
+                                         segments, segment_size, callback,
+                                         verify)
 
     def download_if_newer(self, source, target, mode='', callback=None):
         """
@@ -510,6 +743,69 @@ class FTPHost(object):
         return file_transfer.copy_file(source_file, target_file,
                                        conditional=True, callback=callback)
 
+    def upload_many(self, pairs, mode='', callback=None,
+                    max_workers=ftp_batch.DEFAULT_MAX_WORKERS,
+                    conditional=False):
+        """
+        Upload the files given by `pairs`, a sequence of `(source,
+        target)` pairs, concurrently over at most `max_workers`
+        additional FTP sessions. Relative remote paths are relative
+        to the current directory of this `FTPHost` object. See the
+        method `upload` for the meaning of `mode`.
+
+        If `conditional` is true, upload files only if they're newer
+        than their targets, as with `upload_if_newer`.
+
+        If given, `callback` is called in the calling thread after
+        each successful transfer with the source, the target and a
+        flag which is false if the file wasn't uploaded because the
+        target was up to date.
+
+        Return a list of the actually uploaded `(source, target)`
+        pairs. If any uploads failed, raise `BatchTransferError`
+        after all other transfers are done.
+        """
+        source_mode, target_mode = self.__get_modes(mode)
+        # The workers have their own current directories.
+        basedir = self.getcwd()
+        def make_files(worker, source, target):
+            """Return `LocalFile` and `RemoteFile` as source and target."""
+            target = self.path.join(basedir, target)
+            return (file_transfer.LocalFile(source, source_mode),
+                    ftp_batch.WorkerRemoteFile(worker, target, target_mode))
+        def on_copied(source, target, copied):
+            """Invalidate cache entries because the target changed."""
+            if copied:
+                self._stat.invalidate(self.path.join(basedir, target))
+        return ftp_batch.copy_files(self, pairs, make_files, conditional,
+                                    max_workers, callback, on_copied)
+
+    def download_many(self, pairs, mode='', callback=None,
+                      max_workers=ftp_batch.DEFAULT_MAX_WORKERS,
+                      conditional=False):
+        """
+        Download the files given by `pairs`, a sequence of `(source,
+        target)` pairs, concurrently over at most `max_workers`
+        additional FTP sessions. Relative remote paths are relative
+        to the current directory of this `FTPHost` object. See the
+        method `download` for the meaning of `mode`.
+
+        If `conditional` is true, download files only if they're
+        newer than their targets, as with `download_if_newer`. See
+        `upload_many` for the `callback` argument, the return value
+        and error handling.
+        """
+        source_mode, target_mode = self.__get_modes(mode)
+        # The workers have their own current directories.
+        basedir = self.getcwd()
+        def make_files(worker, source, target):
+            """Return `RemoteFile` and `LocalFile` as source and target."""
+            source = self.path.join(basedir, source)
+            return (ftp_batch.WorkerRemoteFile(worker, source, source_mode),
+                    file_transfer.LocalFile(target, target_mode))
+        return ftp_batch.copy_files(self, pairs, make_files, conditional,
+                                    max_workers, callback)
+
     #
     # Helper methods to descend into a directory before executing a command
     #
@@ -536,6 +832,8 @@ class FTPHost(object):
         If `descend_deeply` is true (the default is false), descend
         deeply, i. e. change the directory to the end of the path.
         """
+        if self._path_policy != 'robust':
+            return self.__tracked_ftp_command(command, path, descend_deeply)
         # If we can't change to the yet-current directory, the code
         #  below won't work (see below), so in this case rather raise
         #  an exception than giving wrong results.
@@ -565,6 +863,28 @@ class FTPHost(object):
             # Restore the old directory.
             self.chdir(old_dir)
 
+    def __tracked_ftp_command(self, command, path, descend_deeply):
+        """
+        Run an FTP command on a path according to the "track" or
+        "direct" path policy (see `set_path_policy`). The arguments
+        and the return value are the same as for
+        `_robust_ftp_command`.
+        """
+        path = self.path.abspath(path)
+        # We don't check the current directory and don't change back
+        #  to it.
+        self.round_trips_saved += 2
+        if self._path_policy == 'direct' and " " not in path:
+            self.round_trips_saved += 1
+            return command(self, path)
+        if descend_deeply:
+            directory, name = path, ""
+        else:
+            directory, name = self.path.split(path)
+        if not self._session_chdir(directory):
+            self.round_trips_saved += 1
+        return command(self, name)
+
     #
     # Miscellaneous utility methods resembling functions in `os`
     #
@@ -574,11 +894,17 @@ class FTPHost(object):
 
     def chdir(self, path):
         """Change the directory on the host."""
-        ftp_error._try_with_oserror(self._session.cwd, path)
         # The path given as the argument is relative to the old current
         #  directory, therefore join them.
-        self._cached_current_dir = \
+        new_dir = \
           self.path.normpath(self.path.join(self._cached_current_dir, path))
+        if self._session_dir == self._cached_current_dir:
+            ftp_error._try_with_oserror(self._session.cwd, path)
+        else:
+            # The session is in another directory (see
+            #  `set_path_policy`), so a relative path won't work.
+            ftp_error._try_with_oserror(self._session.cwd, new_dir)
+        self._cached_current_dir = self._session_dir = new_dir
 
     def mkdir(self, path, mode=None):
         """
@@ -591,7 +917,13 @@ class FTPHost(object):
         def command(self, path):
             """Callback function."""
             return ftp_error._try_with_oserror(self._session.mkd, path)
-        self._robust_ftp_command(command, path)
+        try:
+            self._robust_ftp_command(command, path)
+        finally:
+            # Also invalidate if the command failed, for example
+            #  because another process created the directory after
+            #  we had found it missing.
+            self._stat.invalidate(self.path.abspath(path))
 
     def makedirs(self, path, mode=None):
         """
@@ -637,7 +969,7 @@ class FTPHost(object):
             """Callback function."""
             ftp_error._try_with_oserror(self._session.rmd, path)
         self._robust_ftp_command(command, path)
-        self.stat_cache.invalidate(path)
+        self._stat.invalidate(path)
 
     def remove(self, path):
         """Remove the given file or link."""
@@ -655,7 +987,7 @@ class FTPHost(object):
         else:
             raise ftp_error.PermanentError("remove/unlink can only delete "
                                            "files and links, not directories")
-        self.stat_cache.invalidate(path)
+        self._stat.invalidate(path)
 
     def unlink(self, path):
         """
@@ -728,28 +1060,49 @@ class FTPHost(object):
             self.rmdir(path)
         except ftp_error.FTPOSError:
             new_onerror(self.rmdir, path, sys.exc_info())
+        # Also remove entries for paths in the tree which were cached
+        #  but not listed above, e. g. from an earlier listing.
+        self._stat.invalidate_tree(self.path.abspath(path))
 
     def rename(self, source, target):
         """Rename the source on the FTP host to target."""
         # The following code is in spirit similar to the code in the
         #  method `_robust_ftp_command`, though we do _not_ do
         #  _everything_ imaginable.
-        self._check_inaccessible_login_directory()
+        if self._path_policy == 'robust':
+            self._check_inaccessible_login_directory()
+        else:
+            # The session may be in another directory than `getcwd()`.
+            source = self.path.abspath(source)
+            target = self.path.abspath(target)
+            self.round_trips_saved += 1
         source_head, source_tail = self.path.split(source)
         target_head, target_tail = self.path.split(target)
         paths_contain_whitespace = (" " in source_head) or (" " in target_head)
         if paths_contain_whitespace and source_head == target_head:
             # Both items are in the same directory.
-            old_dir = self.getcwd()
-            try:
-                self.chdir(source_head)
+            if self._path_policy == 'robust':
+                old_dir = self.getcwd()
+                try:
+                    self.chdir(source_head)
+                    ftp_error._try_with_oserror(self._session.rename,
+                                                source_tail, target_tail)
+                finally:
+                    self.chdir(old_dir)
+            else:
+                # Don't change back.
+                self.round_trips_saved += 1
+                if not self._session_chdir(source_head):
+                    self.round_trips_saved += 1
                 ftp_error._try_with_oserror(self._session.rename,
                                             source_tail, target_tail)
-            finally:
-                self.chdir(old_dir)
         else:
             # Use straightforward command.
             ftp_error._try_with_oserror(self._session.rename, source, target)
+        # If a directory was renamed, the paths below it have changed,
+        #  too.
+        self._stat.invalidate_tree(self.path.abspath(source))
+        self._stat.invalidate_tree(self.path.abspath(target))
 
     #XXX One could argue to put this method into the `_Stat` class, but
     #  I refrained from that because then `_Stat` would have to know
@@ -772,6 +1125,82 @@ class FTPHost(object):
                                          descend_deeply=True)
         return lines
 
+    def _dir_recursive(self, path):
+        """
+        Return a recursive directory listing of `path` as made by
+        FTP's `LIST -R` command.
+        """
+        def _FTPHost_dir_recursive_command(self, path):
+            """Callback function."""
+            lines = []
+            def callback(line):
+                """Callback function."""
+                lines.append(line)
+            # `path` is empty unless the path policy is "direct".
+            args = ['-R']
+            if path:
+                args.append(path)
+            args.append(callback)
+            ftp_error._try_with_oserror(self._session.dir, *args)
+            return lines
+        return self._robust_ftp_command(_FTPHost_dir_recursive_command, path,
+                                        descend_deeply=True)
+
+    def _features(self):
+        """
+        Return a list of the names of the features the server lists
+        in its response to the `FEAT` command, in uppercase. If the
+        server doesn't support `FEAT`, return an empty list.
+        """
+        try:
+            response = ftp_error._try_with_oserror(self._session.sendcmd,
+                                                   'FEAT')
+        except ftp_error.PermanentError:
+            return []
+        features = []
+        # The first and the last line are the start and end of the
+        #  reply, the features are listed in between.
+        for line in response.splitlines()[1:-1]:
+            line = line.strip()
+            if line:
+                features.append(line.split()[0].upper())
+        return features
+
+    def _mlsd(self, path):
+        """
+        Return a directory listing as made by FTP's `MLSD` command.
+        """
+        def _FTPHost_mlsd_command(self, path):
+            """Callback function."""
+            lines = []
+            def callback(line):
+                """Callback function."""
+                lines.append(line)
+            command = ('MLSD %s' % path).rstrip()
+            ftp_error._try_with_oserror(self._session.retrlines, command,
+                                        callback)
+            return lines
+        return self._robust_ftp_command(_FTPHost_mlsd_command, path,
+                                        descend_deeply=True)
+
+    def _mlst(self, path):
+        """
+        Return the facts line for `path` from the response of FTP's
+        `MLST` command.
+        """
+        def _FTPHost_mlst_command(self, path):
+            """Callback function."""
+            command = ('MLST %s' % path).rstrip()
+            response = ftp_error._try_with_oserror(self._session.sendcmd,
+                                                   command)
+            # The facts line is the only line starting with a space.
+            for line in response.splitlines():
+                if line.startswith(' '):
+                    return line[1:]
+            raise ftp_error.ParserError("no facts in MLST response '%s'" %
+                                        response)
+        return self._robust_ftp_command(_FTPHost_mlst_command, path)
+
     # The `listdir`, `lstat` and `stat` methods don't use
     #  `_robust_ftp_command` because they implicitly already use
     #  `_dir` which actually uses `_robust_ftp_command`.
@@ -785,6 +1214,21 @@ class FTPHost(object):
         """
         return self._stat.listdir(path)
 
+    def scandir(self, path):
+        """
+        Return an iterator over `DirEntry` objects for the items in
+        the directory `path`, except `.` and `..`. The entries have
+        the attributes `name` and `path` and the methods `is_dir`,
+        `is_file`, `is_symlink` and `stat`.
+
+        Unless the listing is cached, it's read from a child session
+        and each line is parsed as soon as it arrives. The stat
+        results are stored in the caches as with `listdir`. If you
+        don't read all entries, call the iterator's `close` method to
+        free the child session.
+        """
+        return ftp_scandir.ScandirIterator(self, path)
+
     def lstat(self, path, _exception_for_missing_path=True):
         """
         Return an object similar to that returned by `os.lstat`.
@@ -820,30 +1264,94 @@ class FTPHost(object):
         dirnames, filenames) on each iteration, like the `os.walk`
         function (see http://docs.python.org/lib/os-file-dir.html ).
         """
+        return self._walk(top, topdown, onerror, True)
+
+    def _walk(self, top, topdown, onerror, check_isdir):
+        """
+        Implement `walk`. If `check_isdir` is false, `top` is known
+        to be a directory, so its parent directory doesn't need to
+        be listed to check this.
+        """
         # The following code is copied from `os.walk` in Python 2.4
         #  and adapted to ftputil.
         try:
-            names = self.listdir(top)
+            dirs, nondirs, links = self._classify_items(top, check_isdir)
         except ftp_error.FTPOSError, err:
             if onerror is not None:
                 onerror(err)
             return
-        dirs, nondirs = [], []
-        for name in names:
-            if self.path.isdir(self.path.join(top, name)):
-                dirs.append(name)
-            else:
-                nondirs.append(name)
         if topdown:
             yield top, dirs, nondirs
         for name in dirs:
-            path = self.path.join(top, name)
-            if not self.path.islink(path):
-                for item in self.walk(path, topdown, onerror):
+            if name not in links:
+                path = self.path.join(top, name)
+                for item in self._walk(path, topdown, onerror, False):
                     yield item
         if not topdown:
             yield top, dirs, nondirs
 
+    def _classify_items(self, top, check_isdir=True):
+        """
+        Return a tuple `(dirs, nondirs, links)` for the directory
+        `top`: the lists of the names of the directories and of the
+        other items, as for `walk`, and a set of the names of links.
+
+        The items are classified with the stat results from the
+        listing, so each directory is listed only once, even if the
+        caches are too small or disabled.
+        """
+        listing = self._stat.listing(top, check_isdir)
+        return self._classify_listing(top, listing)
+
+    def _classify_listing(self, top, listing):
+        """
+        Return a tuple `(dirs, nondirs, links)` like `_classify_items`,
+        but for the already parsed `listing` of the directory `top`.
+        """
+        dirs, nondirs, links = [], [], set()
+        for lstat_result in listing:
+            name = lstat_result._st_name
+            if name in (self.curdir, self.pardir):
+                continue
+            if stat.S_ISLNK(lstat_result.st_mode):
+                # Only for links, the target has to be stat'ed.
+                links.add(name)
+                is_dir = self.path.isdir(self.path.join(top, name))
+            else:
+                is_dir = stat.S_ISDIR(lstat_result.st_mode)
+            if is_dir:
+                dirs.append(name)
+            else:
+                nondirs.append(name)
+        return dirs, nondirs, links
+
+    def scan_tree(self, top):
+        """
+        Fetch the listings of all directories in the tree `top` and
+        store them in the caches, so that a subsequent `walk` doesn't
+        need to contact the server (as long as the listing cache is
+        large enough).
+
+        Try to get all listings with a single `LIST -R` command. If
+        the server doesn't support it, list each directory.
+        """
+        self._stat.scan_tree(top)
+
+    def walk_parallel(self, top, max_workers=ftp_batch.DEFAULT_MAX_WORKERS,
+                      ordered=False, onerror=None):
+        """
+        Iterate over the directory tree like `walk` with `topdown`
+        set to true, but fetch the directory listings concurrently
+        over at most `max_workers` additional FTP sessions. The
+        listings are stored in the caches of this `FTPHost` object.
+
+        If `ordered` is true, yield the directories in the same order
+        as `walk`, else in the order in which the listings arrive.
+        As with `walk`, you can remove names from the yielded list of
+        directory names to skip these directories.
+        """
+        return ftp_batch.walk(self, top, max_workers, ordered, onerror)
+
     def chmod(self, path, mode):
         """
         Change the mode of a remote `path` (a string) to the integer
@@ -861,7 +1369,7 @@ class FTPHost(object):
             ftp_error._try_with_oserror(self._session.voidcmd,
                                         "SITE CHMOD %s %s" % (oct(mode), path))
         self._robust_ftp_command(command, path)
-        self.stat_cache.invalidate(path)
+        self._stat.invalidate(path)
 
     #
     # Context manager methods
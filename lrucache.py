@@ -40,11 +40,10 @@ discarded. [1]_
 
 from __future__ import generators
 import time
-from heapq import heappush, heappop, heapify
 
 # the suffix after the hyphen denotes modifications by the
 #  ftputil project with respect to the original version
-__version__ = "0.2-2"
+__version__ = "0.2-3"
 __all__ = ['CacheKeyError', 'LRUCache', 'DEFAULT_SIZE']
 __docformat__ = 'reStructuredText en'
 
@@ -97,21 +96,26 @@ class LRUCache(object):
 
     for j in cache:   # iterate (in LRU order)
         print j, cache[j] # iterator produces keys, not values
+
+    Implementation note: The nodes are kept in a dictionary for
+    lookups and, at the same time, in a circular doubly linked list
+    ordered by the time of their last use. The list starts with the
+    least recently used node. Thus all operations except iteration
+    and shrinking take constant time, independent of the cache size.
     """
 
     class __Node(object):
         """Record of a cached value. Not for public consumption."""
 
-        def __init__(self, key, obj, timestamp, sort_key):
+        __slots__ = ('prev', 'next', 'key', 'obj', 'atime', 'mtime')
+
+        def __init__(self, key, obj, timestamp):
             object.__init__(self)
+            self.prev = self.next = self
             self.key = key
             self.obj = obj
             self.atime = timestamp
             self.mtime = self.atime
-            self._sort_key = sort_key
-
-        def __cmp__(self, other):
-            return cmp(self._sort_key, other._sort_key)
 
         def __repr__(self):
             return "<%s %s => %s (%s)>" % \
@@ -123,105 +127,126 @@ class LRUCache(object):
         if size < 0:
             raise ValueError("cache size (%d) mustn't be negative" % size)
         object.__init__(self)
-        self.__heap = []
         self.__dict = {}
+        # Sentinel of the circular list; `__root.next` is the least
+        #  recently used node, `__root.prev` the most recently used.
+        self.__root = self.__Node(None, None, None)
         """Maximum size of the cache.
         If more than 'size' elements are added to the cache,
         the least-recently-used ones will be discarded."""
         self.size = size
-        self.__counter = 0
-
-    def _sort_key(self):
-        """Return a new integer value upon every call.
 
-        Cache nodes need a monotonically increasing time indicator.
-        time.time() and time.clock() don't guarantee this in a
-        platform-independent way.
-        """
-        self.__counter += 1
-        return self.__counter
+    def __unlink(self, node):
+        """Remove `node` from the linked list."""
+        node.prev.next = node.next
+        node.next.prev = node.prev
+
+    def __append(self, node):
+        """Insert `node` as the most recently used node."""
+        root = self.__root
+        last = root.prev
+        node.prev = last
+        node.next = root
+        last.next = node
+        root.prev = node
+
+    def __pop_lru(self):
+        """Remove the least recently used node from the cache."""
+        lru = self.__root.next
+        self.__unlink(lru)
+        del self.__dict[lru.key]
 
     def __len__(self):
-        return len(self.__heap)
+        return len(self.__dict)
 
     def __contains__(self, key):
-        return self.__dict.has_key(key)
+        return key in self.__dict
 
     def __setitem__(self, key, obj):
         if self.size == 0:
             # can't store anything
             return
-        if self.__dict.has_key(key):
+        if key in self.__dict:
             node = self.__dict[key]
             # update node object in-place
             node.obj = obj
             node.atime = time.time()
             node.mtime = node.atime
-            node._sort_key = self._sort_key()
-            heapify(self.__heap)
+            self.__unlink(node)
+            self.__append(node)
         else:
-            # size of the heap can be at most the value of
+            # size of the cache can be at most the value of
             #  self.size because __setattr__ decreases the cache
             #  size if the new size value is smaller; so we don't
             #  need a loop _here_
-            if len(self.__heap) == self.size:
-                lru = heappop(self.__heap)
-                del self.__dict[lru.key]
-            node = self.__Node(key, obj, time.time(), self._sort_key())
+            if len(self.__dict) == self.size:
+                self.__pop_lru()
+            node = self.__Node(key, obj, time.time())
             self.__dict[key] = node
-            heappush(self.__heap, node)
+            self.__append(node)
 
     def __getitem__(self, key):
-        if not self.__dict.has_key(key):
+        if key not in self.__dict:
             raise CacheKeyError(key)
         else:
             node = self.__dict[key]
             # update node object in-place
             node.atime = time.time()
-            node._sort_key = self._sort_key()
-            heapify(self.__heap)
+            self.__unlink(node)
+            self.__append(node)
             return node.obj
 
     def __delitem__(self, key):
-        if not self.__dict.has_key(key):
+        if key not in self.__dict:
             raise CacheKeyError(key)
         else:
-            node = self.__dict[key]
-            del self.__dict[key]
-            self.__heap.remove(node)
-            heapify(self.__heap)
+            node = self.__dict.pop(key)
+            self.__unlink(node)
             return node.obj
 
     def __iter__(self):
-        copy = self.__heap[:]
-        while len(copy) > 0:
-            node = heappop(copy)
-            yield node.key
-        raise StopIteration
+        # Take a snapshot, so that the cache may be modified (e. g.
+        #  by `cache[key]` in the loop body) during the iteration.
+        keys = []
+        root = self.__root
+        node = root.next
+        while node is not root:
+            keys.append(node.key)
+            node = node.next
+        for key in keys:
+            yield key
 
     def __setattr__(self, name, value):
         object.__setattr__(self, name, value)
-        # automagically shrink heap on resize
+        # automagically shrink cache on resize
         if name == 'size':
             if value < 0:
-                raise ValueError("cache size (%d) mustn't be negative" % size)
-            while len(self.__heap) > value:
-                lru = heappop(self.__heap)
-                del self.__dict[lru.key]
+                raise ValueError("cache size (%d) mustn't be negative" % value)
+            while len(self.__dict) > value:
+                self.__pop_lru()
 
     def __repr__(self):
-        return "<%s (%d elements)>" % (str(self.__class__), len(self.__heap))
+        return "<%s (%d elements)>" % (str(self.__class__), len(self.__dict))
 
     def mtime(self, key):
         """Return the last modification time for the cache record with key.
         May be useful for cache instances where the stored values can get
         'stale', such as caching file or network resource contents."""
-        if not self.__dict.has_key(key):
+        if key not in self.__dict:
             raise CacheKeyError(key)
         else:
             node = self.__dict[key]
             return node.mtime
 
+    def set_mtime(self, key, mtime):
+        """Set the last modification time for the cache record with key,
+        for example if the value was stored elsewhere before and should
+        only be considered as new as it was then."""
+        if key not in self.__dict:
+            raise CacheKeyError(key)
+        else:
+            self.__dict[key].mtime = mtime
+
 if __name__ == "__main__":
     cache = LRUCache(25)
     print cache
@@ -0,0 +1,140 @@
+#! /usr/bin/env python
+# Copyright (C) 2010, Stefan Schwarzer <sschwarzer@sschwarzer.net>
+# See the file LICENSE for licensing terms.
+
+"""
+Compare a copy loop over `file_transfer.chunks`, which reads a new
+string for each chunk, with loops which reuse a buffer via `readinto`
+(for files, as `file_transfer.copyfileobj` does if it can) or
+`recv_into` (for sockets, like the data connection of a download).
+
+The data is read from a temporary file or from a local socket and
+written to `os.devnull`, so the times show the overhead of the copy
+loops, not of the disk or the network.
+
+Usage: PYTHONPATH=.. python copy_benchmark.py [megabytes]
+"""
+
+import os
+import resource
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import file_transfer
+
+
+CHUNK_SIZE = file_transfer.MAX_COPY_CHUNK_SIZE
+
+
+def copy_with_chunks(source, target):
+    """Copy with a new string for each chunk."""
+    for chunk in file_transfer.chunks(source, CHUNK_SIZE):
+        target.write(chunk)
+
+
+def copy_with_readinto(source, target):
+    """Copy with `file_transfer.copyfileobj`, which uses `readinto`."""
+    file_transfer.copyfileobj(source, target, CHUNK_SIZE)
+
+
+def copy_with_recv_into(sock, target):
+    """Copy with a reused buffer and the socket method `recv_into`."""
+    buffer_ = bytearray(CHUNK_SIZE)
+    while True:
+        byte_count = sock.recv_into(buffer_)
+        if not byte_count:
+            break
+        target.write(buffer(buffer_, 0, byte_count))
+
+
+def send_data(sock, byte_count):
+    """Send `byte_count` bytes over `sock`, then close it."""
+    data = "x" * CHUNK_SIZE
+    while byte_count > 0:
+        sock.sendall(data[:byte_count])
+        byte_count -= len(data)
+    sock.close()
+
+
+def benchmark_file(copy, source_name):
+    """Return the time in seconds to copy the file `source_name`."""
+    source = open(source_name, "rb")
+    target = open(os.devnull, "wb")
+    try:
+        start_time = time.time()
+        copy(source, target)
+        return time.time() - start_time
+    finally:
+        target.close()
+        source.close()
+
+
+def benchmark_socket(copy, byte_count, use_socket):
+    """
+    Return the time in seconds to copy `byte_count` bytes received
+    from a local socket. If `use_socket` is true, pass the socket to
+    `copy`, else a file object made with `makefile`, as `_FTPFile`
+    does.
+    """
+    receiver, sender = socket.socketpair()
+    thread = threading.Thread(target=send_data, args=(sender, byte_count))
+    thread.start()
+    target = open(os.devnull, "wb")
+    try:
+        start_time = time.time()
+        if use_socket:
+            copy(receiver, target)
+        else:
+            copy(receiver.makefile("rb"), target)
+        return time.time() - start_time
+    finally:
+        target.close()
+        receiver.close()
+        thread.join()
+
+
+def max_rss():
+    """Return the maximum resident set size of the process in KB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def report(name, byte_count, seconds, rss_before):
+    print "%-22s %7.1f MB/s, maximum RSS grew by %d KB" % \
+          (name + ":", byte_count / seconds / 1024.0 / 1024.0,
+           max_rss() - rss_before)
+
+
+def main(megabytes):
+    byte_count = megabytes * 1024 * 1024
+    fd, source_name = tempfile.mkstemp()
+    try:
+        data = os.urandom(1024 * 1024)
+        for ignored in xrange(megabytes):
+            os.write(fd, data)
+        os.close(fd)
+        # Read the file once, so that it's in the operating system's
+        #  cache for all benchmarks.
+        benchmark_file(copy_with_chunks, source_name)
+        for name, copy in (("file, chunks", copy_with_chunks),
+                           ("file, readinto", copy_with_readinto)):
+            rss_before = max_rss()
+            report(name, byte_count, benchmark_file(copy, source_name),
+                   rss_before)
+    finally:
+        os.remove(source_name)
+    for name, copy, use_socket in (
+          ("socket, chunks", copy_with_chunks, False),
+          ("socket, recv_into", copy_with_recv_into, True)):
+        rss_before = max_rss()
+        report(name, byte_count,
+               benchmark_socket(copy, byte_count, use_socket), rss_before)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main(512)
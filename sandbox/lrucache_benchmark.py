@@ -0,0 +1,134 @@
+#! /usr/bin/env python
+# Copyright (C) 2010, Stefan Schwarzer <sschwarzer@sschwarzer.net>
+# See the file LICENSE for licensing terms.
+
+"""
+Compare the speed of the linked-list based `lrucache.LRUCache` with
+the previous heap-based implementation (ftputil 2.5 and earlier).
+
+Usage: PYTHONPATH=.. python lrucache_benchmark.py [cache_size ...]
+"""
+
+import random
+import sys
+import time
+from heapq import heappush, heappop, heapify
+
+import lrucache
+
+
+CacheKeyError = lrucache.CacheKeyError
+
+
+# The old implementation, copied from `lrucache.py` 0.2-2 (only the
+#  parts needed for the benchmark).
+class HeapLRUCache(object):
+    """Heap-based LRU cache, as used up to ftputil 2.5."""
+
+    class __Node(object):
+
+        def __init__(self, key, obj, timestamp, sort_key):
+            object.__init__(self)
+            self.key = key
+            self.obj = obj
+            self.atime = timestamp
+            self.mtime = self.atime
+            self._sort_key = sort_key
+
+        def __cmp__(self, other):
+            return cmp(self._sort_key, other._sort_key)
+
+    def __init__(self, size):
+        self.__heap = []
+        self.__dict = {}
+        self.size = size
+        self.__counter = 0
+
+    def _sort_key(self):
+        self.__counter += 1
+        return self.__counter
+
+    def __len__(self):
+        return len(self.__heap)
+
+    def __contains__(self, key):
+        return self.__dict.has_key(key)
+
+    def __setitem__(self, key, obj):
+        if self.__dict.has_key(key):
+            node = self.__dict[key]
+            node.obj = obj
+            node.atime = time.time()
+            node.mtime = node.atime
+            node._sort_key = self._sort_key()
+            heapify(self.__heap)
+        else:
+            if len(self.__heap) == self.size:
+                lru = heappop(self.__heap)
+                del self.__dict[lru.key]
+            node = self.__Node(key, obj, time.time(), self._sort_key())
+            self.__dict[key] = node
+            heappush(self.__heap, node)
+
+    def __getitem__(self, key):
+        if not self.__dict.has_key(key):
+            raise CacheKeyError(key)
+        else:
+            node = self.__dict[key]
+            node.atime = time.time()
+            node._sort_key = self._sort_key()
+            heapify(self.__heap)
+            return node.obj
+
+    def __delitem__(self, key):
+        if not self.__dict.has_key(key):
+            raise CacheKeyError(key)
+        else:
+            node = self.__dict[key]
+            del self.__dict[key]
+            self.__heap.remove(node)
+            heapify(self.__heap)
+            return node.obj
+
+
+def run(cache_class, cache_size, operation_count):
+    """
+    Fill a cache of class `cache_class` with `cache_size` entries,
+    then perform `operation_count` mixed lookups, updates, inserts
+    and deletions on it. Return the duration in seconds.
+    """
+    cache = cache_class(cache_size)
+    keys = ["/home/user/dir/file%d" % i for i in xrange(2 * cache_size)]
+    for key in keys[:cache_size]:
+        cache[key] = key
+    # Use the same "random" sequence for all cache classes.
+    random.seed(42)
+    operations = [(random.random(), random.choice(keys))
+                  for i in xrange(operation_count)]
+    start_time = time.time()
+    for choice, key in operations:
+        if choice < 0.7:
+            # Lookup, like `StatCache.__contains__` and `__getitem__`
+            if key in cache:
+                cache[key]
+        elif choice < 0.95:
+            cache[key] = key
+        elif key in cache:
+            del cache[key]
+    return time.time() - start_time
+
+
+def main(cache_sizes):
+    operation_count = 20000
+    print "%d operations per run" % operation_count
+    print "%10s %12s %12s %8s" % ("size", "heap [s]", "list [s]", "speedup")
+    for cache_size in cache_sizes:
+        heap_duration = run(HeapLRUCache, cache_size, operation_count)
+        list_duration = run(lrucache.LRUCache, cache_size, operation_count)
+        print "%10d %12.3f %12.3f %8.1f" % (cache_size, heap_duration,
+              list_duration, heap_duration / list_duration)
+
+
+if __name__ == '__main__':
+    cache_sizes = [int(arg) for arg in sys.argv[1:]] or [100, 1000, 5000]
+    main(cache_sizes)
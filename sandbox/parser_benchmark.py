@@ -0,0 +1,155 @@
+#! /usr/bin/env python
+# Copyright (C) 2010, Stefan Schwarzer <sschwarzer@sschwarzer.net>
+# See the file LICENSE for licensing terms.
+
+"""
+Compare the speed of `ftp_stat.UnixParser` with the implementation
+in ftputil 2.5 and earlier, which split each line several times and
+called `time.localtime` and `time.mktime` for each line.
+
+Usage: PYTHONPATH=.. python parser_benchmark.py [line_count]
+"""
+
+import random
+import stat
+import sys
+import time
+
+import ftp_error
+import ftp_stat
+
+
+# The old implementation, copied from `ftp_stat.py` of ftputil 2.5
+#  (only the parts needed for the benchmark).
+class OldUnixParser(ftp_stat.UnixParser):
+    """Split-based Unix parser, as used up to ftputil 2.5."""
+
+    def parse_unix_mode(self, mode_string):
+        if len(mode_string) != 10:
+            raise ftp_error.ParserError("invalid mode string '%s'" %
+                                        mode_string)
+        st_mode = 0
+        for bit in mode_string[1:10]:
+            bit = (bit != '-')
+            st_mode = (st_mode << 1) + bit
+        if mode_string[3] == 's':
+            st_mode = st_mode | stat.S_ISUID
+        if mode_string[6] == 's':
+            st_mode = st_mode | stat.S_ISGID
+        file_type_to_mode = {'b': stat.S_IFBLK, 'c': stat.S_IFCHR,
+                             'd': stat.S_IFDIR, 'l': stat.S_IFLNK,
+                             'p': stat.S_IFIFO, 's': stat.S_IFSOCK,
+                             '-': stat.S_IFREG, '?': 0}
+        file_type = mode_string[0]
+        if file_type in file_type_to_mode:
+            st_mode = st_mode | file_type_to_mode[file_type]
+        else:
+            raise ftp_error.ParserError(
+                  "unknown file type character '%s'" % file_type)
+        return st_mode
+
+    def parse_unix_time(self, month_abbreviation, day, year_or_time,
+                        time_shift, with_precision=False):
+        month = self._month_numbers[month_abbreviation.lower()]
+        day = int(day)
+        if ":" not in year_or_time:
+            year, hour, minute = int(year_or_time), 0, 0
+            st_mtime = time.mktime( (year, month, day,
+                                     hour, minute, 0, 0, 0, -1) )
+            st_mtime_precision = 24 * 60 * 60
+        else:
+            hour, minute = year_or_time.split(':')
+            year, hour, minute = None, int(hour), int(minute)
+            year = time.localtime()[0]
+            st_mtime = time.mktime( (year, month, day,
+                                     hour, minute, 0, 0, 0, -1) )
+            st_mtime_precision = 60
+            if st_mtime > time.time() + time_shift + 60.0:
+                st_mtime = time.mktime( (year-1, month, day,
+                                         hour, minute, 0, 0, 0, -1) )
+        if with_precision:
+            return (st_mtime, st_mtime_precision)
+        else:
+            return st_mtime
+
+    def parse_line(self, line, time_shift=0.0):
+        return self._parse_line_parts(self._split_line(line), time_shift)
+
+
+MONTHS = "Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec".split()
+
+
+def make_dates(count):
+    """
+    Return a list of `count` random `(month, day, year_or_time)`
+    tuples. In real listings, many files share the same date.
+    """
+    dates = []
+    for index in range(count):
+        if random.random() < 0.5:
+            year_or_time = "%02d:%02d" % (random.randint(0, 23),
+                                          random.randint(0, 59))
+        else:
+            year_or_time = str(random.randint(1995, 2009))
+        dates.append((random.choice(MONTHS), random.randint(1, 28),
+                      year_or_time))
+    return dates
+
+
+def make_lines(count):
+    """Return a list of `count` random lines of a Unix listing."""
+    random.seed(0)
+    dates = make_dates(1000)
+    lines = []
+    for index in range(count):
+        mode = random.choice(["-rw-r--r--", "-rwxr-xr-x", "drwxr-sr-x",
+                              "lrwxrwxrwx"])
+        month, day, year_or_time = random.choice(dates)
+        name = "file_%d" % index
+        if mode.startswith('l'):
+            name = name + " -> target"
+        lines.append("%s %3d %-8s %-8s %10d %s %2d %5s %s" %
+                     (mode, random.randint(1, 5), "user", "group",
+                      random.randint(0, 10**7), month, day,
+                      year_or_time, name))
+    return lines
+
+
+def benchmark(parser, lines):
+    """Return the time in seconds to parse all `lines` with `parser`."""
+    start_time = time.time()
+    for line in lines:
+        parser.parse_line(line, 0.0)
+    return time.time() - start_time
+
+
+def benchmark_batch(parser, lines):
+    """
+    Return the time in seconds to parse all `lines` with one call of
+    `parser.parse_lines`.
+    """
+    start_time = time.time()
+    parser.parse_lines(lines, 0.0)
+    return time.time() - start_time
+
+
+def main(line_count):
+    lines = make_lines(line_count)
+    old_parser, new_parser = OldUnixParser(), ftp_stat.UnixParser()
+    # Check that both parsers agree.
+    for line in lines[:1000]:
+        assert old_parser.parse_line(line) == new_parser.parse_line(line)
+    old_time = benchmark(old_parser, lines)
+    new_time = benchmark(new_parser, lines)
+    batch_time = benchmark_batch(new_parser, lines)
+    print "%d lines: old %.2f s, new %.2f s, speedup %.1f" % \
+          (line_count, old_time, new_time, old_time / new_time)
+    print "parse_lines: %.2f s, speedup %.1f" % \
+          (batch_time, old_time / batch_time)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main(200000)
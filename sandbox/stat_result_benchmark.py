@@ -0,0 +1,92 @@
+#! /usr/bin/env python
+# Copyright (C) 2010, Stefan Schwarzer <sschwarzer@sschwarzer.net>
+# See the file LICENSE for licensing terms.
+
+"""
+Compare memory usage and speed of `ftp_stat.StatResult` with the
+implementation in ftputil 2.5 and earlier, a `tuple` subclass with
+a `__dict__` for each instance and a `__getattr__` method.
+
+Usage: PYTHONPATH=.. python stat_result_benchmark.py [count]
+"""
+
+import stat
+import sys
+import time
+
+import ftp_stat
+
+
+# The old implementation, copied from `ftp_stat.py` of ftputil 2.5
+class OldStatResult(tuple):
+
+    _index_mapping = {
+      'st_mode':  0, 'st_ino':   1, 'st_dev':    2, 'st_nlink':    3,
+      'st_uid':   4, 'st_gid':   5, 'st_size':   6, 'st_atime':    7,
+      'st_mtime': 8, 'st_ctime': 9, '_st_name': 10, '_st_target': 11}
+
+    def __init__(self, sequence):
+        # pylint: disable=W0231, W0613
+        self._st_name = ""
+        self._st_target = None
+        self._st_mtime_precision = None
+
+    def __getattr__(self, attr_name):
+        if attr_name in self._index_mapping:
+            return self[self._index_mapping[attr_name]]
+        else:
+            raise AttributeError("'StatResult' object has no attribute '%s'" %
+                                 attr_name)
+
+
+def make_stat_results(class_, count):
+    """Return a list of `count` instances of `class_`."""
+    stat_results = []
+    for index in xrange(count):
+        stat_result = class_( (stat.S_IFREG | 0644, None, None, 1, "user",
+                               "group", index, None, 1261264260.0, None) )
+        stat_result._st_name = "file_%d" % index
+        stat_result._st_mtime_precision = 60
+        stat_results.append(stat_result)
+    return stat_results
+
+
+def instance_size(stat_result):
+    """Return the memory used by `stat_result` in bytes."""
+    size = sys.getsizeof(stat_result)
+    if hasattr(stat_result, "__dict__"):
+        size += sys.getsizeof(stat_result.__dict__)
+    return size
+
+
+def access_attributes(stat_results):
+    """
+    Return the time in seconds to access some attributes of all
+    `stat_results`, similar to `FTPHost.path.isdir` and `getsize`.
+    """
+    start_time = time.time()
+    for stat_result in stat_results:
+        stat.S_ISDIR(stat_result.st_mode)
+        stat_result.st_size
+        stat_result.st_mtime
+        stat_result._st_name
+    return time.time() - start_time
+
+
+def main(count):
+    for class_ in (OldStatResult, ftp_stat.StatResult):
+        start_time = time.time()
+        stat_results = make_stat_results(class_, count)
+        creation_time = time.time() - start_time
+        access_time = access_attributes(stat_results)
+        print "%-13s %4d bytes per instance, creation %.2f s, " \
+              "access %.2f s" % (class_.__name__ + ":",
+                                 instance_size(stat_results[0]),
+                                 creation_time, access_time)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main(300000)
@@ -12,6 +12,7 @@ run the unit tests.
 import ftplib
 import posixpath
 import StringIO
+import threading
 
 DEBUG = 0
 
@@ -142,6 +143,8 @@ total 1
         # Count successful `transfercmd` invocations to ensure that
         #  each has a corresponding `voidresp`.
         self._transfercmds = 0
+        # Transfer commands with their `rest` arguments
+        self.transfers = []
         # Dummy, only for getting/setting timeout in `_FTPFile.close`
         self.sock = MockSocket("", "")
 
@@ -157,6 +160,12 @@ total 1
         else:
             raise ftplib.error_perm
 
+    def sendcmd(self, cmd):
+        if DEBUG:
+            print cmd
+        # By default, pretend to be a server without `FEAT` support.
+        raise ftplib.error_perm("500 %s not understood" % cmd.split()[0])
+
     def pwd(self):
         return self.current_dir
 
@@ -192,13 +201,17 @@ total 1
         self._transfercmds = self._transfercmds - 1
         return '2xx'
 
-    def transfercmd(self, cmd):
+    def transfercmd(self, cmd, rest=None):
         """
         Return a `MockSocket` object whose `makefile` method will
-        return a mock file object.
+        return a mock file object. If `rest` is given, the content
+        of a file opened for reading starts at this offset.
         """
         if DEBUG:
             print cmd
+        self.transfers.append((cmd, rest))
+        if cmd == 'LIST' or cmd.startswith('LIST '):
+            return self._list_transfer(cmd[5:])
         # Fail if attempting to read from/write to a directory
         cmd, path = cmd.split()
         path = self._remove_trailing_slash(path)
@@ -210,10 +223,115 @@ total 1
             raise ftplib.error_perm
         assert self._transfercmds == 0
         self._transfercmds = self._transfercmds + 1
-        return MockSocket(path, self.mock_file_content)
+        content = self.mock_file_content
+        if rest is not None:
+            content = content[int(rest):]
+        return MockSocket(path, content)
+
+    def _list_transfer(self, path):
+        """
+        Return a `MockSocket` object for reading the listing of
+        `path` as sent for a `LIST` command.
+        """
+        path = self._transform_path(path)
+        if not self.dir_contents.has_key(path):
+            raise ftplib.error_perm("550 %s: no such directory" % path)
+        assert self._transfercmds == 0
+        self._transfercmds = self._transfercmds + 1
+        content = self.dir_contents[path].replace('\n', '\r\n') + '\r\n'
+        return MockSocket(path, content)
 
     def close(self):
         if not self.closed:
             self.closed = 1
             assert self._transfercmds == 0
 
+
+class CountingSession(MockSession):
+    """
+    Mock session which records the calls of some of its methods, so
+    that tests can check which commands were sent to the server.
+
+    `calls(name)` returns a list with the argument of each call of
+    the method `name` (the path; a tuple `(source, target)` for
+    `rename` and `None` for `pwd`), `count(name)` the number of
+    calls. The recorded methods are `cwd`, `pwd`, `dir`, `mkd`,
+    `rmd`, `delete`, `rename` and `_list_transfer` (for `LIST`
+    transfers); the commands which change files or directories
+    don't do anything else.
+
+    The class attribute `sessions` is the list of the sessions made
+    so far, `total_counts` a dictionary of the numbers of calls of
+    all these sessions. The class method `reset` sets these
+    attributes for the class it's called on, so that subclasses can
+    count separately.
+    """
+
+    # Protects `total_counts`, as sessions may be used in threads
+    _lock = threading.Lock()
+
+    sessions = []
+    total_counts = {}
+
+    def reset(cls):
+        """Forget the sessions and calls recorded so far."""
+        cls.sessions = []
+        cls.total_counts = {}
+
+    reset = classmethod(reset)
+
+    def total_count(cls, name):
+        """Return the number of calls of `name` of all sessions."""
+        return cls.total_counts.get(name, 0)
+
+    total_count = classmethod(total_count)
+
+    def __init__(self, host='', user='', password=''):
+        MockSession.__init__(self, host, user, password)
+        self._calls = {}
+        # Appending to a list is thread-safe.
+        self.sessions.append(self)
+
+    def _record(self, name, arg=None):
+        self._calls.setdefault(name, []).append(arg)
+        self._lock.acquire()
+        try:
+            self.total_counts[name] = self.total_counts.get(name, 0) + 1
+        finally:
+            self._lock.release()
+
+    def calls(self, name):
+        """Return the list of the arguments of the calls of `name`."""
+        return self._calls.get(name, [])
+
+    def count(self, name):
+        """Return the number of calls of `name`."""
+        return len(self.calls(name))
+
+    def cwd(self, path):
+        self._record('cwd', path)
+        MockSession.cwd(self, path)
+
+    def pwd(self):
+        self._record('pwd')
+        return MockSession.pwd(self)
+
+    def dir(self, path, callback=None):
+        self._record('dir', path)
+        MockSession.dir(self, path, callback)
+
+    def _list_transfer(self, path):
+        self._record('_list_transfer', path)
+        return MockSession._list_transfer(self, path)
+
+    def mkd(self, path):
+        self._record('mkd', path)
+
+    def rmd(self, path):
+        self._record('rmd', path)
+
+    def delete(self, path):
+        self._record('delete', path)
+
+    def rename(self, source, target):
+        self._record('rename', (source, target))
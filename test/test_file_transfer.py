@@ -1,8 +1,10 @@
 # Copyright (C) 2010, Stefan Schwarzer <sschwarzer@sschwarzer.net>
 # See the file LICENSE for licensing terms.
 
+import os
 import random
 import StringIO
+import tempfile
 import unittest
 
 import file_transfer
@@ -111,6 +113,62 @@ class TestChunkwiseTransfer(unittest.TestCase):
                           iterator.next)
 
 
+
+class ReadintoStringIO(StringIO.StringIO):
+    """`StringIO` class with a `readinto` method which counts its calls."""
+
+    def __init__(self, data):
+        StringIO.StringIO.__init__(self, data)
+        self.readinto_count = 0
+
+    def readinto(self, buffer_):
+        self.readinto_count += 1
+        data = self.read(len(buffer_))
+        buffer_[:len(data)] = data
+        return len(data)
+
+
+class TestCopyfileobj(unittest.TestCase):
+
+    def setUp(self):
+        self.data = "".join([chr(i % 256) for i in xrange(1021)])
+        handle, self.filename = tempfile.mkstemp()
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def copy_to_file(self, source, callback=None):
+        """Copy `source` to the temporary file and return its content."""
+        target = open(self.filename, 'wb')
+        try:
+            file_transfer.copyfileobj(source, target, 256, callback)
+        finally:
+            target.close()
+        return open(self.filename, 'rb').read()
+
+    def test_reused_buffer(self):
+        source = ReadintoStringIO(self.data)
+        self.assertEqual(self.copy_to_file(source), self.data)
+        # Four chunks and the end of the data
+        self.assertEqual(source.readinto_count, 5)
+
+    def test_callback(self):
+        # Callbacks get strings, so `readinto` isn't used.
+        source = ReadintoStringIO(self.data)
+        chunks = []
+        self.assertEqual(self.copy_to_file(source, chunks.append), self.data)
+        self.assertEqual(source.readinto_count, 0)
+        self.assertEqual("".join(chunks), self.data)
+
+    def test_target_without_buffer_support(self):
+        source = ReadintoStringIO(self.data)
+        target = StringIO.StringIO()
+        file_transfer.copyfileobj(source, target, 256)
+        self.assertEqual(source.readinto_count, 0)
+        self.assertEqual(target.getvalue(), self.data)
+
+
 if __name__ == '__main__':
     unittest.main()
 
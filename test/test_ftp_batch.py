@@ -0,0 +1,428 @@
+# Copyright (C) 2010, Stefan Schwarzer <sschwarzer@sschwarzer.net>
+# See the file LICENSE for licensing terms.
+
+import ftplib
+import os
+import Queue
+import StringIO
+import threading
+import time
+import unittest
+
+import ftp_batch
+import ftp_error
+
+import mock_ftplib
+import test_base
+
+
+class DownloadSession(mock_ftplib.CountingSession):
+
+    mock_file_content = "downloaded data"
+
+
+class SegmentSession(mock_ftplib.CountingSession):
+
+    # Same size as `/home/sschwarzer/index.html` in the listing
+    mock_file_content = "".join([chr(index % 256) for index in range(4604)])
+
+
+class NoRestSession(SegmentSession):
+
+    def transfercmd(self, cmd, rest=None):
+        if rest is not None:
+            raise ftplib.error_perm("502 REST not implemented")
+        return SegmentSession.transfercmd(self, cmd)
+
+
+class ShortFileSession(SegmentSession):
+
+    mock_file_content = SegmentSession.mock_file_content[:3000]
+
+
+class FailingWorkerSession(mock_ftplib.MockSession):
+    """Allow only the login of the first session."""
+
+    sessions = []
+
+    def __init__(self, host='', user='', password=''):
+        if self.sessions:
+            raise ftplib.error_temp("421 too many connections")
+        mock_ftplib.MockSession.__init__(self, host, user, password)
+        self.sessions.append(self)
+
+
+class TreeSession(mock_ftplib.CountingSession):
+
+    dir_contents = {
+      '/home': """\
+drwxr-sr-x   2 45854    200           512 May  4  2000 tree""",
+
+      '/home/tree': """\
+drwxr-sr-x   2 45854    200           512 May  4  2000 a
+drwxr-sr-x   2 45854    200           512 May  4  2000 b
+-rw-r--r--   1 45854    200          4605 Jan 19  1970 f1
+lrwxrwxrwx   1 45854    200             1 Jan 19  2002 link -> a""",
+
+      '/home/tree/a': """\
+drwxr-sr-x   2 45854    200           512 May  4  2000 c
+-rw-r--r--   1 45854    200          4605 Jan 19  1970 f2""",
+
+      '/home/tree/a/c': "total 0",
+
+      '/home/tree/b': """\
+drwxr-sr-x   2 45854    200           512 May  4  2000 missing
+-rw-r--r--   1 45854    200          4605 Jan 19  1970 f3""",
+    }
+
+
+class FailingWorkerTreeSession(TreeSession):
+    """Allow only the login of the first session."""
+
+    sessions = []
+
+    def __init__(self, host='', user='', password=''):
+        if self.sessions:
+            raise ftplib.error_temp("421 too many connections")
+        TreeSession.__init__(self, host, user, password)
+
+
+class TestWalkParallel(unittest.TestCase):
+
+    def setUp(self):
+        mock_ftplib.CountingSession.reset()
+        self.host = test_base.ftp_host_factory(session_factory=TreeSession)
+        self.errors = []
+
+    def tearDown(self):
+        self.host.close()
+
+    def walk_parallel(self, **kwargs):
+        return list(self.host.walk_parallel("/home/tree",
+                                            onerror=self.errors.append,
+                                            **kwargs))
+
+    def test_ordered(self):
+        expected = list(test_base.ftp_host_factory(
+                          session_factory=TreeSession).walk(
+                          "/home/tree", onerror=self.errors.append))
+        self.assertEqual(len(expected), 4)
+        self.assertEqual(len(self.errors), 1)
+        self.assertEqual(self.walk_parallel(max_workers=3, ordered=True),
+                         expected)
+        self.assertEqual(len(self.errors), 2)
+        self.failUnless(isinstance(self.errors[1], ftp_error.PermanentError))
+
+    def test_unordered(self):
+        result = self.walk_parallel(max_workers=3)
+        result.sort()
+        self.assertEqual(result,
+          [("/home/tree", ["a", "b", "link"], ["f1"]),
+           ("/home/tree/a", ["c"], ["f2"]),
+           ("/home/tree/a/c", [], []),
+           ("/home/tree/b", ["missing"], ["f3"])])
+        # Listing "/home/tree/b/missing" failed.
+        self.assertEqual(len(self.errors), 1)
+
+    def test_relative_top(self):
+        self.host.chdir("/home")
+        result = list(self.host.walk_parallel("tree", ordered=True))
+        self.assertEqual([item[0] for item in result],
+                         ["tree", "tree/a", "tree/a/c", "tree/b"])
+
+    def test_pruning(self):
+        result = []
+        for dirpath, dirnames, filenames in self.host.walk_parallel(
+                                              "/home/tree"):
+            result.append(dirpath)
+            if "a" in dirnames:
+                dirnames.remove("a")
+        result.sort()
+        self.assertEqual(result, ["/home/tree", "/home/tree/b"])
+
+    def test_listings_are_cached(self):
+        self.walk_parallel()
+        main_session = self.host._session
+        dir_count = main_session.count('dir')
+        self.assertEqual(self.host.listdir("/home/tree/a"), ["c", "f2"])
+        self.failUnless(self.host.path.isfile("/home/tree/a/f2"))
+        self.assertEqual(self.host.listdir("/home/tree/a/c"), [])
+        self.assertEqual(main_session.count('dir'), dir_count)
+
+    def test_items_classified_from_listing(self):
+        # Without caches, only the links need further listings of the
+        #  main session.
+        self.host.stat_cache.disable()
+        self.host.listing_cache.disable()
+        self.walk_parallel(max_workers=2)
+        # "/home" to check "/home/tree", "/home/tree" itself and two
+        #  listings to resolve "/home/tree/link"
+        self.assertEqual(self.host._session.count('dir'), 4)
+
+    def test_failed_logins(self):
+        # If no worker can log in, the host's own session is used.
+        FailingWorkerTreeSession.sessions = []
+        host = test_base.ftp_host_factory(
+                 session_factory=FailingWorkerTreeSession)
+        result = list(host.walk_parallel("/home/tree", ordered=True))
+        self.assertEqual([item[0] for item in result],
+          ["/home/tree", "/home/tree/a", "/home/tree/a/c", "/home/tree/b"])
+        host.close()
+
+    def test_sessions(self):
+        self.walk_parallel(max_workers=2)
+        # The first listing is fetched with the host's session.
+        sessions = mock_ftplib.CountingSession.sessions
+        self.failUnless(2 <= len(sessions) <= 1 + 2)
+        for session in sessions[1:]:
+            self.failUnless(session.closed)
+        self.assertEqual(self.host._children, [])
+
+
+class TestBatchTransfers(unittest.TestCase):
+
+    def setUp(self):
+        mock_ftplib.CountingSession.reset()
+        self.host = test_base.ftp_host_factory(
+                      session_factory=mock_ftplib.CountingSession)
+        self.local_files = []
+
+    def tearDown(self):
+        self.host.close()
+        for name in self.local_files:
+            if os.path.exists(name):
+                os.remove(name)
+
+    def make_local_files(self, count):
+        """Make `count` local files and return their names."""
+        for index in range(count):
+            name = "__test_source_%d" % index
+            local_file = open(name, 'w')
+            local_file.write("line %d\n" % index)
+            local_file.close()
+            self.local_files.append(name)
+        return self.local_files[:]
+
+    def test_upload_many(self):
+        sources = self.make_local_files(6)
+        pairs = [(source, "batch_target_%d" % index)
+                 for index, source in enumerate(sources)]
+        calls = []
+        def callback(source, target, copied):
+            calls.append((source, target, copied,
+                          threading.currentThread().getName()))
+        copied = self.host.upload_many(pairs, callback=callback,
+                                       max_workers=3)
+        self.assertEqual(copied, pairs)
+        for index in range(6):
+            self.assertEqual(
+              mock_ftplib.content_of("batch_target_%d" % index),
+              "line %d\r\n" % index)
+        # The callback is called in the calling thread.
+        main_thread = threading.currentThread().getName()
+        calls.sort()
+        self.assertEqual(calls, [(source, target, True, main_thread)
+                                 for source, target in pairs])
+        # One session for the host itself and at most one for each
+        #  worker, no child sessions
+        sessions = mock_ftplib.CountingSession.sessions
+        self.failUnless(2 <= len(sessions) <= 1 + 3)
+        self.assertEqual(self.host._children, [])
+        for session in sessions[1:]:
+            self.failUnless(session.closed)
+
+    def test_fewer_files_than_workers(self):
+        sources = self.make_local_files(2)
+        pairs = [(source, "batch_target_%d" % index)
+                 for index, source in enumerate(sources)]
+        self.host.upload_many(pairs, max_workers=10)
+        self.failUnless(len(mock_ftplib.CountingSession.sessions) <= 1 + 2)
+
+    def test_no_files(self):
+        self.assertEqual(self.host.upload_many([]), [])
+        self.assertEqual(len(mock_ftplib.CountingSession.sessions), 1)
+
+    def test_invalid_max_workers(self):
+        sources = self.make_local_files(1)
+        self.assertRaises(ValueError, self.host.upload_many,
+                          [(sources[0], "target")], max_workers=0)
+
+    def test_upload_invalidates_cache(self):
+        sources = self.make_local_files(1)
+        self.host.lstat("/home/older")
+        self.failUnless("/home/older" in self.host.stat_cache)
+        self.host.chdir("/home")
+        self.host.upload_many([(sources[0], "older")])
+        self.failIf("/home/older" in self.host.stat_cache)
+
+    def use_download_session(self):
+        """Replace `self.host` with a host for download tests."""
+        self.host.close()
+        self.host = test_base.ftp_host_factory(
+                      session_factory=DownloadSession)
+
+    def test_download_many(self):
+        self.use_download_session()
+        targets = ["__test_target_%d" % index for index in range(3)]
+        self.local_files.extend(targets)
+        pairs = [("/home/older", targets[0]), ("/home/newer", targets[1]),
+                 ("/home/sschwarzer/index.html", targets[2])]
+        copied = self.host.download_many(pairs, mode='b', max_workers=2)
+        self.assertEqual(copied, pairs)
+        for target in targets:
+            data = open(target, 'rb').read()
+            self.assertEqual(data, "downloaded data")
+
+    def test_conditional_download(self):
+        self.use_download_session()
+        # The local target of the first pair doesn't exist, the target
+        #  of the second pair is newer than the remote file.
+        targets = ["__test_target_0", "__test_target_1"]
+        self.local_files.extend(targets)
+        open(targets[1], 'w').close()
+        now = time.time()
+        os.utime(targets[1], (now, now))
+        pairs = [("/home/older", targets[0]), ("/home/older", targets[1])]
+        calls = []
+        def callback(source, target, copied):
+            calls.append((target, copied))
+        copied = self.host.download_many(pairs, mode='b', callback=callback,
+                                         conditional=True)
+        self.assertEqual(copied, pairs[:1])
+        calls.sort()
+        self.assertEqual(calls, [(targets[0], True), (targets[1], False)])
+        self.assertEqual(open(targets[1]).read(), "")
+
+    def test_failed_transfers(self):
+        targets = ["__test_target_%d" % index for index in range(3)]
+        self.local_files.extend(targets)
+        # The mock session refuses to download "notthere".
+        pairs = [("/home/older", targets[0]), ("/home/notthere", targets[1]),
+                 ("/home/newer", targets[2])]
+        try:
+            self.host.download_many(pairs, max_workers=2)
+        except ftp_error.BatchTransferError, exc:
+            self.assertEqual(len(exc.errors), 1)
+            source, target, error = exc.errors[0]
+            self.assertEqual((source, target), pairs[1])
+            self.failUnless(isinstance(error, ftp_error.FTPIOError))
+            self.assertEqual(exc.copied, [pairs[0], pairs[2]])
+        else:
+            self.fail("BatchTransferError not raised")
+
+    def test_failed_logins(self):
+        FailingWorkerSession.sessions = []
+        host = test_base.ftp_host_factory(
+                 session_factory=FailingWorkerSession)
+        sources = self.make_local_files(3)
+        pairs = [(source, "batch_target_%d" % index)
+                 for index, source in enumerate(sources)]
+        try:
+            host.upload_many(pairs, max_workers=2)
+        except ftp_error.BatchTransferError, exc:
+            self.assertEqual([error[:2] for error in exc.errors], pairs)
+            for source, target, error in exc.errors:
+                self.failUnless(isinstance(error, ftp_error.TemporaryError))
+            self.assertEqual(exc.copied, [])
+        else:
+            self.fail("BatchTransferError not raised")
+        host.close()
+
+
+class TestSegmentedDownload(unittest.TestCase):
+
+    source = "/home/sschwarzer/index.html"
+    target = "__test_target"
+
+    def setUp(self):
+        mock_ftplib.CountingSession.reset()
+
+    def tearDown(self):
+        if os.path.exists(self.target):
+            os.unlink(self.target)
+
+    def download(self, session_factory, **kwargs):
+        """
+        Download the source with `kwargs` and return a list of the
+        transfer commands of all sessions, sorted by offset.
+        """
+        host = test_base.ftp_host_factory(session_factory=session_factory)
+        try:
+            host.download(self.source, self.target, 'b', **kwargs)
+        finally:
+            host.close()
+        transfers = []
+        for session in mock_ftplib.CountingSession.sessions:
+            transfers.extend(session.transfers)
+        transfers.sort()
+        return transfers
+
+    def test_segments(self):
+        chunks = []
+        transfers = self.download(SegmentSession, segments=3,
+                                  segment_size=1000, callback=chunks.append,
+                                  verify=True)
+        self.assertEqual(transfers, [("RETR index.html", None),
+                                     ("RETR index.html", 1000),
+                                     ("RETR index.html", 2000),
+                                     ("RETR index.html", 3000),
+                                     ("RETR index.html", 4000)])
+        # The host itself and at most three children, one per thread
+        self.failUnless(len(mock_ftplib.CountingSession.sessions) <= 4)
+        self.assertEqual(open(self.target, 'rb').read(),
+                         SegmentSession.mock_file_content)
+        self.assertEqual(sum([len(chunk) for chunk in chunks]), 4604)
+
+    def test_segments_without_callback(self):
+        self.download(SegmentSession, segments=3, segment_size=1000)
+        self.assertEqual(open(self.target, 'rb').read(),
+                         SegmentSession.mock_file_content)
+
+    def test_copy_segment(self):
+        source_fobj = StringIO.StringIO("0123456789")
+        target_fobj = StringIO.StringIO("-" * 10)
+        results, stopped = Queue.Queue(), threading.Event()
+        ftp_batch._copy_segment(source_fobj, target_fobj, 2, 5, results,
+                                stopped, True)
+        self.assertEqual(target_fobj.getvalue(), "--01234---")
+        self.assertEqual(results.get_nowait(), ("chunk", "01234"))
+        # Without a callback, the chunks aren't queued.
+        ftp_batch._copy_segment(source_fobj, target_fobj, 7, 3, results,
+                                stopped, False)
+        self.assertEqual(target_fobj.getvalue(), "--01234567")
+        self.failUnless(results.empty())
+
+    def test_small_file(self):
+        # Below the default minimum segment size
+        transfers = self.download(SegmentSession, segments=3)
+        self.assertEqual(transfers, [("RETR index.html", None)])
+        self.assertEqual(open(self.target, 'rb').read(),
+                         SegmentSession.mock_file_content)
+
+    def test_server_without_rest(self):
+        transfers = self.download(NoRestSession, segments=3,
+                                  segment_size=1000)
+        self.assertEqual(transfers, [("RETR index.html", None)])
+        self.assertEqual(open(self.target, 'rb').read(),
+                         SegmentSession.mock_file_content)
+
+    def test_short_source(self):
+        self.assertRaises(ftp_error.FTPIOError, self.download,
+                          ShortFileSession, segments=2, segment_size=1000)
+
+    def test_invalid_arguments(self):
+        self.assertRaises(ValueError, self.download, SegmentSession,
+                          segments=2, resume=True)
+        self.assertRaises(ValueError, self.download, SegmentSession,
+                          segments=0)
+        self.assertRaises(ValueError, self.download, SegmentSession,
+                          segments=-1)
+        for segment_size in (0, -1000):
+            self.assertRaises(ValueError, self.download, SegmentSession,
+                              segments=2, segment_size=segment_size)
+            self.assertRaises(ValueError, self.download, SegmentSession,
+                              segments=1, segment_size=segment_size)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -211,6 +211,19 @@ class TestFileOperations(unittest.TestCase):
         host = test_base.ftp_host_factory()
         self.assertRaises(ftp_error.FTPIOError, host.file, 'notthere', 'r')
 
+    def test_rest_and_append(self):
+        """Test reading from an offset and appending."""
+        host = test_base.ftp_host_factory(session_factory=ReadMockSession)
+        input_ = host.file('dummy', 'rb', rest=5)
+        self.assertEqual(input_.read(), ReadMockSession.mock_file_content[5:])
+        input_.close()
+        output = host.file('dummy', 'ab')
+        output.close()
+        self.assertEqual(host._children[0]._session.transfers,
+                         [('RETR dummy', 5), ('APPE dummy', None)])
+        # Offsets are only supported in binary mode.
+        self.assertRaises(ftp_error.FTPIOError, host.file, 'dummy', 'r', 5)
+
 
 if __name__ == '__main__':
     unittest.main()
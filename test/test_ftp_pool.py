@@ -0,0 +1,135 @@
+# Copyright (C) 2010, Stefan Schwarzer <sschwarzer@sschwarzer.net>
+# See the file LICENSE for licensing terms.
+
+import ftplib
+import time
+import unittest
+
+import ftp_error
+
+import mock_ftplib
+import test_base
+
+
+class TestChildPool(unittest.TestCase):
+
+    def setUp(self):
+        self.host = test_base.ftp_host_factory(
+                      session_factory=mock_ftplib.CountingSession)
+        self.pool = self.host.child_pool
+
+    def open_files(self, count):
+        """Open `count` files and return them as a list."""
+        return [self.host.file("file%d" % i, 'w') for i in range(count)]
+
+    def test_lifo_reuse(self):
+        file1, file2, file3 = self.open_files(3)
+        file1.close()
+        # Make sure the close times differ.
+        time.sleep(0.01)
+        file3.close()
+        file_obj = self.host.file("new_file", 'w')
+        self.failUnless(file_obj is file3)
+        self.assertEqual(self.pool.misses, 3)
+        self.assertEqual(self.pool.hits, 1)
+        self.assertEqual(len(self.host._children), 3)
+        file_obj.close()
+        file2.close()
+
+    def test_no_pwd_for_recently_used_children(self):
+        file_obj, = self.open_files(1)
+        file_obj.close()
+        child_session = file_obj._session
+        # Opening a file itself may send `PWD` commands, so compare the
+        #  counts for a reuse without and with a check.
+        pwd_count = child_session.count('pwd')
+        self.host.file("new_file", 'w').close()
+        unchecked_pwd_count = child_session.count('pwd') - pwd_count
+        # Children idle for longer than `check_interval` are checked.
+        self.pool.check_interval = 0.0
+        pwd_count = child_session.count('pwd')
+        self.host.file("new_file", 'w').close()
+        self.assertEqual(child_session.count('pwd') - pwd_count,
+                         unchecked_pwd_count + 1)
+
+    def test_dead_child_is_evicted(self):
+        file_obj, = self.open_files(1)
+        file_obj.close()
+        def timed_out_pwd():
+            raise ftplib.error_temp("simulated timeout")
+        file_obj._session.pwd = timed_out_pwd
+        self.pool.check_interval = 0.0
+        new_file_obj = self.host.file("new_file", 'w')
+        self.failIf(new_file_obj is file_obj)
+        self.assertEqual(len(self.host._children), 1)
+        self.assertEqual(self.pool.evictions, 1)
+        new_file_obj.close()
+
+    def test_dead_recently_used_child_is_replaced(self):
+        file_obj, = self.open_files(1)
+        file_obj.close()
+        def closed_connection(*args):
+            raise ftplib.error_temp("421 connection closed")
+        file_obj._session.cwd = file_obj._session.pwd = closed_connection
+        # The child isn't checked before the reuse, but after the
+        #  failed open.
+        new_file_obj = self.host.file("/home/new_file", 'w')
+        self.failIf(new_file_obj is file_obj)
+        self.assertEqual(len(self.host._children), 1)
+        self.assertEqual(self.pool.evictions, 1)
+        self.assertEqual(self.pool.misses, 2)
+        new_file_obj.close()
+
+    def test_error_with_live_child(self):
+        file_obj, = self.open_files(1)
+        file_obj.close()
+        self.assertRaises(ftp_error.FTPIOError, self.host.file, "notthere")
+        # The child is alive, so the open isn't retried.
+        self.assertEqual(len(self.host._children), 1)
+        self.assertEqual(self.pool.evictions, 0)
+        self.assertEqual(self.pool.misses, 1)
+
+    def test_max_size(self):
+        self.pool.max_size = 2
+        files = self.open_files(3)
+        # All children are in use, so the pool has to grow temporarily.
+        self.assertEqual(len(self.host._children), 3)
+        for file_obj in files:
+            file_obj.close()
+        self.host.file("new_file", 'w').close()
+        self.assertEqual(len(self.host._children), 2)
+        self.assertEqual(self.pool.evictions, 1)
+
+    def test_idle_timeout(self):
+        self.pool.idle_timeout = 0.05
+        for file_obj in self.open_files(2):
+            file_obj.close()
+        self.pool.prune()
+        self.assertEqual(len(self.host._children), 2)
+        time.sleep(0.1)
+        self.pool.prune()
+        self.assertEqual(len(self.host._children), 0)
+        self.assertEqual(self.pool.evictions, 2)
+
+    def test_background_pruning(self):
+        self.pool.idle_timeout = 0.0
+        for file_obj in self.open_files(2):
+            file_obj.close()
+        self.pool.start_pruning(0.02)
+        try:
+            time.sleep(0.2)
+            self.assertEqual(len(self.host._children), 0)
+        finally:
+            self.pool.stop_pruning()
+
+    def test_close(self):
+        files = self.open_files(2)
+        files[0].close()
+        self.host.close()
+        self.assertEqual(self.host._children, [])
+        for file_obj in files:
+            self.failUnless(file_obj.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
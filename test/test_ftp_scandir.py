@@ -0,0 +1,113 @@
+# Copyright (C) 2010, Stefan Schwarzer <sschwarzer@sschwarzer.net>
+# See the file LICENSE for licensing terms.
+
+import unittest
+
+import ftp_error
+import ftp_stat
+
+import mock_ftplib
+import test_base
+
+
+class BrokenListingSession(mock_ftplib.CountingSession):
+    """Add a directory with a listing which can't be parsed."""
+
+    dir_contents = mock_ftplib.MockSession.dir_contents.copy()
+    dir_contents['/home/broken'] = """\
+-rw-r--r--   1 45854    200          4604 Jan 19 23:11 first
+-rw-r--r--   1 45854    200          4604 Jan 19 23:11 second
+this line can't be parsed"""
+
+
+class TestScandir(unittest.TestCase):
+
+    def setUp(self):
+        BrokenListingSession.reset()
+        self.host = test_base.ftp_host_factory(
+                      session_factory=BrokenListingSession)
+
+    def tearDown(self):
+        self.host.close()
+
+    def test_entries(self):
+        entries = list(self.host.scandir("/home/sschwarzer"))
+        self.assertEqual([entry.name for entry in entries],
+                         self.host.listdir("/home/sschwarzer"))
+        entries = dict([(entry.name, entry) for entry in entries])
+        self.assertEqual(entries["index.html"].path,
+                         "/home/sschwarzer/index.html")
+        self.failUnless(entries["index.html"].is_file())
+        self.failIf(entries["index.html"].is_dir())
+        self.assertEqual(entries["index.html"].stat().st_size, 4604)
+        self.failUnless(entries["chemeng"].is_dir())
+        self.failIf(entries["chemeng"].is_symlink())
+
+    def test_links(self):
+        entries = dict([(entry.name, entry)
+                        for entry in self.host.scandir("/home")])
+        # "link" points to a file.
+        link = entries["link"]
+        self.failUnless(link.is_symlink())
+        self.failUnless(link.is_file())
+        self.failIf(link.is_file(follow_symlinks=False))
+        self.failIf(link.is_dir())
+        self.assertEqual(link.stat().st_size, 4604)
+        self.assertEqual(link.stat(follow_symlinks=False)._st_target,
+                         "sschwarzer/index.html")
+        self.failUnless(entries["bad_link"].is_symlink())
+        self.failUnless(entries["sschwarzer"].is_dir(follow_symlinks=False))
+
+    def test_relative_path(self):
+        self.host.chdir("/home")
+        entries = list(self.host.scandir("sschwarzer"))
+        self.assertEqual(entries[0].path, "sschwarzer/chemeng")
+        self.failUnless(entries[0].is_dir())
+
+    def test_caches_are_populated(self):
+        list(self.host.scandir("/home/sschwarzer"))
+        self.assertEqual(BrokenListingSession.total_count('_list_transfer'), 1)
+        # The listing was read from a child session, which is free
+        #  again.
+        child = self.host._children[0]
+        self.failUnless(child._file.closed)
+        self.failUnless("/home/sschwarzer/index.html" in self.host.stat_cache)
+        self.failUnless("/home/sschwarzer" in self.host.listing_cache)
+        self.host.listdir("/home/sschwarzer")
+        self.failUnless(self.host.path.isfile("/home/sschwarzer/index.html"))
+        self.assertEqual(BrokenListingSession.total_count('dir'), 0)
+        # The next `scandir` uses the cached listing.
+        list(self.host.scandir("/home/sschwarzer"))
+        self.assertEqual(BrokenListingSession.total_count('_list_transfer'), 1)
+
+    def test_early_close(self):
+        entries = self.host.scandir("/home/sschwarzer")
+        entries.next()
+        entries.close()
+        self.assertRaises(StopIteration, entries.next)
+        self.failUnless(self.host._children[0]._file.closed)
+        # An incomplete listing isn't cached.
+        self.failIf("/home/sschwarzer" in self.host.listing_cache)
+
+    def test_lines_are_parsed_while_they_arrive(self):
+        entries = self.host.scandir("/home/broken")
+        self.assertEqual(entries.next().name, "first")
+        self.assertEqual(entries.next().name, "second")
+        self.assertRaises(ftp_error.ParserError, entries.next)
+        self.failUnless(self.host._children[0]._file.closed)
+        self.failIf("/home/broken" in self.host.listing_cache)
+
+    def test_parser_switching(self):
+        names = [entry.name for entry in self.host.scandir("/home/msformat")]
+        self.assertEqual(names,
+                         ["WindowsXP", "XPLaunch", "abcd.exe", "O2KKeys.exe"])
+        self.failUnless(isinstance(self.host._stat._parser,
+                                   ftp_stat.MSParser))
+
+    def test_missing_directory(self):
+        self.assertRaises(ftp_error.PermanentError, self.host.scandir,
+                          "/home/missing")
+
+
+if __name__ == '__main__':
+    unittest.main()
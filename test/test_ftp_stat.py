@@ -3,7 +3,13 @@
 
 from __future__ import division
 
+import calendar
+import ftplib
+import os
+import pickle
+import posixpath
 import stat
+import tempfile
 import time
 import unittest
 
@@ -11,9 +17,125 @@ import ftp_error
 import ftp_stat
 import ftputil
 
+import mock_ftplib
 import test_base
 
 
+class TreeSession(mock_ftplib.CountingSession):
+    """
+    Make the tree below `/home/sschwarzer` complete, so that it can
+    be walked without errors.
+    """
+
+    dir_contents = mock_ftplib.MockSession.dir_contents.copy()
+    dir_contents['/home'] = dir_contents['/home'] + """
+drwxr-sr-x   2 45854    200           512 May 29  2000 os2"""
+    for name in ('chemeng download image os2 publications '
+                 'python scios2').split():
+        dir_contents['/home/sschwarzer/' + name] = "total 0"
+    del name
+
+    def voidcmd(self, cmd):
+        if cmd.startswith('SITE CHMOD'):
+            return '200 ok'
+        return mock_ftplib.CountingSession.voidcmd(self, cmd)
+
+
+class RecursiveListSession(TreeSession):
+    """Support recursive listings with `LIST -R`."""
+
+    def dir(self, path, callback=None):
+        if path != '-R':
+            TreeSession.dir(self, path, callback)
+            return
+        self._record('dir', path)
+        top = self.pwd()
+        dirs = [path for path in self.dir_contents
+                if path.startswith(top + '/')]
+        dirs.sort()
+        lines = self.dir_contents[top].split('\n')
+        for path in dirs:
+            lines.append("")
+            lines.append("./%s:" % path[len(top)+1:])
+            lines.extend(self.dir_contents[path].split('\n'))
+        for line in lines:
+            callback(line)
+
+
+class MLSDSession(mock_ftplib.MockSession):
+    """Mock session for a server which supports `MLSD` and `MLST`."""
+
+    mlsd_contents = {
+      '/home': [
+        "type=cdir;modify=20100101000000; /home",
+        "type=pdir;modify=20100101000000; ..",
+        "type=dir;modify=20000504000000;perm=flcdmpe; sschwarzer",
+        "type=file;size=4605;modify=19700119000000;perm=r; older",
+        "type=OS.unix=slink:sschwarzer;unix.mode=0777;"
+          "modify=20020119000000; link"],
+      '/home/sschwarzer': [
+        "type=file;size=4604;modify=20100119231101.25;unix.mode=0644;"
+          "unix.owner=45854;unix.group=200; index.html",
+        "type=dir;modify=20000529000000;unix.mode=0755; python",
+        "type=OS.unix=symlink;unix.mode=0777; unknown_target",
+        "type=file;size=10;unix.mode=0644; no_mtime"],
+      '/': [
+        "type=dir;modify=20000504000000;perm=el; home"],
+      }
+
+    features = """\
+211-Features:
+ MDTM
+ MLST type*;size*;modify*;perm*;unix.mode*;
+ SIZE
+211 End"""
+
+    def __init__(self, host='', user='', password=''):
+        mock_ftplib.MockSession.__init__(self, host, user, password)
+        self.commands = []
+
+    def sendcmd(self, cmd):
+        self.commands.append(cmd)
+        if cmd == 'FEAT':
+            return self.features
+        elif cmd.startswith('MLST'):
+            path = self._transform_path(cmd[5:])
+            if path == '/':
+                return "250-Listing /\n type=dir;perm=el; /\n250 End"
+            dirname, basename = posixpath.split(path)
+            for line in self.mlsd_contents.get(dirname, []):
+                if line.endswith(' ' + basename):
+                    return "250-Listing %s\n %s\n250 End" % (path, line)
+            raise ftplib.error_perm("550 %s: no such file" % path)
+        return mock_ftplib.MockSession.sendcmd(self, cmd)
+
+    def retrlines(self, cmd, callback):
+        self.commands.append(cmd)
+        path = self._transform_path(cmd[5:])
+        if path not in self.mlsd_contents:
+            raise ftplib.error_perm("550 %s: no such directory" % path)
+        for line in self.mlsd_contents[path]:
+            callback(line)
+
+    def dir(self, path, callback=None):
+        self.commands.append('LIST')
+        mock_ftplib.MockSession.dir(self, path, callback)
+
+
+class BaseParseLinesParser(ftp_stat.UnixParser):
+    """Unix parser with the default `parse_lines` implementation."""
+
+    parse_lines = ftp_stat.Parser.parse_lines.im_func
+
+
+class NoLinksParser(ftp_stat.UnixParser):
+    """Unix parser which ignores the lines for links."""
+
+    def ignores_line(self, line):
+        return line.startswith("l") or \
+               ftp_stat.UnixParser.ignores_line(self, line)
+
+
 def test_stat():
     host = test_base.ftp_host_factory()
     stat = ftp_stat._Stat(host)
@@ -91,6 +213,58 @@ class TestParsers(unittest.TestCase):
         self._test_valid_lines(ftp_stat.UnixParser, lines,
                                expected_stat_results)
 
+    def test_valid_mlsd_lines(self):
+        parser = ftp_stat.MLSDParser()
+        stat_result = parser.parse_line(
+          "type=file;size=4604;modify=20100119231101.25;unix.mode=0644;"
+          "unix.owner=45854;unix.group=200; index.html", time_shift=3600.0)
+        self.assertEqual(list(stat_result),
+          [stat.S_IFREG | 0644, None, None, None, '45854', '200', 4604, None,
+           calendar.timegm((2010, 1, 19, 23, 11, 1)) + 0.25 + 3600.0,
+           None])
+        self.assertEqual(stat_result._st_name, "index.html")
+        self.assertEqual(stat_result._st_target, None)
+        self.assertEqual(stat_result._st_mtime_precision, 1.0)
+        # Names with spaces, mode from the "perm" fact
+        stat_result = parser.parse_line(
+          "Type=dir;Modify=20000504000000;Perm=flcdmpe; dir with spaces")
+        self.assertEqual(stat_result.st_mode, stat.S_IFDIR | 0700)
+        self.assertEqual(stat_result._st_name, "dir with spaces")
+        self.assertEqual(stat_result.st_size, None)
+        # Link
+        stat_result = parser.parse_line(
+          "type=OS.unix=slink:../os2;unix.mode=0777; osup")
+        self.assertEqual(stat_result.st_mode, stat.S_IFLNK | 0777)
+        self.assertEqual(stat_result._st_target, "../os2")
+        self.assertEqual(stat_result.st_mtime, None)
+        stat_result = parser.parse_line(
+          "type=OS.unix=symlink:/home/os2;unix.mode=0777; osup")
+        self.assertEqual(stat_result.st_mode, stat.S_IFLNK | 0777)
+        self.assertEqual(stat_result._st_target, "/home/os2")
+        # Links without a target
+        for type_ in ("OS.unix=symlink", "OS.unix=slink"):
+            stat_result = parser.parse_line("type=%s;perm=r; osup" % type_)
+            self.assertEqual(stat_result.st_mode, stat.S_IFLNK | 0400)
+            self.assertEqual(stat_result._st_target, None)
+
+    def test_ignored_mlsd_lines(self):
+        parser = ftp_stat.MLSDParser()
+        for line in ["type=cdir;modify=20100101000000; /home",
+                     "type=pdir; ..", ""]:
+            self.failUnless(parser.ignores_line(line))
+        self.failIf(parser.ignores_line("type=file; name"))
+
+    def test_invalid_mlsd_lines(self):
+        lines = [
+          "type=file;size=4604;modify=20100119231101;",
+          "size=4604; no_type",
+          "type=file;size=big; name",
+          "type=file;modify=2010; name",
+          "type=file;nofactvalue; name",
+          "type=file;unix.mode=rwx; name",
+          ]
+        self._test_invalid_lines(ftp_stat.MLSDParser, lines)
+
     def test_invalid_unix_lines(self):
         lines = [
           "total 14",
@@ -127,6 +301,90 @@ class TestParsers(unittest.TestCase):
         self._test_valid_lines(ftp_stat.UnixParser, lines,
                                expected_stat_results)
 
+    def test_fast_and_split_unix_parsing(self):
+        # `UnixParser.parse_line` uses a regular expression for common
+        #  lines and splits other lines; both must give the same results.
+        lines = [
+          "drwxr-sr-x   2 45854    200           512 May  4  2000 "
+            "chemeng link -> chemeng target",
+          "-rw-r--r--   1 45854    200          4604 Dec 19 23:11 index.html",
+          "-rw-r--r--   1 45854    200          4604 Jan  1 00:00 new year",
+          "lrwxrwxrwx   2 45854    200           512 May 29  2000 osup -> "
+            "../os2",
+          "-rw-r--r--   1 45854    200          4604 Dec 19 23:11 trailing  ",
+          "-rwsr-sr-t   1 45854    200          4604 Dec 19  2009 suid",
+          "drwxr-sr-x   2   200           512 May  4  2000 alternative",
+          "drwxr-sr-x   2 45854    200           512 Foo  4  2000 month",
+          "-rw-r--r--   1 45854    200          4605 Jan 19  1970 a -> b -> c",
+          "xrw-r--r--   1 45854    200          4605 Jan 19  1970 file_type",
+          ]
+        for listing in mock_ftplib.MockSession.dir_contents.values():
+            lines.extend(listing.splitlines())
+        parser = ftp_stat.UnixParser()
+        matched_lines = 0
+        for line in lines:
+            if parser._line_regex.match(line):
+                matched_lines += 1
+            for time_shift in (0.0, 3600.0, -7200.0):
+                try:
+                    fast_result = parser.parse_line(line, time_shift)
+                except ftp_error.ParserError:
+                    fast_result = ftp_error.ParserError
+                try:
+                    split_result = parser._parse_line_parts(
+                                     parser._split_line(line), time_shift)
+                except ftp_error.ParserError:
+                    split_result = ftp_error.ParserError
+                if fast_result is ftp_error.ParserError:
+                    self.assertEqual(split_result, fast_result)
+                    continue
+                self.assertEqual(fast_result, split_result)
+                for attribute in ('_st_name', '_st_target',
+                                  '_st_mtime_precision'):
+                    self.assertEqual(getattr(fast_result, attribute),
+                                     getattr(split_result, attribute))
+        # Make sure that the regular expression is actually used.
+        self.failUnless(matched_lines > len(lines) // 2)
+
+    def test_current_year_change(self):
+        current_year = ftp_stat._CurrentYear()
+        end_of_2009 = time.mktime( (2009, 12, 31, 23, 59, 59, 0, 0, -1) )
+        self.assertEqual(current_year.year(end_of_2009), 2009)
+        self.assertEqual(current_year.year(end_of_2009 + 1), 2010)
+        self.assertEqual(current_year.year(end_of_2009), 2009)
+
+    def test_parse_lines(self):
+        # `parse_lines` gives the same results as `parse_line` for
+        #  each line which isn't ignored.
+        lines = ["total 14",
+          "drwxr-sr-x   2 45854    200           512 May  4  2000 chemeng",
+          "-rw-r--r--   1 45854    200          4604 Dec 19 23:11 index.html",
+          "drwxr-sr-x   2   200           512 May  4  2000 alternative",
+          "lrwxrwxrwx   2 45854    200           512 May 29  2000 osup -> "
+            "../os2"]
+        for parser in (ftp_stat.UnixParser(), BaseParseLinesParser()):
+            stat_results = parser.parse_lines(lines, 3600.0)
+            self.assertEqual(len(stat_results), 4)
+            for line, stat_result in zip(lines[1:], stat_results):
+                expected = parser.parse_line(line, 3600.0)
+                self.assertEqual(stat_result, expected)
+                self.assertEqual(stat_result._st_name, expected._st_name)
+        self.assertEqual(ftp_stat.UnixParser().parse_lines([]), [])
+        self.assertRaises(ftp_error.ParserError,
+                          ftp_stat.UnixParser().parse_lines,
+                          lines + ["invalid line"])
+        # An overridden `ignores_line` is used for all lines.
+        stat_results = NoLinksParser().parse_lines(lines, 3600.0)
+        self.assertEqual([stat_result._st_name
+                          for stat_result in stat_results],
+                         ["chemeng", "index.html", "alternative"])
+        # MLSD lines for the current and parent directory are ignored.
+        stat_results = ftp_stat.MLSDParser().parse_lines(
+                         ["type=cdir; .", "type=pdir; ..",
+                          "type=file;size=3; file"])
+        self.assertEqual([stat_result._st_name
+                          for stat_result in stat_results], ["file"])
+
     def test_valid_ms_lines(self):
         lines = [
           "07-27-01  11:16AM       <DIR>          Test",
@@ -234,6 +492,75 @@ class TestParsers(unittest.TestCase):
         self._test_time_shift(-3 * 60 * 60, 60)
 
 
+class TestStatResult(unittest.TestCase):
+
+    values = (stat.S_IFREG | 0644, None, None, 1, "user", "group",
+              4604, None, 1261264260.0, None)
+
+    def stat_result(self):
+        stat_result = ftp_stat.StatResult(self.values)
+        stat_result._st_name = "index.html"
+        stat_result._st_mtime_precision = 60
+        return stat_result
+
+    def test_tuple_compatibility(self):
+        stat_result = self.stat_result()
+        self.assertEqual(len(stat_result), 10)
+        self.assertEqual(stat_result[6], 4604)
+        self.assertEqual(stat_result[-2], 1261264260.0)
+        self.assertEqual(stat_result[stat.ST_MODE], stat.S_IFREG | 0644)
+        self.assertEqual(stat_result[4:6], ("user", "group"))
+        self.assertEqual(tuple(stat_result), self.values)
+        self.failUnless(stat_result == self.values)
+        self.failUnless(self.values == stat_result)
+        self.failIf(stat_result != self.values)
+        self.failIf(stat_result == self.values[:9])
+        self.failIf(stat_result == 1)
+        self.assertEqual(hash(stat_result), hash(self.values))
+        self.assertEqual(repr(stat_result), repr(self.values))
+        mode, ino, dev, nlink, uid, gid, size, atime, mtime, ctime = \
+          stat_result
+        self.assertEqual(uid, "user")
+        self.assertRaises(IndexError, lambda: stat_result[10])
+        self.assertRaises(IndexError, lambda: stat_result[-11])
+        self.failUnless("group" in stat_result)
+        self.failIf("other" in stat_result)
+        self.assertEqual(stat_result.count(None), 4)
+        self.assertEqual(stat_result.index("group"), 5)
+        self.assertEqual(stat_result + (1,), self.values + (1,))
+        self.assertEqual((1,) + stat_result, (1,) + self.values)
+        # Ordering like tuples
+        smaller_values = self.values[:6] + (4603,) + self.values[7:]
+        self.failUnless(smaller_values < stat_result)
+        self.failUnless(stat_result > smaller_values)
+        self.failUnless(stat_result >= self.values)
+        self.failUnless(stat_result <= self.stat_result())
+        self.assertEqual(sorted([stat_result, smaller_values]),
+                         [smaller_values, stat_result])
+        # Like a tuple, a `StatResult` isn't equal to a list.
+        self.failIf(stat_result == list(self.values))
+
+    def test_attributes(self):
+        stat_result = self.stat_result()
+        self.assertEqual(stat_result.st_size, 4604)
+        self.assertEqual(stat_result.st_mtime, 1261264260.0)
+        self.assertEqual(stat_result._st_name, "index.html")
+        self.assertEqual(stat_result._st_target, None)
+        self.assertRaises(AttributeError, getattr, stat_result, "st_foo")
+        # Only the declared attributes can be set.
+        self.assertRaises(AttributeError, setattr, stat_result, "foo", 1)
+        self.failIf(hasattr(stat_result, "__dict__"))
+
+    def test_pickling(self):
+        stat_result = self.stat_result()
+        for protocol in (0, 2):
+            unpickled = pickle.loads(pickle.dumps(stat_result, protocol))
+            self.assertEqual(unpickled, stat_result)
+            self.assertEqual(unpickled._st_name, "index.html")
+            self.assertEqual(unpickled._st_target, None)
+            self.assertEqual(unpickled._st_mtime_precision, 60)
+
+
 class TestLstatAndStat(unittest.TestCase):
     """
     Test `FTPHost.lstat` and `FTPHost.stat` (test currently only
@@ -381,6 +708,442 @@ class TestListdir(unittest.TestCase):
             self.failUnless(file in remote_file_list)
 
 
+class TestListingCache(unittest.TestCase):
+    """Test the caching of directory listings."""
+
+    def setUp(self):
+        self.host = test_base.ftp_host_factory(
+                      session_factory=TreeSession)
+
+    def dir_count(self):
+        """Return the number of `DIR` commands sent to the server."""
+        return self.host._session.count('dir')
+
+    def test_listdir_uses_cached_listing(self):
+        self.host.listdir("/home/sschwarzer")
+        dir_count = self.dir_count()
+        # The second `listdir` call doesn't even need the `isdir` check.
+        self.host.stat_cache.clear()
+        files = self.host.listdir("/home/sschwarzer")
+        self.assertEqual(self.dir_count(), dir_count)
+        self.assertEqual(files, ['chemeng', 'download', 'image',
+          'index.html', 'os2', 'osup', 'publications', 'python', 'scios2'])
+
+    def test_lstat_of_child_uses_cached_listing(self):
+        self.host.listdir("/home/sschwarzer")
+        dir_count = self.dir_count()
+        # Simulate eviction of the lstat results.
+        self.host.stat_cache.clear()
+        stat_result = self.host.lstat("/home/sschwarzer/index.html")
+        self.assertEqual(stat_result.st_size, 4604)
+        self.failUnless(self.host.path.isdir("/home/sschwarzer/os2"))
+        self.failUnless(self.host.path.exists("/home/sschwarzer/osup"))
+        self.assertEqual(self.dir_count(), dir_count)
+
+    def test_walk_lists_each_directory_once(self):
+        list(self.host.walk("/home/sschwarzer"))
+        dir_count = self.dir_count()
+        self.host.stat_cache.clear()
+        list(self.host.walk("/home/sschwarzer"))
+        self.assertEqual(self.dir_count(), dir_count)
+
+    def test_walk_with_disabled_caches(self):
+        expected = list(self.host.walk("/home/sschwarzer"))
+        walked_dirs = []
+        self.host.path.walk("/home/sschwarzer",
+          lambda arg, top, names: walked_dirs.append((top, names)), None)
+        host = test_base.ftp_host_factory(session_factory=TreeSession)
+        host.stat_cache.disable()
+        host.listing_cache.disable()
+        self.assertEqual(list(host.walk("/home/sschwarzer")), expected)
+        # One listing for each of the eight directories in the tree
+        #  (`/home/sschwarzer` is the current directory, so it's known
+        #  to be a directory) and two to find out that the link `osup`
+        #  points to a directory
+        self.assertEqual(host._session.count('dir'), 8 + 2)
+        host = test_base.ftp_host_factory(session_factory=TreeSession)
+        host.stat_cache.disable()
+        host.listing_cache.disable()
+        host_walked_dirs = []
+        host.path.walk("/home/sschwarzer",
+          lambda arg, top, names: host_walked_dirs.append((top, names)), None)
+        self.assertEqual(host_walked_dirs, walked_dirs)
+        # `path.walk` doesn't follow links.
+        self.assertEqual(host._session.count('dir'), 8)
+
+    def test_subtree_invalidation(self):
+        list(self.host.walk("/home/sschwarzer"))
+        self.failUnless("/home/sschwarzer/python" in self.host.listing_cache)
+        self.host.rename("/home/sschwarzer", "/home/sschwarzer2")
+        self.failIf("/home/sschwarzer/python" in self.host.listing_cache)
+        self.failIf("/home/sschwarzer/index.html" in self.host.stat_cache)
+        self.failIf("/home" in self.host.listing_cache)
+        list(self.host.walk("/home/sschwarzer"))
+        self.host.rmtree("/home/sschwarzer/python")
+        self.failIf("/home/sschwarzer/python" in self.host.stat_cache)
+        self.failIf("/home/sschwarzer" in self.host.listing_cache)
+        self.failUnless("/home/sschwarzer/index.html" in self.host.stat_cache)
+
+    def test_disabled_listing_cache(self):
+        self.host.listing_cache.disable()
+        self.host.listdir("/home/sschwarzer")
+        dir_count = self.dir_count()
+        self.host.listdir("/home/sschwarzer")
+        self.assertEqual(self.dir_count(), dir_count + 1)
+
+    def _assert_listing_invalidated(self, operation, *args):
+        """
+        Check that `operation`, called with `args`, invalidates the
+        cached listing of `/home/sschwarzer`.
+        """
+        self.host.listdir("/home/sschwarzer")
+        self.failUnless("/home/sschwarzer" in self.host.listing_cache)
+        operation(*args)
+        self.failIf("/home/sschwarzer" in self.host.listing_cache)
+
+    def test_invalidation(self):
+        host = self.host
+        self._assert_listing_invalidated(host.mkdir, "/home/sschwarzer/new")
+        self._assert_listing_invalidated(host.rmdir,
+                                         "/home/sschwarzer/python")
+        self._assert_listing_invalidated(host.remove,
+                                         "/home/sschwarzer/index.html")
+        self._assert_listing_invalidated(host.rename,
+          "/home/sschwarzer/index.html", "/home/sschwarzer/index2.html")
+        self._assert_listing_invalidated(host.rename,
+          "/home/older", "/home/sschwarzer/older")
+        self._assert_listing_invalidated(host.chmod,
+                                         "/home/sschwarzer/index.html", 0644)
+        self._assert_listing_invalidated(
+          lambda path: host.file(path, 'w').close(),
+          "/home/sschwarzer/index.html")
+
+
+class IgnoredRecursiveListSession(TreeSession):
+    """Ignore the `-R` option of `LIST`."""
+
+    def dir(self, path, callback=None):
+        if path == '-R':
+            path = self.pwd()
+        TreeSession.dir(self, path, callback)
+
+
+class TestScanTree(unittest.TestCase):
+    """Test filling the caches with recursive listings."""
+
+    def test_split_recursive_listing(self):
+        host = test_base.ftp_host_factory()
+        lines = [".:", "total 1", "-rw-r--r-- 1 a b 1 Jan 19 23:11 file", "",
+                 "./sub dir:", "total 0", "", "/abs/dir:"]
+        self.assertEqual(host._stat._split_recursive_listing("/top", lines),
+          [("/top", ["total 1", "-rw-r--r-- 1 a b 1 Jan 19 23:11 file"]),
+           ("/top/sub dir", ["total 0"]), ("/abs/dir", [])])
+        # The listing of `top` may come without a header.
+        self.assertEqual(host._stat._split_recursive_listing("/top",
+                           lines[1:]),
+                         host._stat._split_recursive_listing("/top", lines))
+        # A first line ending in a colon is only a header if it names
+        #  the top directory.
+        lines = ["-rw-r--r-- 1 a b 1 Jan 19 23:11 file:", "",
+                 "./sub:", "total 0"]
+        self.assertEqual(host._stat._split_recursive_listing("/top", lines),
+          [("/top", lines[:1]), ("/top/sub", ["total 0"])])
+        self.assertEqual(host._stat._split_recursive_listing("/top",
+                           ["/top:", "total 0"]), [("/top", ["total 0"])])
+
+    def test_walk_after_scan_tree(self):
+        expected = list(test_base.ftp_host_factory(
+                          session_factory=TreeSession).walk(
+                            "/home/sschwarzer"))
+        host = test_base.ftp_host_factory(
+                 session_factory=RecursiveListSession)
+        host.scan_tree("/home/sschwarzer")
+        self.assertEqual(host._session.count('dir'), 1)
+        self.failUnless(host.path.isfile("/home/sschwarzer/index.html"))
+        self.assertEqual(host.listdir("/home/sschwarzer/python"), [])
+        self.assertEqual(host._session.count('dir'), 1)
+        self.assertEqual(list(host.walk("/home/sschwarzer")), expected)
+        # Only the link `osup`, which points outside of the tree,
+        #  needs another listing.
+        self.assertEqual(host._session.count('dir'), 2)
+
+    def test_tree_without_subdirectories(self):
+        host = test_base.ftp_host_factory(
+                 session_factory=RecursiveListSession)
+        host.scan_tree("/home/sschwarzer/chemeng")
+        # The listing of the parent directory to check the top
+        #  directory and the recursive listing, which isn't repeated
+        self.assertEqual(host._session.count('dir'), 2)
+        self.assertEqual(host.listdir("/home/sschwarzer/chemeng"), [])
+        self.assertEqual(host._session.count('dir'), 2)
+        self.failUnless(host._stat._use_recursive_listing)
+
+    def test_ignored_recursive_option(self):
+        host = test_base.ftp_host_factory(
+                 session_factory=IgnoredRecursiveListSession)
+        host.scan_tree("/home/sschwarzer")
+        # The recursive listing gives the listing of the top directory,
+        #  so one listing less than for a rejected `LIST -R`
+        #  (see `test_fallback`)
+        self.assertEqual(host._session.count('dir'), (1 + 7 + 2) - 1)
+        self.failUnless("/home/sschwarzer/python" in host.listing_cache)
+
+    def test_fallback(self):
+        host = test_base.ftp_host_factory(session_factory=TreeSession)
+        host.scan_tree("/home/sschwarzer")
+        # The rejected `LIST -R` and one listing for each directory
+        #  but the current one
+        self.assertEqual(host._session.count('dir'), 1 + 7 + 2)
+        self.failIf(host._stat._use_recursive_listing)
+        self.failUnless("/home/sschwarzer/python" in host.listing_cache)
+        # `LIST -R` isn't tried again.
+        host.listing_cache.clear()
+        host.stat_cache.clear()
+        host.scan_tree("/home/sschwarzer")
+        self.assertEqual(host._session.count('dir'), 2 * (1 + 7 + 2) - 1)
+
+    def test_scan_tree_of_file(self):
+        host = test_base.ftp_host_factory(
+                 session_factory=RecursiveListSession)
+        self.assertRaises(ftp_error.PermanentError, host.scan_tree,
+                          "/home/sschwarzer/index.html")
+
+
+class TestColumnarListing(unittest.TestCase):
+    """Test the column-based storage of large directory listings."""
+
+    def setUp(self):
+        self.host = test_base.ftp_host_factory(
+                      session_factory=TreeSession)
+        self.host.listing_cache.columnar_threshold = 1
+
+    def dir_count(self):
+        """Return the number of `DIR` commands sent to the server."""
+        return self.host._session.count('dir')
+
+    def assert_same_stat_results(self, stat_results, expected_stat_results):
+        self.assertEqual(len(stat_results), len(expected_stat_results))
+        for stat_result, expected in zip(stat_results,
+                                         expected_stat_results):
+            self.assertEqual(stat_result, expected)
+            for attribute in ('_st_name', '_st_target',
+                              '_st_mtime_precision'):
+                self.assertEqual(getattr(stat_result, attribute),
+                                 getattr(expected, attribute))
+
+    def test_stat_results(self):
+        lines = mock_ftplib.MockSession.dir_contents['/home/sschwarzer']
+        stat_results = ftp_stat.UnixParser().parse_lines(lines.splitlines())
+        ms_stat_results = ftp_stat.MSParser().parse_lines([
+          "07-27-01  11:16AM       <DIR>          Test",
+          "07-17-00  02:08PM             12266720 test.exe"])
+        mlsd_stat_results = ftp_stat.MLSDParser().parse_lines(
+                              MLSDSession.mlsd_contents['/home'])
+        # Values which don't fit into the columns
+        unusual = ftp_stat.StatResult((0644, 17, None, 1, "user", "group",
+                                       2**60 + 1, None, None, None))
+        unusual._st_name = "unusual"
+        stat_results = stat_results + ms_stat_results + \
+                       mlsd_stat_results + [unusual]
+        listing = ftp_stat._ColumnarListing(stat_results[:3])
+        listing.extend(stat_results[3:])
+        self.assertEqual(len(listing), len(stat_results))
+        self.assertEqual(listing.names(), [stat_result._st_name
+                                           for stat_result in stat_results])
+        self.assert_same_stat_results(list(listing), stat_results)
+        self.assert_same_stat_results([listing.get("osup")],
+                                      [stat_results[5]])
+        self.failUnless(listing.get("unusual") is unusual)
+        self.failUnless("test.exe" in listing)
+        self.failIf("missing" in listing)
+        self.assertEqual(listing.get("missing"), None)
+
+    def test_listdir_lstat_and_walk(self):
+        expected_walk = list(test_base.ftp_host_factory(
+                               session_factory=TreeSession).walk(
+                               "/home/sschwarzer"))
+        files = self.host.listdir("/home/sschwarzer")
+        self.failUnless(isinstance(
+                          self.host.listing_cache["/home/sschwarzer"],
+                          ftp_stat._ColumnarListing))
+        # The items aren't put into the stat cache ...
+        self.failIf("/home/sschwarzer/index.html" in self.host.stat_cache)
+        # ... but are still available without listing the directory
+        #  again.
+        dir_count = self.dir_count()
+        self.assertEqual(files, ['chemeng', 'download', 'image',
+          'index.html', 'os2', 'osup', 'publications', 'python', 'scios2'])
+        stat_result = self.host.lstat("/home/sschwarzer/index.html")
+        self.assertEqual(stat_result.st_size, 4604)
+        self.assertEqual(stat_result._st_mtime_precision, 60)
+        self.assertEqual(self.host.lstat("/home/sschwarzer/osup")._st_target,
+                         "../os2")
+        self.failUnless(self.host.path.isdir("/home/sschwarzer/os2"))
+        self.failIf(self.host.path.exists("/home/sschwarzer/missing"))
+        self.assertEqual(self.dir_count(), dir_count)
+        self.assertEqual(list(self.host.walk("/home/sschwarzer")),
+                         expected_walk)
+
+    def test_threshold(self):
+        self.host.listing_cache.columnar_threshold = 1000
+        self.host.listdir("/home/sschwarzer")
+        self.failUnless(isinstance(
+                          self.host.listing_cache["/home/sschwarzer"],
+                          ftp_stat._Listing))
+        self.failUnless("/home/sschwarzer/index.html" in self.host.stat_cache)
+
+
+class TestMissingPathCache(unittest.TestCase):
+    """Test the caching of missing paths."""
+
+    def setUp(self):
+        self.host = test_base.ftp_host_factory(
+                      session_factory=TreeSession)
+
+    def dir_count(self):
+        """Return the number of `DIR` commands sent to the server."""
+        return self.host._session.count('dir')
+
+    def test_missing_paths_in_cached_listing(self):
+        path = self.host.path
+        self.failIf(path.exists("/home/sschwarzer/notthere1"))
+        dir_count = self.dir_count()
+        self.failIf(path.exists("/home/sschwarzer/notthere2"))
+        self.failIf(path.isfile("/home/sschwarzer/notthere3"))
+        self.failIf(path.isdir("/home/sschwarzer/notthere4"))
+        self.assertRaises(ftp_error.PermanentError, self.host.lstat,
+                          "/home/sschwarzer/notthere5")
+        self.assertEqual(self.dir_count(), dir_count)
+
+    def test_missing_path_without_listing_cache(self):
+        self.host.listing_cache.disable()
+        self.failIf(self.host.path.exists("/home/sschwarzer/notthere"))
+        dir_count = self.dir_count()
+        self.failIf(self.host.path.exists("/home/sschwarzer/notthere"))
+        self.assertEqual(self.dir_count(), dir_count)
+        # A different missing path needs a new listing.
+        self.failIf(self.host.path.exists("/home/sschwarzer/notthere2"))
+        self.assertEqual(self.dir_count(), dir_count + 1)
+
+    def test_max_age(self):
+        self.host.listing_cache.disable()
+        self.failIf(self.host.path.exists("/home/sschwarzer/notthere"))
+        dir_count = self.dir_count()
+        self.host.stat_cache.max_age = 1
+        time.sleep(1.1)
+        self.failIf(self.host.path.exists("/home/sschwarzer/notthere"))
+        self.assertEqual(self.dir_count(), dir_count + 1)
+
+    def test_invalidation(self):
+        host = self.host
+        host.listing_cache.disable()
+        for operation, path in [
+          (host.mkdir, "/home/sschwarzer/newdir"),
+          (lambda path: host.file(path, 'w').close(),
+           "/home/sschwarzer/newfile")]:
+            self.failIf(host.path.exists(path))
+            self.failUnless(path in host.stat_cache)
+            operation(path)
+            self.failIf(path in host.stat_cache)
+        self.failIf(host.path.exists("/home/sschwarzer/renamed"))
+        host.rename("/home/sschwarzer/index.html", "/home/sschwarzer/renamed")
+        self.failIf("/home/sschwarzer/renamed" in host.stat_cache)
+
+
+class TestMLSD(unittest.TestCase):
+
+    def setUp(self):
+        self.host = test_base.ftp_host_factory(session_factory=MLSDSession)
+        self.session = self.host._session
+
+    def test_lstat_uses_mlst(self):
+        stat_result = self.host.lstat("/home/sschwarzer/index.html")
+        self.assertEqual(stat_result.st_size, 4604)
+        self.assertEqual(stat_result.st_mode, stat.S_IFREG | 0644)
+        self.assertEqual(stat_result._st_mtime_precision, 1.0)
+        self.assertEqual(stat_result._st_name, "index.html")
+        self.assertEqual(self.session.commands[0], 'FEAT')
+        # No listing of the parent directory
+        self.assertEqual([command for command in self.session.commands
+                          if command.startswith('MLST')],
+                         ['MLST index.html'])
+        self.failIf('MLSD' in self.session.commands)
+        self.failIf('LIST' in self.session.commands)
+        # The features are only requested once.
+        self.host.lstat("/home/older")
+        self.assertEqual(self.session.commands.count('FEAT'), 1)
+
+    def test_missing_path(self):
+        self.assertRaises(ftp_error.PermanentError, self.host.lstat,
+                          "/home/sschwarzer/notthere")
+        self.failIf(self.host.path.exists("/home/sschwarzer/notthere"))
+
+    def test_root_dir(self):
+        self.failUnless(self.host.path.isdir("/"))
+        self.failUnless(stat.S_ISDIR(self.host.lstat("/").st_mode))
+
+    def test_listdir_uses_mlsd(self):
+        self.assertEqual(self.host.listdir("/home"),
+                         ["sschwarzer", "older", "link"])
+        # The listing of the parent is used for the items.
+        commands = self.session.commands[:]
+        self.failUnless(self.host.path.isdir("/home/sschwarzer"))
+        self.failUnless(self.host.path.islink("/home/link"))
+        self.assertEqual(self.host.stat("/home/link").st_mode,
+                         stat.S_IFDIR | 0700)
+        self.assertEqual(self.session.commands, commands)
+        self.failIf('LIST' in self.session.commands)
+
+    def test_link_without_target(self):
+        path = "/home/sschwarzer/unknown_target"
+        self.failUnless(self.host.path.islink(path))
+        # The link can't be followed.
+        self.assertEqual(self.host.stat(path).st_mode, stat.S_IFLNK | 0777)
+        self.failIf(self.host.path.isdir(path))
+        self.failIf(self.host.path.isfile(path))
+
+    def test_missing_modification_time(self):
+        path = "/home/sschwarzer/no_mtime"
+        stat_result = self.host.lstat(path)
+        self.assertEqual(stat_result.st_mtime, None)
+        self.assertEqual(stat_result._st_mtime_precision, 24 * 60 * 60)
+        # Without a modification time, the file is transferred in
+        #  any case.
+        local_path = tempfile.mktemp()
+        local_file = open(local_path, 'wb')
+        local_file.write("data")
+        local_file.close()
+        try:
+            self.failUnless(self.host.upload_if_newer(local_path, path))
+            self.failUnless(self.host.download_if_newer(path, local_path))
+        finally:
+            os.unlink(local_path)
+
+    def test_set_parser_disables_mlsd(self):
+        self.host.set_parser(ftp_stat.UnixParser())
+        self.host.listdir("/home/sschwarzer")
+        self.failIf('FEAT' in self.session.commands)
+        self.failUnless('LIST' in self.session.commands)
+
+    def test_set_mlsd(self):
+        self.host.listdir("/home")
+        self.host.set_mlsd(False)
+        self.failUnless(isinstance(self.host._stat._parser,
+                                   ftp_stat.UnixParser))
+        self.host.listdir("/home/sschwarzer")
+        self.failUnless('LIST' in self.session.commands)
+        self.host.set_mlsd(True)
+        self.assertEqual(self.host.listdir("/home"),
+                         ["sschwarzer", "older", "link"])
+        self.assertEqual(self.session.commands.count('FEAT'), 2)
+
+    def test_no_feat_support(self):
+        host = test_base.ftp_host_factory(session_factory=TreeSession)
+        host.lstat("/home/sschwarzer/index.html")
+        self.assertEqual(host._session.count('dir'), 1)
+        self.failIf(host._stat._use_mlsd)
+
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -1,12 +1,18 @@
 # Copyright (C) 2006, Stefan Schwarzer <sschwarzer@sschwarzer.net>
 # See the file LICENSE for licensing terms.
 
+import os
+import tempfile
+import threading
 import time
 import unittest
 
+import ftp_cache_backend
 import ftp_error
+import ftp_stat
 import ftp_stat_cache
 
+import mock_ftplib
 import test_base
 
 
@@ -33,6 +39,32 @@ class TestStatCache(unittest.TestCase):
         self.cache.clear()
         self.assertEqual(len(self.cache), 0)
 
+    def test_invalidate_tree(self):
+        for path in ("/", "/a", "/a/b", "/a/b/c", "/a/bc", "/a/d/e", "/ab"):
+            self.cache[path] = "test"
+        self.cache.invalidate_tree("/a/b")
+        self.assertEqual(sorted(self.cache._cache), ["/", "/a", "/a/bc",
+                                                     "/a/d/e", "/ab"])
+        # Paths whose parents aren't in the cache are found, too.
+        self.cache.invalidate_tree("/a")
+        self.assertEqual(sorted(self.cache._cache), ["/", "/ab"])
+        self.cache.invalidate_tree("/missing")
+        self.cache.invalidate_tree("/")
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache._index, {})
+        self.assertEqual(self.cache._index_size, 0)
+
+    def test_index_is_rebuilt(self):
+        self.cache.resize(10)
+        for i in xrange(5000):
+            self.cache["/dir%d/file" % i] = i
+        # The index holds the paths in the cache and at most about
+        #  1000 removed ones, and their parents.
+        self.failUnless(self.cache._index_size <= 2 * (10 + 1001))
+        self.cache.invalidate_tree("/dir4999")
+        self.failIf("/dir4999/file" in self.cache)
+        self.failUnless("/dir4998/file" in self.cache)
+
     def test_contains(self):
         self.cache["path1"] = "test1"
         self.assertEqual("path1" in self.cache, True)
@@ -96,6 +128,238 @@ class TestStatCache(unittest.TestCase):
         self.assertEqual(items[:3], ['chemeng', 'download', 'image'])
 
 
+class TestBackend(unittest.TestCase):
+    """Test the stat and listing caches with a persistent backend."""
+
+    def setUp(self):
+        handle, self.filename = tempfile.mkstemp(".db")
+        os.close(handle)
+        try:
+            self.backend = ftp_cache_backend.SqliteCacheBackend(self.filename)
+        except ImportError:
+            # No `sqlite3` module before Python 2.5
+            self.backend = None
+
+    def tearDown(self):
+        if self.backend is not None:
+            self.backend.close()
+        os.remove(self.filename)
+
+    def test_write_through_and_load(self):
+        if self.backend is None:
+            return
+        cache = ftp_stat_cache.StatCache()
+        cache.set_backend(self.backend, "host stat")
+        cache["/path1"] = ("stat", "result")
+        cache.clear_memory()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache["/path1"], ("stat", "result"))
+        # The entry is in memory again.
+        self.assertEqual(len(cache), 1)
+        # Other namespaces are independent.
+        other_cache = ftp_stat_cache.StatCache()
+        other_cache.set_backend(self.backend, "other_host stat")
+        self.failIf("/path1" in other_cache)
+        # Invalidation removes the entry from the backend, too.
+        cache.invalidate("/path1")
+        self.failIf("/path1" in cache)
+
+    def test_max_age_of_loaded_entries(self):
+        if self.backend is None:
+            return
+        cache = ftp_stat_cache.StatCache()
+        cache.set_backend(self.backend, "host stat")
+        self.backend.store("host stat", "/old", time.time() - 100, "old")
+        cache["/new"] = "new"
+        cache.clear_memory()
+        cache.max_age = 50
+        self.failIf("/old" in cache)
+        self.assertEqual(self.backend.load("host stat", "/old"), None)
+        self.assertEqual(cache["/new"], "new")
+        # The age of a loaded entry counts from the original storage.
+        self.backend.store("host stat", "/older", time.time() - 40, "older")
+        self.assertEqual(cache["/older"], "older")
+        self.failUnless(cache._age("/older") >= 40)
+
+    def test_default_max_age_of_loaded_entries(self):
+        if self.backend is None:
+            return
+        cache = ftp_stat_cache.StatCache()
+        cache.set_backend(self.backend, "host stat")
+        now = time.time()
+        self.backend.store("host stat", "/old", now - 2 * 60 * 60, "old")
+        self.backend.store("host stat", "/new", now - 60, "new")
+        self.failIf("/old" in cache)
+        self.assertEqual(cache["/new"], "new")
+        cache.clear_memory()
+        cache.backend_max_age = None
+        self.backend.store("host stat", "/old", now - 2 * 60 * 60, "old")
+        self.assertEqual(cache["/old"], "old")
+
+    def test_clear(self):
+        if self.backend is None:
+            return
+        cache = ftp_stat_cache.StatCache()
+        cache.set_backend(self.backend, "host stat")
+        cache["/path"] = "value"
+        cache.clear()
+        self.failIf("/path" in cache)
+        self.assertEqual(self.backend.load("host stat", "/path"), None)
+
+    def test_set_parser_clears_backend(self):
+        if self.backend is None:
+            return
+        host = test_base.ftp_host_factory(
+                 session_factory=mock_ftplib.CountingSession)
+        host.set_cache_backend(self.backend)
+        host.listdir("/home/sschwarzer")
+        host.set_parser(ftp_stat.UnixParser())
+        # The listing isn't loaded from the backend again.
+        host.listdir("/home/sschwarzer")
+        self.assertEqual(host._session.count('dir'), 2)
+        host.close()
+
+    def test_persistence_across_hosts(self):
+        if self.backend is None:
+            return
+        host = test_base.ftp_host_factory()
+        host.set_cache_backend(self.backend)
+        host.listdir("/home/sschwarzer")
+        host.close()
+        self.backend.close()
+        # Simulate a new process.
+        self.backend = ftp_cache_backend.SqliteCacheBackend(self.filename)
+        host = test_base.ftp_host_factory()
+        host.set_cache_backend(self.backend)
+        host._session.dir = None
+        self.assertEqual(host.listdir("/home/sschwarzer")[:3],
+                         ['chemeng', 'download', 'image'])
+        self.assertEqual(host.lstat("/home/sschwarzer/index.html").st_size,
+                         4604)
+
+    def test_missing_path_across_hosts(self):
+        if self.backend is None:
+            return
+        missing = "/home/sschwarzer/missing"
+        host = test_base.ftp_host_factory()
+        host.set_cache_backend(self.backend)
+        self.failIf(host.path.exists(missing))
+        host.close()
+        host = test_base.ftp_host_factory()
+        host.set_cache_backend(self.backend)
+        # Entries loaded from the backend
+        self.failIf(host.path.exists(missing))
+        self.failIf(host.path.isfile(missing))
+        self.assertRaises(ftp_error.PermanentError, host.lstat, missing)
+        host.close()
+
+    def test_invalidate_tree(self):
+        if self.backend is None:
+            return
+        cache = ftp_stat_cache.StatCache()
+        cache.set_backend(self.backend, "host stat")
+        for path in ("/a", "/a/b", "/a/b/c", "/a/bc"):
+            cache[path] = "test"
+        cache.invalidate_tree("/a/b")
+        cache.clear_memory()
+        self.failUnless("/a" in cache)
+        self.failUnless("/a/bc" in cache)
+        self.failIf("/a/b" in cache)
+        self.failIf("/a/b/c" in cache)
+
+    def test_unusable_entries(self):
+        if self.backend is None:
+            return
+        self.backend._connection.execute(
+          "INSERT INTO entries VALUES ('host stat', '/path', 0.0, 'xyz')")
+        self.assertEqual(self.backend.load("host stat", "/path"), None)
+        self.backend._connection.execute("UPDATE format SET version = 0")
+        self.backend.store("host stat", "/path", 0.0, "value")
+        self.backend.close()
+        # Entries of another format version are removed.
+        self.backend = ftp_cache_backend.SqliteCacheBackend(self.filename)
+        self.assertEqual(self.backend.load("host stat", "/path"), None)
+
+
+class TestSharedCaches(unittest.TestCase):
+
+    def setUp(self):
+        mock_ftplib.CountingSession.reset()
+        self.host1 = test_base.ftp_host_factory(
+                       session_factory=mock_ftplib.CountingSession)
+        self.host2 = test_base.ftp_host_factory(
+                       session_factory=mock_ftplib.CountingSession)
+        self.host1.share_caches()
+        self.host2.share_caches()
+
+    def tearDown(self):
+        ftp_stat_cache.registry.remove(self.host1._cache_key())
+
+    def test_listings_are_shared(self):
+        self.failUnless(self.host1.stat_cache is self.host2.stat_cache)
+        self.failUnless(self.host1.listing_cache is self.host2.listing_cache)
+        self.host1.listdir("/home/sschwarzer")
+        self.host2.listdir("/home/sschwarzer")
+        self.failUnless(self.host2.path.isfile("/home/sschwarzer/index.html"))
+        self.assertEqual(mock_ftplib.CountingSession.total_count('dir'), 1)
+        # Invalidations are seen by the other host.
+        self.host1.remove("/home/sschwarzer/index.html")
+        self.failIf("/home/sschwarzer" in self.host2.listing_cache)
+        self.failIf("/home/sschwarzer/index.html" in self.host2.stat_cache)
+
+    def test_close_keeps_shared_caches(self):
+        self.host1.listdir("/home/sschwarzer")
+        self.host1.close()
+        self.failUnless("/home/sschwarzer" in self.host2.listing_cache)
+
+    def test_set_parser_unshares_caches(self):
+        shared_listing_cache = self.host1.listing_cache
+        self.host1.listdir("/home/sschwarzer")
+        self.host1.set_parser(ftp_stat.UnixParser())
+        self.failIf(self.host1.stat_cache is self.host2.stat_cache)
+        self.failIf(self.host1.listing_cache is shared_listing_cache)
+        self.failIf("/home/sschwarzer" in self.host1.listing_cache)
+        # The other host keeps the shared caches and their contents.
+        self.failUnless(self.host2.listing_cache is shared_listing_cache)
+        self.failUnless("/home/sschwarzer" in shared_listing_cache)
+        self.host2.listdir("/home/sschwarzer")
+        self.assertEqual(mock_ftplib.CountingSession.total_count('dir'), 1)
+        # The same for `set_mlsd`
+        self.host2.set_mlsd(False)
+        self.failIf(self.host2.listing_cache is shared_listing_cache)
+        self.failUnless("/home/sschwarzer" in shared_listing_cache)
+
+    def test_other_key(self):
+        host = test_base.ftp_host_factory()
+        host.share_caches(("other", 21, "user"))
+        try:
+            self.failIf(host.stat_cache is self.host1.stat_cache)
+            # Workers share the caches of their host.
+            worker = host._make_worker()
+            self.failUnless(worker.stat_cache is host.stat_cache)
+        finally:
+            ftp_stat_cache.registry.remove(("other", 21, "user"))
+
+    def test_concurrent_use(self):
+        cache = self.host1.stat_cache
+        cache.resize(50)
+        def use_cache(offset):
+            for i in xrange(2000):
+                path = "/%d" % ((i + offset) % 100)
+                cache[path] = i
+                path in cache
+                if i % 10 == 0:
+                    cache.invalidate(path)
+        threads = [threading.Thread(target=use_cache, args=(offset,))
+                   for offset in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.failUnless(len(cache) <= 50)
+        self.assertEqual(len(list(cache._cache)), len(cache))
+
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -4,10 +4,16 @@
 import os
 import shutil
 import sys
+import tempfile
+import time
 import unittest
 
+import ftp_error
 import ftp_sync
 
+import mock_ftplib
+import test_base
+
 
 # Assume the test subdirectories are or will be in the current directory
 TEST_ROOT = os.getcwd()
@@ -38,6 +44,263 @@ class TestLocalToLocal(unittest.TestCase):
         syncer.sync(source_dir, target_dir)
 
 
+class TestDeltaSync(unittest.TestCase):
+    """Test the comparison of source and target trees."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.root, "source")
+        self.target_dir = os.path.join(self.root, "target")
+        self.make_file("source/file1", "abc")
+        self.make_file("source/dir/file2", "defg")
+        self.syncer = ftp_sync.Syncer(ftp_sync.LocalHost(),
+                                      ftp_sync.LocalHost())
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def make_file(self, path, data, mtime=None):
+        """Make a file with the `data` below the temporary directory."""
+        path = os.path.join(self.root, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        fobj = open(path, "wb")
+        try:
+            fobj.write(data)
+        finally:
+            fobj.close()
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def target(self, *names):
+        return os.path.join(self.target_dir, *names)
+
+    def test_first_and_second_sync(self):
+        actions = self.syncer.sync(self.source_dir, self.target_dir)
+        self.assertEqual(actions,
+          [("mkdir", self.target_dir),
+           ("mkdir", self.target("dir")),
+           ("copy", os.path.join(self.source_dir, "dir", "file2"),
+            self.target("dir", "file2")),
+           ("copy", os.path.join(self.source_dir, "file1"),
+            self.target("file1"))])
+        self.assertEqual(open(self.target("dir", "file2")).read(), "defg")
+        # Nothing has changed since the first sync.
+        self.assertEqual(self.syncer.sync(self.source_dir, self.target_dir),
+                         [])
+
+    def test_changed_files(self):
+        self.syncer.sync(self.source_dir, self.target_dir)
+        # Another size
+        self.make_file("source/file1", "abcd")
+        # Same size, but newer than the target
+        self.make_file("source/dir/file2", "xyzw", time.time() + 10)
+        self.assertEqual(self.syncer.plan(self.source_dir, self.target_dir),
+          [("copy", os.path.join(self.source_dir, "dir", "file2"),
+            self.target("dir", "file2")),
+           ("copy", os.path.join(self.source_dir, "file1"),
+            self.target("file1"))])
+
+    def test_dry_run(self):
+        actions = self.syncer.sync(self.source_dir, self.target_dir,
+                                   dry_run=True)
+        self.assertEqual(len(actions), 4)
+        self.failIf(os.path.exists(self.target_dir))
+
+    def test_delete(self):
+        self.make_file("target/dir/file2", "defg")
+        self.make_file("target/dir/extra", "")
+        self.make_file("target/extra_dir/file", "")
+        # Extraneous items are kept unless `delete` is true.
+        self.assertEqual(self.syncer.plan(self.source_dir, self.target_dir),
+          [("copy", os.path.join(self.source_dir, "file1"),
+            self.target("file1"))])
+        actions = self.syncer.sync(self.source_dir, self.target_dir,
+                                   delete=True)
+        self.assertEqual(actions,
+          [("copy", os.path.join(self.source_dir, "file1"),
+            self.target("file1")),
+           ("delete", self.target("dir", "extra")),
+           ("delete", self.target("extra_dir"))])
+        self.assertEqual(sorted(os.listdir(self.target_dir)),
+                         ["dir", "file1"])
+        self.assertEqual(os.listdir(self.target("dir")), ["file2"])
+
+    def test_type_conflict(self):
+        self.make_file("target/dir", "")
+        self.assertRaises(ftp_error.SyncError, self.syncer.plan,
+                          self.source_dir, self.target_dir)
+        self.syncer.sync(self.source_dir, self.target_dir, delete=True)
+        self.failUnless(os.path.isfile(self.target("dir", "file2")))
+
+
+class RecordingLocalHost(ftp_sync.LocalHost):
+    """Record the opened source files and fail some opens."""
+
+    def __init__(self, failures=0):
+        self.opened = []
+        self.stated = []
+        # Number of errors to raise for files opened for writing
+        self.failures = failures
+        self.error = ftp_error.FTPIOError("connection broken")
+
+    def open(self, path, mode):
+        if mode == "rb":
+            self.opened.append(os.path.basename(path))
+        elif self.failures:
+            self.failures -= 1
+            raise self.error
+        return ftp_sync.LocalHost.open(self, path, mode)
+
+    def stat(self, path):
+        self.stated.append(os.path.basename(path))
+        return os.stat(path)
+
+
+class DownloadSession(mock_ftplib.MockSession):
+
+    mock_file_content = "downloaded data"
+    # Sessions made so far; appending to a list is thread-safe.
+    sessions = []
+
+    def __init__(self, host='', user='', password=''):
+        mock_ftplib.MockSession.__init__(self, host, user, password)
+        self.sessions.append(self)
+
+
+class TestTransferScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.pairs = []
+        for name, size in [("small", 1), ("big", 3), ("medium", 2)]:
+            path = os.path.join(self.root, name)
+            open(path, "wb").write("x" * size)
+            self.pairs.append((path, path + ".copy"))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_biggest_files_first(self):
+        source = RecordingLocalHost()
+        scheduler = ftp_sync.TransferScheduler(source, ftp_sync.LocalHost(),
+                                               max_workers=1)
+        progress = []
+        def callback(scheduler):
+            progress.append((scheduler.files_done, scheduler.bytes_copied))
+        self.assertEqual(scheduler.run(self.pairs, callback), self.pairs)
+        self.assertEqual(source.opened, ["big", "medium", "small"])
+        self.assertEqual(scheduler.bytes_total, 6)
+        self.assertEqual(progress, [(0, 3), (1, 3), (1, 5), (2, 5),
+                                    (2, 6), (3, 6)])
+        self.assertEqual(open(self.pairs[1][1], "rb").read(), "xxx")
+
+    def test_concurrent_transfers(self):
+        scheduler = ftp_sync.TransferScheduler(ftp_sync.LocalHost(),
+                                               ftp_sync.LocalHost())
+        self.assertEqual(scheduler.run(self.pairs), self.pairs)
+        self.assertEqual(scheduler.files_done, 3)
+        self.assertEqual(scheduler.run([]), [])
+
+    def test_retries(self):
+        target = RecordingLocalHost(failures=2)
+        scheduler = ftp_sync.TransferScheduler(ftp_sync.LocalHost(), target,
+                                               max_workers=1)
+        self.assertEqual(scheduler.run(self.pairs), self.pairs)
+        self.assertEqual(scheduler.bytes_copied, 6)
+        # Too many failures for the first (biggest) file
+        target.failures = 3
+        try:
+            scheduler.run(self.pairs)
+        except ftp_error.BatchTransferError, exc:
+            self.assertEqual([error[0] for error in exc.errors],
+                             [self.pairs[1][0]])
+            self.assertEqual(exc.copied, [self.pairs[0], self.pairs[2]])
+        else:
+            self.fail("BatchTransferError not raised")
+
+    def test_no_retries_for_permanent_errors(self):
+        for error in [ftp_error.PermanentError("550 permission denied"),
+                      ftp_error.FTPIOError("550 permission denied")]:
+            target = RecordingLocalHost(failures=1)
+            target.error = error
+            scheduler = ftp_sync.TransferScheduler(ftp_sync.LocalHost(),
+                                                   target, max_workers=1)
+            try:
+                scheduler.run(self.pairs)
+            except ftp_error.BatchTransferError, exc:
+                self.assertEqual(exc.errors,
+                                 [(self.pairs[1][0], self.pairs[1][1],
+                                   error)])
+            else:
+                self.fail("BatchTransferError not raised")
+        # Temporary errors are retried.
+        target = RecordingLocalHost(failures=1)
+        target.error = ftp_error.FTPIOError("421 too many connections")
+        scheduler = ftp_sync.TransferScheduler(ftp_sync.LocalHost(), target,
+                                               max_workers=1)
+        self.assertEqual(scheduler.run(self.pairs), self.pairs)
+
+    def test_cancel(self):
+        source = RecordingLocalHost()
+        scheduler = ftp_sync.TransferScheduler(source, ftp_sync.LocalHost(),
+                                               max_workers=1)
+        def open_(path, mode):
+            # Cancel during the second transfer.
+            if path.endswith("medium"):
+                scheduler.cancel()
+            return RecordingLocalHost.open(source, path, mode)
+        source.open = open_
+        self.assertEqual(scheduler.run(self.pairs), [self.pairs[1]])
+        self.failUnless(scheduler.cancelled())
+        self.assertEqual(scheduler.files_done, 1)
+        self.assertEqual(source.opened, ["big", "medium"])
+        self.failIf(os.path.exists(self.pairs[0][1]))
+
+    def test_connection_limit(self):
+        DownloadSession.sessions = []
+        host = test_base.ftp_host_factory(session_factory=DownloadSession)
+        try:
+            pairs = [(source, os.path.join(self.root, "copy%d" % index))
+                     for index, source in enumerate(["/home/older",
+                       "/home/newer", "/home/sschwarzer/index.html"])]
+            scheduler = ftp_sync.TransferScheduler(host, ftp_sync.LocalHost(),
+                                                   max_workers=3,
+                                                   max_connections=1)
+            self.assertEqual(scheduler.run(pairs), pairs)
+            self.assertEqual(open(pairs[2][1], "rb").read(),
+                             "downloaded data")
+            # The host itself and one worker
+            self.assertEqual(len(DownloadSession.sessions), 2)
+            self.failUnless(DownloadSession.sessions[1].closed)
+        finally:
+            host.close()
+        self.assertRaises(ValueError, ftp_sync.TransferScheduler, host, host,
+                          max_connections=1)
+
+    def test_syncer(self):
+        source_dir = os.path.join(self.root, "source")
+        target_dir = os.path.join(self.root, "target")
+        os.mkdir(source_dir)
+        for source, target in self.pairs:
+            os.rename(source, os.path.join(source_dir,
+                                           os.path.basename(source)))
+        for max_workers in (1, 2):
+            source = RecordingLocalHost()
+            syncer = ftp_sync.Syncer(source, ftp_sync.LocalHost(),
+                                     max_workers=max_workers)
+            syncer.sync(source_dir, target_dir)
+            self.assertEqual(sorted(os.listdir(target_dir)),
+                             ["big", "medium", "small"])
+            # The times for the copies are taken from the manifest, so
+            #  each source file is stat'ed only once.
+            self.assertEqual(sorted(source.stated),
+                             ["big", "medium", "small"])
+            # The copies got the times of the source files.
+            self.assertEqual(syncer.sync(source_dir, target_dir), [])
+            shutil.rmtree(target_dir)
+
+
 if __name__ == '__main__':
     unittest.main()
 
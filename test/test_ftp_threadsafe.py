@@ -0,0 +1,195 @@
+# Copyright (C) 2010, Stefan Schwarzer <sschwarzer@sschwarzer.net>
+# See the file LICENSE for licensing terms.
+
+import StringIO
+import sys
+import threading
+import time
+import unittest
+
+import ftp_error
+import ftp_threadsafe
+
+import mock_ftplib
+
+
+class SlowListingSession(mock_ftplib.CountingSession):
+
+    def dir(self, path, callback=None):
+        # Give other threads the chance to run.
+        time.sleep(0.01)
+        mock_ftplib.CountingSession.dir(self, path, callback)
+
+
+class TestThreadSafeFTPHost(unittest.TestCase):
+
+    def setUp(self):
+        SlowListingSession.reset()
+        self.host = ftp_threadsafe.ThreadSafeFTPHost(
+                      'dummy_host', 'dummy_user', 'dummy_password',
+                      session_factory=SlowListingSession)
+
+    def tearDown(self):
+        self.host.close()
+
+    def run_in_threads(self, function, count):
+        """Call `function` with the indices 0 to `count`-1 in threads."""
+        threads = [threading.Thread(target=function, args=(index,))
+                   for index in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_concurrent_operations(self):
+        self.host.max_sessions = 3
+        results = []
+        def list_dirs(index):
+            for path in ("/home/sschwarzer", "/home", "/"):
+                results.append(self.host.listdir(path))
+        self.run_in_threads(list_dirs, 8)
+        self.assertEqual(len(results), 3 * 8)
+        self.failUnless(['chemeng', 'download', 'image', 'index.html',
+                         'os2', 'osup', 'publications', 'python',
+                         'scios2'] in results)
+        self.failUnless(len(self.host._sessions) <= 3)
+        self.assertEqual(len(SlowListingSession.sessions),
+                         len(self.host._sessions))
+        # Listings are fetched at most once per session because of the
+        #  shared caches.
+        self.failUnless(SlowListingSession.total_count('dir') <= 3 * 3)
+
+    def test_current_directory_per_thread(self):
+        self.assertEqual(self.host.getcwd(), "/home/sschwarzer")
+        results = {}
+        def change_dir(index):
+            path = ["/home", "/home/sschwarzer/python", "/"][index]
+            self.host.chdir(path)
+            time.sleep(0.05)
+            results[index] = (self.host.getcwd(),
+                              self.host.path.abspath("file"))
+        self.run_in_threads(change_dir, 3)
+        self.assertEqual(results,
+          {0: ("/home", "/home/file"),
+           1: ("/home/sschwarzer/python", "/home/sschwarzer/python/file"),
+           2: ("/", "/file")})
+        # The directory of the main thread hasn't changed.
+        self.assertEqual(self.host.getcwd(), "/home/sschwarzer")
+        self.failUnless(self.host.path.isfile("index.html"))
+
+    def test_walk(self):
+        self.host.chdir("/home")
+        items = list(self.host.walk("sschwarzer"))
+        # The subdirectories of `/home/sschwarzer` aren't in the
+        #  mock session's listings.
+        self.assertEqual(items, [("sschwarzer",
+          ['chemeng', 'download', 'image', 'os2', 'publications', 'python',
+           'scios2'], ['index.html', 'osup'])])
+
+    def test_walk_lists_subdirectories_once(self):
+        self.host.stat_cache.disable()
+        self.host.listing_cache.disable()
+        list(self.host.walk("/home/sschwarzer"))
+        # "/home" to check "/home/sschwarzer", "/home/sschwarzer" itself,
+        #  one listing to resolve the link and one (failing) listing for
+        #  each of the seven subdirectories, but none of the parent
+        #  directory to check the subdirectories
+        self.assertEqual(SlowListingSession.total_count('dir'), 2 + 1 + 7)
+
+    def test_pure_path_functions(self):
+        # These don't need a session.
+        self.host._acquire = None
+        try:
+            path = self.host.path
+            self.assertEqual(path.join("/home", "file"), "/home/file")
+            self.assertEqual(path.basename("/home/file"), "file")
+            self.assertEqual(path.normpath("/home/../file"), "/file")
+        finally:
+            del self.host._acquire
+
+    def test_settings(self):
+        self.host.set_time_shift(3600.0)
+        self.assertEqual(self.host.time_shift(), 3600.0)
+        session = self.host._make_session()
+        try:
+            self.assertEqual(session.time_shift(), 3600.0)
+            self.failUnless(session.stat_cache is self.host.stat_cache)
+        finally:
+            session.close()
+
+    def test_close(self):
+        session = self.host._acquire()
+        self.host.close()
+        self.failIf(session.closed)
+        self.host._release(session)
+        self.failUnless(session.closed)
+        self.assertRaises(ValueError, self.host.listdir, "/home")
+
+
+class TestSubmit(unittest.TestCase):
+
+    def setUp(self):
+        SlowListingSession.reset()
+        self.host = ftp_threadsafe.ThreadSafeFTPHost(
+                      'dummy_host', 'dummy_user', 'dummy_password',
+                      session_factory=SlowListingSession)
+        self.host.max_sessions = 3
+
+    def tearDown(self):
+        self.host.close()
+
+    def test_many_operations(self):
+        futures = [self.host.submit("lstat", "/home/sschwarzer/index.html")
+                   for i in range(50)]
+        for future in futures:
+            self.assertEqual(future.result().st_size, 4604)
+        self.failUnless(len(self.host._workers) <= 3)
+        self.failUnless(len(SlowListingSession.sessions) <= 3)
+
+    def test_relative_paths(self):
+        self.host.chdir("/home")
+        future = self.host.submit("listdir", "sschwarzer")
+        self.assertEqual(future.result()[:2], ['chemeng', 'download'])
+
+    def test_exception(self):
+        future = self.host.submit("listdir", "/home/missing")
+        self.failUnless(isinstance(future.exception(),
+                                   ftp_error.PermanentError))
+        self.assertRaises(ftp_error.PermanentError, future.result)
+        self.assertRaises(AttributeError, self.host.submit, "missing")
+
+    def test_callback(self):
+        finished = []
+        future = self.host.submit("getcwd")
+        future.add_done_callback(finished.append)
+        self.failUnless(future.wait(5.0))
+        self.assertEqual(finished, [future])
+        # Callbacks for finished operations are called immediately.
+        future.add_done_callback(finished.append)
+        self.assertEqual(finished, [future, future])
+        self.assertEqual(future.result(), "/home/sschwarzer")
+
+    def test_raising_callback(self):
+        self.host.max_sessions = 1
+        def callback(future):
+            raise RuntimeError("error in callback")
+        stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+        try:
+            future = self.host.submit("getcwd")
+            future.add_done_callback(callback)
+            self.failUnless(future.wait(5.0))
+            # Also for a finished operation
+            future.add_done_callback(callback)
+            output = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+        self.failUnless("error in callback" in output)
+        # The worker still executes operations.
+        future = self.host.submit("getcwd")
+        self.failUnless(future.wait(5.0))
+        self.assertEqual(future.result(), "/home/sschwarzer")
+
+
+if __name__ == '__main__':
+    unittest.main()
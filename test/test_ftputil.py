@@ -94,6 +94,10 @@ d--x--x--x   5 staff        512 Oct  3  2000 usr"""}
 class BinaryDownloadMockSession(mock_ftplib.MockSession):
     mock_file_content = binary_data()
 
+class ResumeMockSession(mock_ftplib.MockSession):
+    # Same size as `/home/sschwarzer/index.html` in the listing
+    mock_file_content = binary_data()[:4604]
+
 class TimeShiftMockSession(mock_ftplib.MockSession):
     def delete(self, file_name):
         pass
@@ -347,6 +351,55 @@ class TestUploadAndDownload(unittest.TestCase):
         # Remove target file
         os.unlink(local_target)
 
+    def test_resumed_download(self):
+        """Test continuing an interrupted binary download."""
+        local_target = '__test_target'
+        data = ResumeMockSession.mock_file_content
+        fobj = open(local_target, 'wb')
+        fobj.write(data[:1000])
+        fobj.close()
+        host = test_base.ftp_host_factory(session_factory=ResumeMockSession)
+        try:
+            # The size checks use the cached listing.
+            host.listdir('/home/sschwarzer')
+            host._session.dir = None
+            host.download('/home/sschwarzer/index.html', local_target, 'b',
+                          resume=True, verify=True)
+            self.assertEqual(open(local_target, 'rb').read(), data)
+            self.assertEqual(host._children[0]._session.transfers,
+                             [('RETR index.html', 1000)])
+            # The file is complete, so nothing is transferred.
+            host.download('/home/sschwarzer/index.html', local_target, 'b',
+                          resume=True)
+            self.assertEqual(len(host._children[0]._session.transfers), 1)
+            self.assertRaises(ValueError, host.download,
+                              '/home/sschwarzer/index.html', local_target,
+                              resume=True)
+        finally:
+            os.unlink(local_target)
+
+    def test_resumed_upload(self):
+        """Test continuing an interrupted binary upload."""
+        local_source = '__test_source'
+        data = binary_data()[:6000]
+        fobj = open(local_source, 'wb')
+        fobj.write(data)
+        fobj.close()
+        host = test_base.ftp_host_factory()
+        try:
+            host.upload(local_source, '/home/sschwarzer/index.html', 'b',
+                        resume=True)
+            self.assertEqual(mock_ftplib.content_of('index.html'),
+                             data[4604:])
+            self.assertEqual(host._children[0]._session.transfers,
+                             [('APPE index.html', None)])
+            # The remote size in the mock listing doesn't change.
+            self.assertRaises(ftp_error.FTPIOError, host.upload,
+                              local_source, '/home/sschwarzer/index.html',
+                              'b', resume=True, verify=True)
+        finally:
+            os.unlink(local_source)
+
 
 class TestTimeShift(unittest.TestCase):
 
@@ -394,6 +447,85 @@ class TestTimeShift(unittest.TestCase):
         self.assertRaises(ftp_error.TimeShiftError, host.synchronize_times)
 
 
+class TestPathPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.host = test_base.ftp_host_factory(
+                      session_factory=mock_ftplib.CountingSession)
+        self.session = self.host._session
+
+    def test_robust(self):
+        self.assertEqual(self.host.path_policy(), 'robust')
+        self.host.mkdir("/home/newdir")
+        # Check login directory, change to parent, change back
+        self.assertEqual(self.session.calls('cwd'),
+          ["/home/sschwarzer", "/home", "/home/sschwarzer"])
+        self.assertEqual(self.session.calls('mkd'), ["newdir"])
+        self.assertEqual(self.host.round_trips_saved, 0)
+
+    def test_track(self):
+        self.host.set_path_policy('track')
+        self.host.mkdir("/home/newdir")
+        self.host.mkdir("/home/otherdir")
+        self.assertEqual(self.session.calls('cwd'), ["/home"])
+        self.assertEqual(self.session.calls('mkd'), ["newdir", "otherdir"])
+        self.assertEqual(self.host.round_trips_saved, 2 + 3)
+        # The current directory of the host didn't change.
+        self.assertEqual(self.host.getcwd(), "/home/sschwarzer")
+        # Relative paths are still relative to `getcwd()`.
+        self.host.mkdir("newdir")
+        self.assertEqual(self.session.calls('cwd')[-1], "/home/sschwarzer")
+        self.assertEqual(self.session.calls('mkd')[-1], "newdir")
+        self.host.chdir("/home")
+        self.host.mkdir("newdir")
+        self.assertEqual(self.session.calls('mkd')[-1], "newdir")
+        self.assertEqual(self.session.current_dir, "/home")
+
+    def test_chdir_after_tracked_command(self):
+        self.host.set_path_policy('track')
+        self.host.chdir("/home/sschwarzer")
+        self.host.mkdir("/home/newdir")
+        self.assertEqual(self.session.current_dir, "/home")
+        # The session is in another directory, so `chdir` must use an
+        #  absolute path.
+        self.host.chdir("python")
+        self.assertEqual(self.session.calls('cwd')[-1],
+                         "/home/sschwarzer/python")
+        self.assertEqual(self.host.getcwd(), "/home/sschwarzer/python")
+
+    def test_direct(self):
+        self.host.set_path_policy('direct')
+        self.host.mkdir("/home/newdir")
+        self.assertEqual(self.session.calls('cwd'), [])
+        self.assertEqual(self.session.calls('mkd'), ["/home/newdir"])
+        self.assertEqual(self.host.round_trips_saved, 3)
+        # Paths with whitespace are handled like with the "track" policy.
+        self.host.mkdir("/home/dir with spaces/newdir")
+        self.assertEqual(self.session.calls('cwd'), ["/home/dir with spaces"])
+        self.assertEqual(self.session.calls('mkd')[-1], "newdir")
+
+    def test_switch_back_to_robust(self):
+        self.host.set_path_policy('track')
+        self.host.mkdir("/home/newdir")
+        self.host.set_path_policy('robust')
+        self.assertEqual(self.session.current_dir, "/home/sschwarzer")
+        self.host.chdir("python")
+        self.assertEqual(self.session.current_dir,
+                         "/home/sschwarzer/python")
+
+    def test_invalid_policy(self):
+        self.assertRaises(ValueError, self.host.set_path_policy, 'fast')
+        self.assertEqual(self.host.path_policy(), 'robust')
+
+    def test_reused_child(self):
+        self.host.set_path_policy('track')
+        for i in range(2):
+            self.host.file("/home/older").close()
+        child_session = self.host._children[0]._session
+        self.assertEqual(child_session.calls('cwd'), ["/home"])
+        self.assertEqual(self.host.round_trips_saved, 1)
+
+
 if __name__ == '__main__':
     unittest.main()
     import __main__
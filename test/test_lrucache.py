@@ -0,0 +1,93 @@
+# Copyright (C) 2010, Stefan Schwarzer <sschwarzer@sschwarzer.net>
+# See the file LICENSE for licensing terms.
+
+import time
+import unittest
+
+import lrucache
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = lrucache.LRUCache(5)
+
+    def test_get_set(self):
+        self.assertRaises(lrucache.CacheKeyError, self.cache.__getitem__, 1)
+        self.cache[1] = "one"
+        self.assertEqual(self.cache[1], "one")
+        self.cache[1] = "ONE"
+        self.assertEqual(self.cache[1], "ONE")
+        self.assertEqual(len(self.cache), 1)
+
+    def test_discard_least_recently_used(self):
+        for i in range(5):
+            self.cache[i] = str(i)
+        # Use the oldest entry, so that 1 becomes the oldest one.
+        self.cache[0]
+        self.cache[5] = "5"
+        self.assertEqual(len(self.cache), 5)
+        self.failIf(1 in self.cache)
+        self.failUnless(0 in self.cache)
+        # Setting an existing entry counts as usage, too.
+        self.cache[2] = "two"
+        self.cache[6] = "6"
+        self.failIf(3 in self.cache)
+        self.failUnless(2 in self.cache)
+
+    def test_contains_doesnt_count_as_usage(self):
+        for i in range(5):
+            self.cache[i] = str(i)
+        self.failUnless(0 in self.cache)
+        self.cache[5] = "5"
+        self.failIf(0 in self.cache)
+
+    def test_delete(self):
+        for i in range(3):
+            self.cache[i] = str(i)
+        del self.cache[1]
+        self.assertEqual(len(self.cache), 2)
+        self.failIf(1 in self.cache)
+        self.assertRaises(lrucache.CacheKeyError, self.cache.__delitem__, 1)
+        self.assertEqual(list(self.cache), [0, 2])
+
+    def test_iteration_order(self):
+        for i in range(5):
+            self.cache[i] = str(i)
+        self.cache[2]
+        self.cache[0] = "zero"
+        self.assertEqual(list(self.cache), [1, 3, 4, 2, 0])
+        # The cache may be used while iterating over it.
+        for key in self.cache:
+            self.cache[key]
+        self.assertEqual(list(self.cache), [1, 3, 4, 2, 0])
+
+    def test_resize(self):
+        for i in range(5):
+            self.cache[i] = str(i)
+        self.cache[0]
+        self.cache.size = 2
+        self.assertEqual(list(self.cache), [4, 0])
+        self.cache.size = 0
+        self.assertEqual(len(self.cache), 0)
+        self.cache[1] = "1"
+        self.assertEqual(len(self.cache), 0)
+        self.assertRaises(ValueError, setattr, self.cache, "size", -1)
+
+    def test_mtime(self):
+        before = time.time()
+        self.cache[1] = "1"
+        mtime = self.cache.mtime(1)
+        self.failUnless(before <= mtime <= time.time())
+        # Reading doesn't change the modification time.
+        self.cache[1]
+        self.assertEqual(self.cache.mtime(1), mtime)
+        self.assertRaises(lrucache.CacheKeyError, self.cache.mtime, 2)
+        self.cache.set_mtime(1, 1000.0)
+        self.assertEqual(self.cache.mtime(1), 1000.0)
+        self.assertRaises(lrucache.CacheKeyError, self.cache.set_mtime, 2,
+                          1000.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -559,6 +559,8 @@ class TestFTPFiles(RealFTPTest):
         def timed_out_pwd():
             raise ftplib.error_temp("simulated timeout")
         file_obj1._host._session.pwd = timed_out_pwd
+        # Check the child session, even though it was used recently.
+        host.child_pool.check_interval = 0.0
         # Try to get a file - which shouldn't be the timed-out file.
         file_obj2 = host.open(REMOTE_FILENAME, 'rb')
         self.assert_(file_obj1 is not file_obj2)